@@ -0,0 +1,133 @@
+"""Admission control of accepted connections, before anything is read or sent"""
+
+
+import ipaddress
+from ctypes import c_double
+from multiprocessing.sharedctypes import RawArray
+from time import monotonic
+from zlib import crc32
+
+from NetHang import messages
+
+
+class BanList:
+    """Banned addresses and CIDR networks, IPv4 and IPv6.
+
+    Networks are kept as sets of network numbers by prefix length, so checking an
+    address takes one set lookup per prefix length in use, however many bans there
+    are. IPv4 addresses mapped to IPv6 are checked as IPv4."""
+
+    def __init__(self, entries=()):
+        # Network numbers by prefix length, for each IP version
+        self.networks = {4: {}, 6: {}}
+        self.count = 0
+        for entry in entries or ():
+            self.add(entry)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, entry):
+        """Ban an address or network, as "10.0.0.1" or "10.0.0.0/8"."""
+        network = ipaddress.ip_network(entry, strict=False)
+        shift = network.max_prefixlen - network.prefixlen
+        numbers = self.networks[network.version].setdefault(network.prefixlen, set())
+        number = int(network.network_address) >> shift
+        if number not in numbers:
+            numbers.add(number)
+            self.count += 1
+
+    def __contains__(self, address):
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        number = int(address)
+        for prefixlen, numbers in self.networks[address.version].items():
+            if number >> (address.max_prefixlen - prefixlen) in numbers:
+                return True
+        return False
+
+
+class RateLimiter:
+    """Token buckets of new connections by address, in shared memory.
+
+    Each bucket refills at rate connections per second, up to burst, and every
+    connection takes one token. Addresses hash to a fixed number of buckets shared
+    by all accept workers, so a flood is limited however the kernel spreads it, and
+    memory stays the same whatever the number of addresses. Addresses sharing a
+    bucket share its rate, which is only ever stricter. Buckets are updated without
+    a lock: workers racing on one bucket can let a connection more through."""
+
+    def __init__(self, rate, burst, slots=4096, clock=monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        # Slots are rounded up to a power of two, for masking hashes
+        self.slots = 1 << max(1, (slots - 1).bit_length())
+        # Tokens and time of the last update of each bucket, untouched ones are full
+        self.buckets = RawArray(c_double, 2 * self.slots)
+
+    def allow(self, address):
+        """Take a token for a new connection, returns False if none is left."""
+        index = 2 * (crc32(address.encode("latin-1")) & (self.slots - 1))
+        buckets = self.buckets
+        now = self.clock()
+        if buckets[index + 1] == 0.0:
+            tokens = self.burst
+        else:
+            refill = (now - buckets[index + 1]) * self.rate
+            tokens = min(self.burst, buckets[index] + refill)
+        allowed = tokens >= 1.0
+        buckets[index] = tokens - 1.0 if allowed else tokens
+        buckets[index + 1] = now
+        return allowed
+
+
+class Admission:
+    """The checks each accepted connection goes through, before its handshake.
+
+    Banned addresses (blacklisted), addresses connecting faster than their token
+    bucket allows (connection_rate, connection_burst), and connections past the
+    caps are refused. Caps are max_conn players and connections in a handshake, and
+    max_handshakes handshakes in progress on each accept worker. In cluster mode,
+    a full node lets new players through, to be sent to the least loaded node."""
+
+    def __init__(self, settings):
+        self.bans = BanList(settings.get("blacklisted"))
+        self.rates = None
+        if settings.get("connection_rate") is not None:
+            self.rates = RateLimiter(
+                settings["connection_rate"], settings.get("connection_burst") or 1
+            )
+        self.max_conn = settings.get("max_conn")
+        if settings.get("coordinator") is not None:
+            self.max_conn = None
+        self.max_handshakes = settings.get("max_handshakes") or settings.get("max_conn")
+
+    def check(self, address, connected, handshaking):
+        """Get the notice refusing a new connection, or None to let it in.
+
+        connected is the number of players, handshaking the number of connections
+        in a handshake, not counting the new one."""
+        if len(self.bans) and address in self.bans:
+            return messages.BANNED
+        if self.rates is not None and not self.rates.allow(address):
+            return messages.TOO_MANY_CONNECTIONS
+        if self.max_handshakes is not None and handshaking >= self.max_handshakes:
+            return messages.SERVER_FULL
+        if self.max_conn is not None and connected + handshaking >= self.max_conn:
+            return messages.SERVER_FULL
+        return None
+
+
+def refuse(client_socket, notice):
+    """Send the refusal notice if the socket takes it at once, then close it."""
+    client_socket.setblocking(False)
+    try:
+        client_socket.send(notice)
+    except OSError:
+        pass
+    client_socket.close()
@@ -0,0 +1,473 @@
+"""Asyncio engine for NetHangServer, serving every client from one event loop"""
+
+
+import asyncio
+import socket as so
+
+from NetHang import messages
+from NetHang.admission import Admission, refuse
+from NetHang.handshake import NICKNAME_LINE, REJOIN_LINE
+from NetHang.players import Player, PlayerList, generate_rejoin_code, send_all, send_to
+from NetHang.reader import LineReader
+from NetHang.rooms import GameHostPool, RoomList, is_room_name, parse_room_request
+from NetHang.spectators import Spectator
+from NetHang.timers import Timers
+from NetHang.util import prettify_time
+from NetHang.writer import Outbox
+
+
+class AsyncEngine:
+    """Runs accept, handshake, lobby chat and command dispatch as coroutines.
+
+    Behaves like the multiprocessing engine of NetHangServer, but there are no accept
+    worker processes and no polling: every client is a task waiting on its socket."""
+
+    def __init__(self, server):
+        self.settings = server.settings
+        self.game_class = server.game_class
+        self.server_socket = server.server_socket
+        self.metrics = server.metrics
+        self.sessions = server.sessions
+        # Refuses connections right after accepting, like the accept workers do
+        self.admission = Admission(self.settings)
+        self.handshaking = 0
+
+        self.players = PlayerList()
+        self.rooms = None
+        self.hosts = None
+        self.loop = None
+        self.outbox = None
+        self.timers = None
+
+        # Client tasks by socket, kept to cancel them when a player is replaced
+        self.tasks = {}
+        # Spectators by socket, watching one room each
+        self.spectators = {}
+        # Loop callback running the timers at their earliest deadline
+        self._timers_handle = None
+        # Loop callback sampling the loop lag, only scheduled while players are in
+        self._lag_handle = None
+
+    async def serve(self, stopping):
+        """Serve clients until stopping is readable."""
+        self.loop = asyncio.get_running_loop()
+        self.server_socket.setblocking(False)
+
+        # All output to players is non-blocking, slow clients get evicted
+        self.outbox = Outbox(
+            self.settings["send_high_water"],
+            on_pending=lambda socket: self.loop.add_writer(
+                socket, self.outbox.flush, socket
+            ),
+            on_drained=self.loop.remove_writer,
+            on_evict=lambda socket: self.loop.call_soon(self._evict, socket),
+            metrics=self.metrics,
+        )
+        self.players.outbox = self.outbox
+
+        # Each room has its own lobby countdown, chat and game, games run on the hosts
+        self.hosts = GameHostPool(
+            self.game_class,
+            self.settings["game_hosts"],
+            self.settings["command_policy"],
+            self.metrics,
+            self.settings.get("journal_dir"),
+        )
+
+        # Lobby countdowns are deadlines on the loop clock, like the other engine
+        self.timers = Timers(self.loop.time, on_change=self._arm_timers)
+        self.rooms = RoomList(
+            self.outbox,
+            self.settings["room_size"],
+            self.settings["lobby_time"],
+            self.timers,
+            self._start_game,
+            self._end_game,
+            self._close_room,
+        )
+        for host in self.hosts.hosts:
+            self.loop.add_reader(host, self.hosts.handle, host, self.rooms)
+
+        # Sessions are saved on joining, leaving and game end, then written behind
+        if self.sessions is not None:
+            self.sessions.start()
+
+        accept_task = self.loop.create_task(self._accept_clients())
+        stopped = self.loop.create_future()
+
+        def stop():
+            self.loop.remove_reader(stopping)
+            stopped.set_result(None)
+
+        # Nothing wakes the loop but sockets, timers and the stop signal
+        self.loop.add_reader(stopping, stop)
+        try:
+            await stopped
+        finally:
+            if self._timers_handle is not None:
+                self._timers_handle.cancel()
+            if self._lag_handle is not None:
+                self._lag_handle.cancel()
+            tasks = [accept_task, *self.tasks.values()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for host in self.hosts.hosts:
+                self.loop.remove_reader(host)
+            self.hosts.close()
+            for socket in self.players.get_sockets():
+                socket.close()
+            if self.sessions is not None:
+                self.sessions.close()
+
+    def _watch_lag(self):
+        if self._lag_handle is None:
+            self._lag_handle = self.loop.call_later(
+                0.1, self._sample_lag, self.loop.time() + 0.1
+            )
+
+    def _sample_lag(self, expected):
+        # Loop lag stands for the tick duration of the other engine, sampled each
+        # tenth of a second until the last player left, so an idle loop stays asleep
+        self._lag_handle = None
+        self._update_metrics(self.loop.time() - expected)
+        if self.players.count():
+            self._watch_lag()
+
+    def _update_metrics(self, lag):
+        self.metrics.tick_seconds.observe(lag)
+        if lag > 0.1:
+            self.metrics.tick_overruns.inc()
+        self.metrics.players.set(self.players.count())
+        self.metrics.spectators.set(len(self.spectators))
+        self.metrics.rooms.set(self.rooms.count())
+        self.metrics.active_games.set(sum(room.is_playing() for room in self.rooms))
+
+    async def _accept_clients(self):
+        while True:
+            client_socket, client_addr_port = await self.loop.sock_accept(
+                self.server_socket
+            )
+            self.metrics.accepted[0].inc()
+            notice = self.admission.check(
+                client_addr_port[0], self.players.count(), self.handshaking
+            )
+            if notice is not None:
+                refuse(client_socket, notice)
+                self.metrics.refused[0].inc()
+                continue
+            # Messages are small separate writes, not worth waiting to coalesce
+            client_socket.setsockopt(so.IPPROTO_TCP, so.TCP_NODELAY, 1)
+            self._track(
+                client_socket,
+                self.loop.create_task(self._client(client_socket, client_addr_port[0])),
+            )
+
+    def _track(self, socket, task):
+        self.tasks[socket] = task
+
+        def untrack(_):
+            if self.tasks.get(socket) is task:
+                del self.tasks[socket]
+
+        task.add_done_callback(untrack)
+
+    async def _send(self, socket, data):
+        await self.loop.sock_sendall(socket, data)
+
+    async def _recv_line(self, socket, reader, size):
+        line = reader.read_line(size)
+        while line is None:
+            try:
+                received = reader.received(
+                    await asyncio.wait_for(
+                        self.loop.sock_recv_into(socket, reader.free()),
+                        self.settings["handshake_timeout"],
+                    )
+                )
+            except asyncio.TimeoutError:
+                await self._send(socket, messages.TIMED_OUT)
+                raise RuntimeError from None
+            if not received:
+                raise ConnectionResetError
+            line = reader.read_line(size)
+        return line.decode("latin-1")
+
+    async def _client(self, client_socket, client_address):
+        # Lines typed right after the handshake stay buffered for the player
+        reader = LineReader(self.settings["max_line_length"])
+        self.handshaking += 1
+        try:
+            player = await self._handshake(client_socket, client_address, reader)
+        except (ConnectionResetError, BrokenPipeError, RuntimeError):
+            player = None
+        finally:
+            self.handshaking -= 1
+        if player is None:
+            self.metrics.handshake_failures[0].inc()
+            client_socket.close()
+            return
+        self.metrics.joined[0].inc()
+        self.metrics.dequeued.inc()
+        if isinstance(player, Spectator):
+            await self._spectator_reader(player)
+            return
+        await self._player_reader(player, reader)
+
+    async def _handshake(self, client_socket, client_address, reader):
+        """Nickname and rejoin code handshake, returns the new Player or None.
+
+        Answering "@room" instead of a nickname returns a Spectator of the room."""
+        delay_factor = self.settings["delay_factor"]
+        await asyncio.sleep(0.5 * delay_factor)
+        await self._send(
+            client_socket, messages.encoded(self.game_class.game_data["title"])
+        )
+
+        while True:
+            try:
+                while True:
+                    await asyncio.sleep(0.25 * delay_factor)
+                    dirty = await asyncio.wait_for(
+                        self.loop.sock_recv(client_socket, 512), 0.08 + delay_factor
+                    )
+                    if not dirty:
+                        return None
+            except asyncio.TimeoutError:
+                pass
+            reader.clear()
+            await self._send(client_socket, messages.NICKNAME_PROMPT)
+
+            client_nickname, room_name = parse_room_request(
+                await self._recv_line(client_socket, reader, NICKNAME_LINE)
+            )
+            if not client_nickname and room_name is not None:
+                if not is_room_name(room_name):
+                    await self._send(client_socket, messages.BAD_ROOM_NAME)
+                    continue
+                print("\x1B[36mSpectator of " + room_name + " joined\x1B[0m")
+                return Spectator(client_socket, client_address, room_name)
+
+            if self.players.is_player(nickname=client_nickname):
+                await self._send(client_socket, messages.REJOIN_PROMPT)
+                input_code = await self._recv_line(client_socket, reader, REJOIN_LINE)
+                old_player = self.players.get_player(nickname=client_nickname)
+                if old_player is None or input_code != old_player.rejoin_code:
+                    return None
+                await self._send(client_socket, messages.WELCOME_BACK)
+                self._kick(old_player)
+                player = Player(
+                    client_socket,
+                    client_nickname,
+                    address=client_address,
+                    rejoin_code=old_player.rejoin_code,
+                    score=old_player.score,
+                    room=old_player.room,
+                )
+                room = self._join(player)
+                # Server notice "+player", the game redraws the rejoined screen
+                self.hosts.send_command(
+                    room, ".", messages.server_notice("+", client_nickname)
+                )
+                print("\x1B[33m" + client_nickname + " rejoined\x1B[0m")
+                return player
+
+            session = self.sessions.get(client_nickname) if self.sessions else None
+            if session is not None:
+                # Returning after leaving, or after a restart, with the stored score
+                await self._send(client_socket, messages.REJOIN_PROMPT)
+                input_code = await self._recv_line(client_socket, reader, REJOIN_LINE)
+                if input_code != session.rejoin_code:
+                    return None
+                await self._send(client_socket, messages.WELCOME_BACK)
+                player = Player(
+                    client_socket,
+                    client_nickname,
+                    address=client_address,
+                    rejoin_code=session.rejoin_code,
+                    score=session.score,
+                    room=room_name,
+                )
+                self._join(player)
+                print("\x1B[33m" + client_nickname + " rejoined\x1B[0m")
+                return player
+
+            if (
+                not client_nickname.isalnum()
+                or len(client_nickname) < 2
+                or len(client_nickname) > 32
+            ):
+                await self._send(client_socket, messages.BAD_NICKNAME)
+                continue
+
+            if room_name is not None and not is_room_name(room_name):
+                await self._send(client_socket, messages.BAD_ROOM_NAME)
+                continue
+
+            break
+
+        if not self.settings["allow_same_source_ip"] and self.players.is_player(
+            address=client_address
+        ):
+            await self._send(client_socket, messages.ADDRESS_IN_USE)
+            return None
+
+        # Welcome is sent before joining, the outbox owns the socket output after
+        rejoin_code = generate_rejoin_code()
+        await self._send(
+            client_socket,
+            messages.encoded(self.game_class.game_data["opening"])
+            + messages.WELCOME.render(
+                rejoin_code=rejoin_code,
+                lobby_time=prettify_time(self.settings["lobby_time"]),
+            ),
+        )
+        player = Player(
+            client_socket,
+            client_nickname,
+            address=client_address,
+            rejoin_code=rejoin_code,
+            room=room_name,
+        )
+        self._join(player)
+        print("\x1B[36m" + client_nickname + " joined\x1B[0m")
+        return player
+
+    def _join(self, player):
+        """Add a player to the server and to a room, returns the room."""
+        self.players.add_player(player)
+        self._watch_lag()
+        self._remember(player)
+        room = self.rooms.place(player, player.room)
+        send_to(self.players, player, messages.IN_ROOM.render(room=room.name))
+        return room
+
+    def _leave(self, player):
+        """Remove a player from the server and its room, telling the game if running."""
+        self.players.drop_player(nickname=player.nickname)
+        self._remember(player)
+        room = self.rooms.leave(player)
+        if room is None:
+            return
+        # Send a command from server management player (nickname="."), telling "-player"
+        self.hosts.send_command(room, ".", messages.server_notice("-", player.nickname))
+
+    def _kick(self, player):
+        """Disconnect a replaced or evicted player, the task closes its socket."""
+        self.outbox.discard(player.socket)
+        task = self.tasks.get(player.socket)
+        try:
+            player.socket.shutdown(so.SHUT_RDWR)
+        except OSError:
+            pass
+        if task is None:
+            player.socket.close()
+        else:
+            task.cancel()
+
+    def _drop(self, player):
+        self.outbox.discard(player.socket)
+        player.socket.close()
+        if self.players.get_player(nickname=player.nickname) is player:
+            self._leave(player)
+
+    def _evict(self, socket):
+        spectator = self.spectators.get(socket)
+        if spectator is not None:
+            self._kick(spectator)
+            return
+        player = self.players.get_player(socket=socket)
+        if player is None:
+            return
+        print("\x1B[33m" + player.nickname + " fell behind.\x1B[0m")
+        self._kick(player)
+        self._leave(player)
+
+    def _arm_timers(self):
+        if self._timers_handle is not None:
+            self._timers_handle.cancel()
+            self._timers_handle = None
+        deadline = self.timers.next_deadline()
+        if deadline is not None:
+            self._timers_handle = self.loop.call_at(deadline, self._run_timers)
+
+    def _run_timers(self):
+        self._timers_handle = None
+        self.timers.run_due()
+        self._arm_timers()
+
+    def _start_game(self, room):
+        send_all(room.players, messages.encoded(self.game_class.game_data["clear"]))
+        self.hosts.start_game(room)
+
+    def _end_game(self, room):
+        for player in room.players:
+            self._remember(player)
+
+    def _close_room(self, room):
+        for socket in tuple(room.spectators.sockets):
+            self.outbox.write(socket, messages.ROOM_CLOSED)
+            self._kick(self.spectators[socket])
+
+    def _unwatch(self, spectator):
+        if self.spectators.pop(spectator.socket, None) is None:
+            return
+        self.rooms.unwatch(spectator)
+        self.outbox.discard(spectator.socket)
+
+    def _remember(self, player):
+        if self.sessions is not None:
+            self.sessions.save(player.nickname, player.rejoin_code, player.score)
+
+    async def _player_reader(self, player, reader):
+        socket = player.socket
+        try:
+            while True:
+                lines = reader.lines()
+                if lines:
+                    room = self.rooms.get_room(player.room)
+                    if room.is_playing():
+                        for line in lines:
+                            self.hosts.send_command(room, player.nickname, line)
+                    else:
+                        other_players = room.players.copy()
+                        other_players.drop_player(nickname=player.nickname)
+                        for line in lines:
+                            send_all(
+                                other_players, messages.chat_line(player.nickname, line)
+                            )
+
+                try:
+                    received = reader.received(
+                        await self.loop.sock_recv_into(socket, reader.free())
+                    )
+                except ConnectionResetError:
+                    print("\x1B[33m" + player.nickname + " reset connection.\x1B[0m")
+                    self._drop(player)
+                    return
+                if not received:
+                    print("\x1B[36m" + player.nickname + " left\x1B[0m")
+                    self._drop(player)
+                    return
+        except asyncio.CancelledError:
+            socket.close()
+            raise
+
+    async def _spectator_reader(self, spectator):
+        socket = spectator.socket
+        if self.rooms.get_room(spectator.room) is None:
+            await self._send(socket, messages.NO_ROOM)
+            socket.close()
+            return
+        self.spectators[socket] = spectator
+        self.outbox.write(socket, messages.WATCHING.render(room=spectator.room))
+        self.rooms.watch(spectator)
+        try:
+            # Spectators only watch, anything they type is thrown away
+            while await self.loop.sock_recv(socket, 4096):
+                pass
+        except ConnectionResetError:
+            pass
+        finally:
+            self._unwatch(spectator)
+            socket.close()
@@ -0,0 +1,202 @@
+"""Cluster of server nodes, sharing nickname and room ownership through a coordinator"""
+
+
+import argparse
+import json
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from threading import Lock, Thread
+
+
+def parse_address(address):
+    """Get a (host, port) tuple from "host:port", or else a Unix socket path."""
+    if isinstance(address, (tuple, list)):
+        return tuple(address)
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return (host or "localhost", int(port))
+    return address
+
+
+class Coordinator:
+    """Tracks the nodes of a cluster, their load, and who owns nicknames and rooms.
+
+    Nodes are named by the address their clients connect to. A nickname belongs to the
+    node that admitted it last, until the player leaves it, a room name to the node
+    that claimed it first, until that node disconnects. Messages are JSON lists, so
+    nodes can't send pickles."""
+
+    def __init__(self, address, authkey=None):
+        self.listener = Listener(parse_address(address), authkey=authkey)
+        self.address = self.listener.address
+        self.lock = Lock()
+        # Players and rooms of each node, then the owning node of names
+        self.nodes = {}
+        self.nicknames = {}
+        self.rooms = {}
+
+    def serve(self):
+        """Serve nodes until interrupted, one thread each."""
+        try:
+            while True:
+                try:
+                    connection = self.listener.accept()
+                except AuthenticationError:
+                    continue
+                Thread(target=self._serve_node, args=(connection,), daemon=True).start()
+        except (OSError, KeyboardInterrupt):
+            pass
+        finally:
+            self.listener.close()
+
+    def _serve_node(self, connection):
+        node = None
+        try:
+            while True:
+                message = json.loads(connection.recv_bytes())
+                if message[0] == "hello":
+                    node = message[1]
+                    with self.lock:
+                        self.nodes[node] = {"players": 0, "rooms": 0}
+                    continue
+                reply = self.handle(node, message)
+                if reply is not None:
+                    connection.send_bytes(json.dumps(reply).encode("utf-8"))
+        except (EOFError, OSError, ValueError, IndexError):
+            pass
+        finally:
+            connection.close()
+            if node is not None:
+                self.forget(node)
+
+    def handle(self, node, message):
+        """Apply a message from a node, returns the reply to requests."""
+        kind = message[0]
+        with self.lock:
+            if kind == "load" and node in self.nodes:
+                self.nodes[node] = {"players": message[1], "rooms": message[2]}
+            elif kind == "nickname" and node in self.nodes:
+                self.nicknames[message[1]] = node
+            elif kind == "leave" and self.nicknames.get(message[1]) == node:
+                # Unless the player joined another node meanwhile
+                del self.nicknames[message[1]]
+            elif kind == "room" and node in self.nodes:
+                self.rooms.setdefault(message[1], node)
+            elif kind == "lookup":
+                return {
+                    "nickname": self.nicknames.get(message[1]),
+                    "room": self.rooms.get(message[2]),
+                    "least_loaded": min(
+                        self.nodes,
+                        key=lambda name: self.nodes[name]["players"],
+                        default=None,
+                    ),
+                }
+        return None
+
+    def forget(self, node):
+        """Drop a node and everything it owns."""
+        with self.lock:
+            self.nodes.pop(node, None)
+            for owners in (self.nicknames, self.rooms):
+                for name in [name for name, owner in owners.items() if owner == node]:
+                    del owners[name]
+
+
+class CoordinatorClient:
+    """Connection to the coordinator, from a node with its name, or only for lookups.
+
+    Updates are sent without waiting, lookups wait timeout seconds at most for the
+    reply, or get sent with send_lookup() and their replies received once the
+    connection is readable, in the same order. Errors are raised as OSError, callers
+    can carry on without a cluster."""
+
+    def __init__(self, address, node=None, authkey=None, timeout=1.0):
+        try:
+            self.connection = Client(parse_address(address), authkey=authkey)
+        except (AuthenticationError, EOFError) as error:
+            raise OSError("Coordinator refused the connection.") from error
+        self.node = node
+        self.timeout = timeout
+        if node is not None:
+            self._send("hello", node)
+
+    def fileno(self):
+        """Connection file descriptor, to wait for lookup replies."""
+        return self.connection.fileno()
+
+    def _send(self, *message):
+        try:
+            self.connection.send_bytes(json.dumps(message).encode("utf-8"))
+        except (EOFError, ValueError) as error:
+            raise OSError("Coordinator connection lost.") from error
+
+    def report_load(self, players, rooms):
+        """Tell the number of players and rooms of this node."""
+        self._send("load", players, rooms)
+
+    def claim_nickname(self, nickname):
+        """Tell that a player with this nickname joined this node."""
+        self._send("nickname", nickname)
+
+    def release_nickname(self, nickname):
+        """Tell that the player with this nickname left this node."""
+        self._send("leave", nickname)
+
+    def claim_room(self, room_name):
+        """Tell that this node has a room by this name, unless another one had it."""
+        self._send("room", room_name)
+
+    def lookup(self, nickname, room_name=None):
+        """Get the nodes owning a nickname and a room, and the least loaded node."""
+        self.send_lookup(nickname, room_name)
+        try:
+            ready = self.connection.poll(self.timeout)
+        except EOFError as error:
+            raise OSError("Coordinator connection lost.") from error
+        if not ready:
+            # A late reply would be taken for the next one
+            self.connection.close()
+            raise OSError("Coordinator took too long to reply.")
+        return self.receive()
+
+    def send_lookup(self, nickname, room_name=None):
+        """Ask for the owners of a nickname and a room, without waiting."""
+        self._send("lookup", nickname, room_name)
+
+    def receive(self):
+        """Get the reply to the oldest lookup sent, once the connection is readable."""
+        try:
+            return json.loads(self.connection.recv_bytes())
+        except EOFError as error:
+            raise OSError("Coordinator connection lost.") from error
+
+    def close(self):
+        """Disconnect, the coordinator forgets what a named node owned."""
+        self.connection.close()
+
+
+def connect(settings, node=None):
+    """Connect to the coordinator of the server settings, or get None without one."""
+    if settings.get("coordinator") is None:
+        return None
+    key = settings.get("cluster_key")
+    return CoordinatorClient(
+        settings["coordinator"], node, None if key is None else key.encode("utf-8")
+    )
+
+
+def cli_coordinator():
+    """Run a cluster coordinator from the command line."""
+    parser = argparse.ArgumentParser(description="NetHang cluster coordinator.")
+    parser.add_argument(
+        "address", help="Unix socket path, or host:port to listen on TCP."
+    )
+    parser.add_argument("--key", help="Shared key nodes must authenticate with.")
+    args = parser.parse_args()
+
+    coordinator = Coordinator(
+        args.address, None if args.key is None else args.key.encode("utf-8")
+    )
+    print("\x1B[36mCoordinator listening on " + str(coordinator.address) + "\x1B[0m")
+    coordinator.serve()
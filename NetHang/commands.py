@@ -0,0 +1,98 @@
+"""Command routing for hosted games, delivering only the awaited players' input"""
+
+
+import queue
+from collections import deque
+from threading import Lock
+
+from NetHang.journal import INPUT, TIMEOUT
+
+# What happens to input from players the game is not waiting for
+POLICIES = ("drop", "buffer")
+
+
+class _Deadline:
+    """Marker put in the queue by a timer, when a timed get() runs out."""
+
+    __slots__ = ()
+
+
+class CommandQueue:
+    """Queue of (Player, line) commands for one game, filtered by expected players.
+
+    The game calls expect() with the nicknames it waits for, then commands from other
+    players are dropped, or buffered per player and released once they are expected.
+    Server notices (nickname ".") always go through. The on_expect callback lets the
+    server drop unwanted input at the source, before it is even passed to the host.
+    With timers, timed gets are deadlines on the timers of the host instead of timed
+    waits, so the host keeps the turn deadlines of all its games on one heap. With a
+    journal, the commands the game gets and its timeouts are recorded, in the order
+    the game sees them, for replays."""
+
+    def __init__(
+        self, policy="drop", buffer_size=8, on_expect=None, timers=None, journal=None
+    ):
+        if policy not in POLICIES:
+            raise ValueError("Unknown command policy: " + str(policy))
+        self.policy = policy
+        self.buffer_size = buffer_size
+        self.on_expect = on_expect
+        self.timers = timers
+        self.journal = journal
+        self.queue = queue.SimpleQueue()
+        self.lock = Lock()
+        self.expected = None
+        self.buffered = {}
+
+    def expect(self, *nicknames):
+        """Only accept commands from these players, or from everyone if none given."""
+        with self.lock:
+            self.expected = set(nicknames) or None
+            for nickname in nicknames:
+                for command in self.buffered.pop(nickname, ()):
+                    self.queue.put(command)
+        if self.on_expect is not None:
+            self.on_expect(list(nicknames) or None)
+
+    def put(self, command):
+        """Route a command tuple to the game, or drop or buffer it by policy."""
+        nickname = command[0].nickname
+        with self.lock:
+            if nickname == "." or self.expected is None or nickname in self.expected:
+                self.queue.put(command)
+            elif self.policy == "buffer":
+                if nickname not in self.buffered:
+                    self.buffered[nickname] = deque(maxlen=self.buffer_size)
+                self.buffered[nickname].append(command)
+
+    def get(self, timeout=None):
+        """Get the next routed command, raise queue.Empty after timeout seconds."""
+        if self.journal is None:
+            return self._get(timeout)
+        try:
+            command = self._get(timeout)
+        except queue.Empty:
+            self.journal.record(TIMEOUT)
+            raise
+        self.journal.record(INPUT, command[0].nickname, command[1])
+        return command
+
+    def _get(self, timeout):
+        if self.timers is None:
+            return self.queue.get(timeout=timeout)
+
+        if timeout is None:
+            deadline, handle = None, None
+        else:
+            deadline = _Deadline()
+            handle = self.timers.call_later(timeout, self.queue.put, deadline)
+        while True:
+            command = self.queue.get()
+            if command is deadline:
+                raise queue.Empty
+            # Markers of earlier gets, that timed out just after getting a command
+            if isinstance(command, _Deadline):
+                continue
+            if handle is not None:
+                handle.cancel()
+            return command
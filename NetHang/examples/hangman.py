@@ -1,16 +1,23 @@
 """Game classes, abstracted to the main components"""
 
 
-import socket as so
 from os import path
-from multiprocessing import Process, SimpleQueue
+from multiprocessing import Process, Queue
+from queue import Empty
+from random import Random
+from time import monotonic
 
-from NetHang.players import PlayerList, send_all
-from NetHang.util import load_json_dict, timeout_in, timeout_kill
+from NetHang import journal, wordlist
+from NetHang.players import Bot, PlayerList, send_all, send_to
+from NetHang.screen import Screen
+from NetHang.solver import Solver
+from NetHang.util import load_json_dict
 
 _game_graphics_path = path.join(path.dirname(path.abspath(__file__)), "hangman.json")
 GAME_DATA = load_json_dict(_game_graphics_path)
 
+LAST_GUESS = "\x1B[01;36mLAST GUESS\x1B[0m\n"
+
 
 def string_to_masked(string, to_show):
     """Return the input string wrapped, colorized and masked. Use lowercase for list to_show."""
@@ -25,6 +32,69 @@ def string_to_masked(string, to_show):
     return out
 
 
+def dictionary():
+    """Get the wordlist dictionary, compiled on first use, shared by all games."""
+    return wordlist.open_dictionary(
+        path.join(path.dirname(path.abspath(__file__)), GAME_DATA["wordlist"]),
+        GAME_DATA.get("wordlist_index"),
+    )
+
+
+def expect(commands_queue, *nicknames):
+    """Tell a routing commands queue whose input is awaited, plain queues get it all."""
+    if hasattr(commands_queue, "expect"):
+        commands_queue.expect(*nicknames)
+
+
+def record(commands_queue, kind, *fields):
+    """Add an event to the journal of the game, if the commands queue has one."""
+    game_journal = getattr(commands_queue, "journal", None)
+    if game_journal is not None:
+        game_journal.record(kind, *fields)
+
+
+def bot_move(commands_queue, bot, line):
+    """Queue the line of a bot after the bot delay, on the timers of the host."""
+    timers = getattr(commands_queue, "timers", None)
+    if timers is None or GAME_DATA["bot_delay"] <= 0:
+        commands_queue.put((bot, line))
+    else:
+        timers.call_later(GAME_DATA["bot_delay"], commands_queue.put, (bot, line))
+
+
+def has_humans(players):
+    """Check if any of the players is not a bot."""
+    return any(not isinstance(player, Bot) for player in players)
+
+
+def fill_with_bots(players, commands_queue=None):
+    """Add bots until the game has fill_bots players, if anyone is there to play."""
+    if not has_humans(players):
+        return
+    number = 1
+    while players.count() < GAME_DATA["fill_bots"]:
+        if not players.is_player(nickname="Bot-" + str(number)):
+            bot = Bot("Bot-" + str(number))
+            players.add_player(bot)
+            record(commands_queue, journal.JOIN, bot.nickname, bot.score, 1)
+        number += 1
+
+
+def game_frame(players, masked, fails, last_guess):
+    """Return the game screen, with scores, last guess, masked guessword and hanger."""
+    return (
+        "\x1B[01;36mSCORE\x1B[0m\n"
+        + str(players.scoreboard())
+        + "\n\n"
+        + last_guess
+        + "\n\x1B[01;36mGUESSWORD\x1B[0m\n"
+        + masked
+        + "\n\n\x1B[01;36mHANGER\x1B[0m\n"
+        + GAME_DATA["hangman" + str(fails)[0]]
+        + "\n\n"
+    )
+
+
 def is_guessed(word, arr):
     """Check if the array has all of the word letters."""
     for _, strchar in enumerate(word.lower()):
@@ -35,40 +105,97 @@ def is_guessed(word, arr):
     return True
 
 
+class GuessWord:
+    """The guessword of a round, with the letters still to find and its masked line.
+
+    Revealing a letter only changes the masked pieces at the positions of that letter,
+    so rendering the masked word is a cached string and a win is an empty set."""
+
+    def __init__(self, word):
+        self.word = word
+        self.letters = set(word.lower())
+        # Positions of each letter, and letters not revealed yet
+        self.positions = {}
+        for i, strchar in enumerate(word):
+            if strchar.isalpha():
+                self.positions.setdefault(strchar.lower(), []).append(i)
+        self.missing = set(self.positions)
+        # Masked word by position, as string_to_masked() renders it
+        self.pieces = [
+            ("-\n-" if (i + 1) % 48 == 0 else "")
+            + ("." if strchar.isalpha() else "\x1B[01;36m" + strchar + "\x1B[0m")
+            for i, strchar in enumerate(word)
+        ]
+        self.masked = "".join(self.pieces)
+
+    def reveal(self, letter):
+        """Show all positions of a lowercase letter in the masked word."""
+        if letter not in self.missing:
+            return
+        self.missing.discard(letter)
+        for i in self.positions[letter]:
+            self.pieces[i] = (
+                ("-\n-" if (i + 1) % 48 == 0 else "")
+                + "\x1B[01;36m"
+                + self.word[i]
+                + "\x1B[0m"
+            )
+        self.masked = "".join(self.pieces)
+
+    def reveal_all(self):
+        """Show the whole word."""
+        for letter in tuple(self.missing):
+            self.reveal(letter)
+
+    def is_guessed(self):
+        """Check if all letters of the word were found."""
+        return not self.missing
+
+    def known(self):
+        """Get the lowercase character of each position, None for hidden letters."""
+        return [None if c.lower() in self.missing else c.lower() for c in self.word]
+
+
 class Game:
     """Base class for all turn-based hangman games."""
 
     # Dict is passed through, essential for server.py showing early user joining info.
     game_data = GAME_DATA
 
-    def __init__(self, players=PlayerList()):
+    def __init__(self, players=PlayerList(), commands_queue=None):
         self.players = players
-        self.commands_queue = SimpleQueue()
+        # Any queue with get(timeout=...), game hosts pass a thread queue
+        self.commands_queue = commands_queue if commands_queue is not None else Queue()
         self.rounds = GAME_DATA["rounds"]
         self.game_process = None
+        # Every choice by chance comes from here, seeded by the host when journaled
+        self.rng = Random()
 
     def _game_loop(self, players, commands_queue):
         send_all(players, "\x1B[01;36mGame started.\x1B[0m\n")
         hanger, prev_hanger = None, None
+        fill_with_bots(players, commands_queue)
         for round_ in range(self.rounds):
             send_all(
                 players, "Round " + str(round_ + 1) + "/" + str(self.rounds) + ".\n"
             )
-            if players.count() < 2:
+            if players.count() < 2 or not has_humans(players):
                 send_all(players, "\x1B[01;36mNot enough players.\x1B[0m\n")
                 return
             while hanger == prev_hanger:
-                hanger = players.get_random_player()
-            Round(hanger, players, commands_queue, rounds=self.rounds)
+                hanger = players.get_random_player(self.rng)
+            Round(hanger, players, commands_queue, rounds=self.rounds, rng=self.rng)
             prev_hanger = hanger
         send_all(players, "\x1B[01;36mGame ended.\x1B[0m\n")
 
+    def run(self):
+        """Run the game in the calling thread, as game hosts do."""
+        self._game_loop(self.players, self.commands_queue)
+
     def start(self):
         """Start the game."""
         if not self.is_alive():
-            self.game_process = Process(
-                target=self._game_loop, args=(self.players, self.commands_queue)
-            )
+            self.game_process = Process(target=self.run)
             self.game_process.start()
         else:
             raise RuntimeError("Already started.")
@@ -87,65 +214,118 @@ class Game:
         return False
 
 
+class WordlistGame(Game):
+    """Hangman without a hanger, every round has a random word from the wordlist."""
+
+    def _game_loop(self, players, commands_queue):
+        send_all(players, "\x1B[01;36mGame started.\x1B[0m\n")
+        min_length, max_length = GAME_DATA["wordlist_lengths"]
+        fill_with_bots(players, commands_queue)
+        for round_ in range(self.rounds):
+            send_all(
+                players, "Round " + str(round_ + 1) + "/" + str(self.rounds) + ".\n"
+            )
+            if not has_humans(players):
+                send_all(players, "\x1B[01;36mNot enough players.\x1B[0m\n")
+                return
+            word = dictionary().random_word(min_length, max_length, self.rng)
+            if word is None:
+                send_all(players, "\x1B[01;36mNo words in the wordlist.\x1B[0m\n")
+                return
+            Round(None, players, commands_queue, rounds=self.rounds, word=word)
+        send_all(players, "\x1B[01;36mGame ended.\x1B[0m\n")
+
+
 class Round:
-    """A single round of the turn-based hangman game."""
+    """A single round of the turn-based hangman game.
+
+    The hanger types the guessword, or without a hanger the word is given. Bots
+    among the guessers share one solver, narrowing down the words as they go."""
 
-    def __init__(self, hanger, players, commands_queue, rounds=5):
+    def __init__(self, hanger, players, commands_queue, rounds=5, word=None, rng=None):
         self.hanger = hanger
         self.players = players
         self.rounds = rounds
         self.commands_queue = commands_queue
+        self.word = word
+        self.rng = rng if rng is not None else Random()
 
         self.tried_letters = []
         self.fails = 0
+        # Turns redraw the lines of the game screen that changed
+        self.screen = Screen(GAME_DATA["clear"])
 
         self.guessers = players.copy()
-        self.guessers.drop_player(nickname=hanger.nickname)
+        if hanger is not None:
+            self.guessers.drop_player(nickname=hanger.nickname)
 
         self._round_loop()
 
+    def _ask_word(self):
+        """Get the guessword from the hanger, or None if a player left meanwhile."""
+        expect(self.commands_queue, self.hanger.nickname)
+        send_all(
+            self.guessers,
+            "\x1B[01;36mWaiting for " + self.hanger.nickname + "...\x1B[0m\n",
+        )
+
+        send_to(self.players, self.hanger, "You are the hanger, type the guessword: ")
+        if isinstance(self.hanger, Bot):
+            min_length, max_length = GAME_DATA["wordlist_lengths"]
+            word = dictionary().random_word(min_length, max_length, self.rng)
+            bot_move(self.commands_queue, self.hanger, word or "hangman")
+
+        while True:
+            command = self.commands_queue.get()
+            while command[0].nickname != self.hanger.nickname:
+                if command[0].nickname == ".":
+                    if command[1][0] == "-":
+                        return None
+                command = self.commands_queue.get()
+            word = command[1]
+            if len(word) < 2 or len(word) > 80:
+                send_to(
+                    self.players, self.hanger, "Between 2 and 80 characters only:  "
+                )
+                continue
+            if GAME_DATA["check_words"] and word not in dictionary():
+                send_to(self.players, self.hanger, "Not in the wordlist, try another: ")
+                continue
+            return word
+
     def _round_loop(self):
         try:
-            send_all(
-                self.guessers,
-                "\x1B[01;36mWaiting for " + self.hanger.nickname + "...\x1B[0m\n",
-            )
-
-            self.hanger.socket.send(
-                "You are the hanger, type the guessword: ".encode("latin-1")
+            word = self.word if self.hanger is None else self._ask_word()
+            if word is None:
+                return
+            record(
+                self.commands_queue,
+                journal.ROUND,
+                "" if self.hanger is None else self.hanger.nickname,
+                word,
             )
 
-            while True:
-                command = self.commands_queue.get()
-                while command[0].nickname != self.hanger.nickname:
-                    if command[0].nickname == ".":
-                        if command[1][0] == "-":
-                            return
-                    command = self.commands_queue.get()
-                word = command[1]
-                if len(word) < 2 or len(word) > 80:
-                    self.hanger.socket.send(
-                        "Between 2 and 80 characters only:  ".encode("latin-1")
-                    )
-                    continue
-                break
-
-            send_all(self.players, GAME_DATA["clear"])
-            send_all(
+            guessword = GuessWord(word)
+            solver = None
+            if any(isinstance(guesser, Bot) for guesser in self.guessers):
+                solver = Solver(dictionary(), len(word))
+            self.screen.draw(
                 self.players,
-                "\x1B[01;36mSCORE\x1B[0m\n"
-                + str(self.players.scoreboard())
-                + "\n\n\x1B[01;36mLAST GUESS\x1B[0m\n\n",
+                game_frame(
+                    self.players, guessword.masked, self.fails, LAST_GUESS + "\n"
+                ),
             )
 
-            while self.fails <= 9 and not is_guessed(word, self.tried_letters):
+            while self.fails <= 9 and not guessword.is_guessed():
                 Turn(
-                    word,
+                    guessword,
                     self.players,
                     self.guessers,
                     self.commands_queue,
                     self.get_stats,
                     self.update_stats,
+                    self.screen,
+                    solver,
                 )
 
             send_all(
@@ -179,89 +359,124 @@ class Round:
 
 
 class Turn:
-    """A single turn of the turn-based hangman game, where all guessers guess."""
+    """A single turn of the turn-based hangman game, where all guessers guess.
+
+    Bots guess what the solver tells them, after the bot delay."""
 
     def __init__(
-        self, word, players, guessers, commands_queue, get_stats, update_stats
+        self,
+        guessword,
+        players,
+        guessers,
+        commands_queue,
+        get_stats,
+        update_stats,
+        screen=None,
+        solver=None,
     ):
-        self.word = word
+        self.guessword = guessword
+        self.word = guessword.word
         self.players = players
         self.guessers = guessers
         self.tried_letters, self.fails = get_stats()
         self.commands_queue = commands_queue
         self.update_stats = update_stats
+        self.screen = screen if screen is not None else Screen(GAME_DATA["clear"])
+        self.solver = solver
 
         self._turn_loop()
 
-    def _turn_loop(self):
-        for guesser in self.guessers.player_list:
-            send_all(
-                self.players,
-                "\n\x1B[01;36mGUESSWORD\x1B[0m\n"
-                + string_to_masked(self.word, self.tried_letters)
-                + "\n",
-            )
-
-            send_all(
-                self.players,
-                "\n\x1B[01;36mHANGER\x1B[0m\n"
-                + GAME_DATA["hangman" + str(self.fails)[0]]
-                + "\n\n",
-            )
-
-            other_players = self.players.copy()
-            other_players.drop_player(nickname=guesser.nickname)
-            send_all(other_players, guesser.nickname + "'s guess...\n")
+    def _get_command(self, deadline):
+        """Get the next command, raise queue.Empty once past the deadline."""
+        return self.commands_queue.get(timeout=max(0, deadline - monotonic()))
+
+    def _draw(self, last_guess):
+        """Redraw the game screen for everyone, under the new scores."""
+        self.screen.draw(
+            self.players,
+            game_frame(self.players, self.guessword.masked, self.fails, last_guess),
+        )
+
+    def _prompt(self, guesser):
+        other_players = self.players.copy()
+        other_players.drop_player(nickname=guesser.nickname)
+        send_all(other_players, guesser.nickname + "'s guess...\n")
+
+        send_to(
+            self.players,
+            guesser,
+            "\x1B[01;36mIt's your turn! You have 60 seconds: \x1B[0m",
+        )
+        if isinstance(guesser, Bot):
+            if self.solver is None:
+                self.solver = Solver(dictionary(), len(self.word))
+            line = self.solver.guess(self.guessword.known(), self.tried_letters)
+            bot_move(self.commands_queue, guesser, line)
 
-            guesser.socket.send(
-                "\x1B[01;36mIt's your turn! You have 60 seconds: \x1B[0m".encode(
-                    "latin-1"
-                )
-            )
+    def _turn_loop(self):
+        for guesser in self.guessers:
+            expect(self.commands_queue, guesser.nickname)
+            self._prompt(guesser)
 
-            timeout_in(60)
+            deadline = monotonic() + 60
             try:
                 while True:
-                    command = self.commands_queue.get()
+                    command = self._get_command(deadline)
                     while command[0].nickname != guesser.nickname:
                         if command[0].nickname == ".":
                             if command[1][0] == "-":
                                 return
-                        command = self.commands_queue.get()
+                            if command[1][0] == "+":
+                                # Rejoined player, with an empty terminal
+                                self.screen.redraw(self.players, command[1][1:])
+                                if command[1][1:] == guesser.nickname:
+                                    self._prompt(guesser)
+                        command = self._get_command(deadline)
                     letter = command[1].lower()
                     if len(letter) != 1 and len(letter) != len(self.word):
-                        guesser.socket.send(
-                            "Only guess letters or the entire word: ".encode("latin-1")
+                        send_to(
+                            self.players,
+                            guesser,
+                            "Only guess letters or the entire word: ",
                         )
                         continue
                     break
-            except (TimeoutError, so.timeout):
+            except Empty:
+                self._draw(
+                    LAST_GUESS
+                    + "\x1B[01;36m"
+                    + guesser.nickname
+                    + "\x1B[0m: \x1B[91mout of time!\x1B[0m\n"
+                )
                 continue
-            timeout_kill()
 
-            last_guess = " "
+            last_guess = LAST_GUESS + "\n"
+            score = guesser.score
 
             if len(letter) == 1:
                 # Assign weighted scoring for each letter guess, and last guess string
                 if letter in self.tried_letters:
                     self.fails += 1
                     last_guess = (
-                        '\x1B[01;36mLAST GUESS\x1B[0m\n\x1B[01;36m"'
+                        LAST_GUESS
+                        + '\x1B[01;36m"'
                         + letter.upper()
                         + '"\x1B[0m: \x1B[91mguessed already!\x1B[0m\n'
                     )
                     guesser.score -= 5 + (guesser.score // 10)
-                elif letter not in self.word.lower():
+                elif letter not in self.guessword.letters:
                     self.fails += 1
                     last_guess = (
-                        '\x1B[01;36mLAST GUESS\x1B[0m\n\x1B[01;36m"'
+                        LAST_GUESS
+                        + '\x1B[01;36m"'
                         + letter.upper()
                         + '"\x1B[0m: \x1B[91mno!\x1B[0m\n'
                     )
                     guesser.score -= 12 + (guesser.score // 20)
                 else:
                     last_guess = (
-                        '\x1B[01;36mLAST GUESS\x1B[0m\n\x1B[01;36m"'
+                        LAST_GUESS
+                        + '\x1B[01;36m"'
                         + letter.upper()
                         + '"\x1B[0m: \x1B[92myes!\x1B[0m\n'
                     )
@@ -269,32 +484,31 @@ class Turn:
 
                 if letter not in self.tried_letters:
                     self.tried_letters.append(letter)
+                    self.guessword.reveal(letter)
 
             else:
                 # Scoring for entire word guesses
                 if letter == self.word.lower():
                     guesser.score += 200
                     self.tried_letters += list(self.word.lower())
+                    self.guessword.reveal_all()
                 else:
                     self.fails += 1
-                    last_guess = (
-                        '\x1B[01;36mLAST GUESS\x1B[0m\n\x1B[91m"'
-                        + letter
-                        + '"\x1B[0m\n'
-                    )
+                    last_guess = LAST_GUESS + '\x1B[91m"' + letter + '"\x1B[0m\n'
                     guesser.score -= 200 + (guesser.score // 5)
 
-            # Clear screen and print scores
-            send_all(self.players, GAME_DATA["clear"])
-            send_all(
-                self.players,
-                "\x1B[01;36mSCORE\x1B[0m\n" + str(self.players.scoreboard()) + "\n\n",
-            )
+            if guesser.score != score:
+                record(
+                    self.commands_queue,
+                    journal.SCORE,
+                    guesser.nickname,
+                    guesser.score - score,
+                )
 
-            # Print the latest guessed letter or word, as string-fied above
-            send_all(self.guessers, last_guess)
+            # Redraw the changes to scores, the latest guess and the guessword
+            self._draw(last_guess)
 
             self.update_stats(tried_letters=self.tried_letters, fails=self.fails)
 
-            if self.fails == 10 or is_guessed(self.word, self.tried_letters):
+            if self.fails == 10 or self.guessword.is_guessed():
                 break
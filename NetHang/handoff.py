@@ -0,0 +1,60 @@
+"""Passing accepted client sockets from the accept workers to the server loop"""
+
+
+import array
+import json
+import socket as so
+
+
+class SocketHandoff:
+    """One way channel of client sockets, from any number of processes to one.
+
+    Each message is a datagram with the player fields as JSON, and the client file
+    descriptor attached as SCM_RIGHTS ancillary data. The sender closes its socket once
+    sent, so each connection is owned by exactly one process at any time."""
+
+    def __init__(self):
+        self.receiver, self.sender = so.socketpair(so.AF_UNIX, so.SOCK_DGRAM)
+        self.receiver.setblocking(False)
+
+    def fileno(self):
+        """Receiving end file descriptor, to wait for sockets."""
+        return self.receiver.fileno()
+
+    def send(self, client_socket, **fields):
+        """Pass a socket with its player fields, closing it in this process."""
+        fds = array.array("i", [client_socket.fileno()])
+        self.sender.sendmsg(
+            [json.dumps(fields).encode("utf-8")], [(so.SOL_SOCKET, so.SCM_RIGHTS, fds)]
+        )
+        client_socket.close()
+
+    def receive(self):
+        """Get all (socket, fields) pairs ready to be received, without blocking."""
+        received = []
+        fds = array.array("i")
+        while True:
+            try:
+                data, ancdata, flags, _ = self.receiver.recvmsg(
+                    4096, so.CMSG_SPACE(fds.itemsize)
+                )
+            except (BlockingIOError, InterruptedError):
+                return received
+
+            client_fds = array.array("i")
+            for level, kind, cmsg_data in ancdata:
+                if level == so.SOL_SOCKET and kind == so.SCM_RIGHTS:
+                    client_fds.frombytes(
+                        cmsg_data[: len(cmsg_data) - len(cmsg_data) % fds.itemsize]
+                    )
+            sockets = [so.socket(fileno=fd) for fd in client_fds]
+            if len(sockets) != 1 or flags & (so.MSG_TRUNC | so.MSG_CTRUNC):
+                for client_socket in sockets:
+                    client_socket.close()
+                continue
+            received.append((sockets[0], json.loads(data.decode("utf-8"))))
+
+    def close(self):
+        """Close both ends."""
+        self.receiver.close()
+        self.sender.close()
@@ -0,0 +1,433 @@
+"""Login handshakes of joining clients, as state machines driven by readiness"""
+
+
+from collections import deque
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+from time import monotonic
+
+from NetHang import cluster, messages
+from NetHang.admission import Admission, refuse
+from NetHang.players import generate_rejoin_code
+from NetHang.reader import LineReader
+from NetHang.rooms import is_room_name, parse_room_request
+from NetHang.timers import Timers
+from NetHang.util import prettify_time
+from NetHang.writer import Outbox
+
+# Handshake states, in the order a joining client goes through them
+TITLE = "title"
+DRAIN = "drain"
+NICKNAME = "nickname"
+REJOIN = "rejoin"
+LOOKUP = "lookup"
+JOINED = "joined"
+FAILED = "failed"
+
+# Longest nickname@room and rejoin code lines
+NICKNAME_LINE = 50
+REJOIN_LINE = 4
+# Seconds before connecting again to a coordinator that couldn't be reached
+COORDINATOR_RETRY = 5.0
+
+
+class Handshake:
+    """Login state of one connection, from the title to its nickname and rejoin code."""
+
+    def __init__(self, socket, address):
+        self.socket = socket
+        self.address = address
+        self.state = TITLE
+        # Input left when joining is handed over with the socket
+        self.reader = LineReader(NICKNAME_LINE, 512)
+        self.deadline = None
+        self.nickname = None
+        self.room = None
+        self.rejoin_code = None
+        self.rejoined = False
+        # Answered "@room" to the nickname prompt, only watching the room
+        self.spectator = False
+
+
+class Handshakes:
+    """All handshakes of an accept worker, multiplexed on one selector.
+
+    Accepted connections go through admission control first (Admission), refused
+    ones are closed before anything is read or sent to them. Each state waits for
+    readiness or for its deadline on a timer heap, never blocking: the title waits
+    out the delay, pending input gets drained, then the nickname and rejoin code
+    prompts wait handshake_timeout seconds each for a line. Finished handshakes go
+    to on_joined(handshake), which takes over the socket. With metrics
+    (ServerMetrics), accepts, refusals and failures are counted for the worker. With
+    sessions (SessionStore), players who left can rejoin with their code too. With a
+    coordinator in the settings, players of another node are sent there: lookups go
+    out without waiting, and their handshakes carry on when the coordinator replies
+    on the selector. Answering "@room" instead of a nickname joins as a spectator of
+    the room."""
+
+    def __init__(
+        self,
+        roster,
+        settings,
+        game_data,
+        on_joined,
+        metrics=None,
+        number=0,
+        sessions=None,
+        admission=None,
+    ):
+        self.roster = roster
+        # Shared by the workers of a server, for their connection rates
+        self.admission = admission if admission is not None else Admission(settings)
+        self.sessions = sessions
+        self.settings = settings
+        self.game_data = game_data
+        self.on_joined = on_joined
+        self.metrics = metrics
+        self.number = number
+
+        self.selector = DefaultSelector()
+        self.timers = Timers()
+        self.outbox = Outbox(
+            settings["send_high_water"],
+            on_pending=self._pending,
+            on_drained=self._drained,
+            on_evict=lambda socket: self._fail(self.selector.get_key(socket).data),
+        )
+        self.listeners = []
+        # Readable once the server gets taken over, this worker stops accepting then
+        self.drain = None
+        # Coordinator lookups, connected on the first one, with handshakes by reply
+        self.coordinator = None
+        self.coordinator_retry = 0.0
+        self.lookups = deque()
+
+    def __len__(self):
+        return (
+            len(self.selector.get_map())
+            - len(self.listeners)
+            - (self.drain is not None)
+            - (self.coordinator is not None)
+        )
+
+    def listen(self, server_socket):
+        """Accept new connections from a listening socket."""
+        server_socket.setblocking(False)
+        self.selector.register(server_socket, EVENT_READ)
+        self.listeners.append(server_socket)
+
+    def drain_on(self, fileobj):
+        """Stop accepting once fileobj is readable, and finish the handshakes left."""
+        self.drain = fileobj
+        self.selector.register(fileobj, EVENT_READ)
+
+    def run(self):
+        """Handle handshakes, until drained and none are left."""
+        while self.listeners or len(self):
+            self.poll()
+
+    def poll(self, timeout=None):
+        """Wait for readiness or the next deadline once, then handle both."""
+        deadline = self.timers.timeout()
+        if deadline is None or (timeout is not None and timeout < deadline):
+            deadline = timeout
+        for key, mask in self.selector.select(deadline):
+            if key.data is None:
+                if key.fileobj == self.drain:
+                    self._stop_accepting()
+                elif key.fileobj is self.coordinator:
+                    self._located()
+                else:
+                    self._accept(key.fileobj)
+                continue
+            if mask & EVENT_WRITE:
+                self.outbox.flush(key.fileobj)
+            if mask & EVENT_READ and key.data.state != FAILED:
+                self._readable(key.data)
+        self.timers.run_due()
+
+    def start(self, client_socket, client_address):
+        """Begin the handshake of a connected socket, or refuse it."""
+        if self.metrics is not None:
+            self.metrics.accepted[self.number].inc()
+        notice = self.admission.check(client_address, self.roster.count(), len(self))
+        if notice is not None:
+            refuse(client_socket, notice)
+            if self.metrics is not None:
+                self.metrics.refused[self.number].inc()
+            return
+        client_socket.setblocking(False)
+        handshake = Handshake(client_socket, client_address)
+        self.selector.register(client_socket, EVENT_READ, handshake)
+        self._after(0.5 * self.settings["delay_factor"], self._title, handshake)
+
+    def _accept(self, server_socket):
+        # Workers may share a listener, another one can take the connection first
+        for _ in range(64):
+            try:
+                client_socket, client_addr_port = server_socket.accept()
+            except OSError:
+                return
+            self.start(client_socket, client_addr_port[0])
+
+    def _stop_accepting(self):
+        self.selector.unregister(self.drain)
+        self.drain = None
+        for listener in self.listeners:
+            self.selector.unregister(listener)
+            listener.close()
+        self.listeners = []
+
+    def _after(self, delay, callback, handshake):
+        if handshake.deadline is not None:
+            handshake.deadline.cancel()
+        handshake.deadline = self.timers.call_later(delay, callback, handshake)
+
+    def _pending(self, socket):
+        key = self.selector.get_key(socket)
+        self.selector.modify(socket, EVENT_READ | EVENT_WRITE, key.data)
+
+    def _drained(self, socket):
+        key = self.selector.get_key(socket)
+        if key.data.state == JOINED:
+            self._hand_over(key.data)
+            return
+        self.selector.modify(socket, EVENT_READ, key.data)
+
+    def _title(self, handshake):
+        self.outbox.write(handshake.socket, messages.encoded(self.game_data["title"]))
+        self._drain(handshake)
+
+    def _drain(self, handshake):
+        # Anything typed before the prompt is thrown away
+        handshake.state = DRAIN
+        handshake.reader.clear()
+        self._after(0.08 + self.settings["delay_factor"], self._prompt, handshake)
+
+    def _prompt(self, handshake):
+        handshake.state = NICKNAME
+        handshake.reader.clear()
+        self.outbox.write(handshake.socket, messages.NICKNAME_PROMPT)
+        self._after(self.settings["handshake_timeout"], self._timeout, handshake)
+
+    def _timeout(self, handshake):
+        handshake.deadline = None
+        self._fail(handshake, messages.TIMED_OUT)
+
+    def _readable(self, handshake):
+        reader = handshake.reader
+        try:
+            received = reader.fill(handshake.socket)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            received = 0
+        if not received:
+            self._fail(handshake)
+            return
+        if handshake.state == LOOKUP:
+            # Lines typed meanwhile are handed over with the socket
+            return
+        if handshake.state not in (NICKNAME, REJOIN):
+            reader.clear()
+            return
+
+        while handshake.state in (NICKNAME, REJOIN):
+            if handshake.state == NICKNAME:
+                line = reader.read_line(NICKNAME_LINE)
+                if line is None:
+                    break
+                self._nickname(handshake, line.decode("latin-1"))
+            else:
+                line = reader.read_line(REJOIN_LINE)
+                if line is None:
+                    break
+                self._rejoin_code(handshake, line.decode("latin-1"))
+
+    def _nickname(self, handshake, line):
+        nickname, room_name = parse_room_request(line)
+        handshake.nickname, handshake.room = nickname, room_name
+        if not nickname and room_name is not None:
+            self._spectate(handshake, room_name)
+            return
+
+        rejoin_code = self.roster.get_rejoin_code(nickname)
+        if rejoin_code is None and self.sessions is not None:
+            rejoin_code = self.sessions.get_rejoin_code(nickname)
+        if rejoin_code is not None:
+            handshake.state = REJOIN
+            handshake.rejoin_code = rejoin_code
+            self.outbox.write(handshake.socket, messages.REJOIN_PROMPT)
+            self._after(self.settings["handshake_timeout"], self._timeout, handshake)
+            return
+
+        if not nickname.isalnum() or len(nickname) < 2 or len(nickname) > 32:
+            self.outbox.write(handshake.socket, messages.BAD_NICKNAME)
+            self._drain(handshake)
+            return
+
+        if room_name is not None and not is_room_name(room_name):
+            self.outbox.write(handshake.socket, messages.BAD_ROOM_NAME)
+            self._drain(handshake)
+            return
+
+        self._lookup(handshake)
+
+    def _join(self, handshake, owners):
+        """Carry on with the handshake once the coordinator told where it belongs."""
+        moved = self._moved(handshake, owners)
+        if moved is not None:
+            self._close(handshake, messages.MOVED.render(address=moved))
+            if self.metrics is not None:
+                self.metrics.redirects[self.number].inc()
+            return
+        if handshake.spectator:
+            # The server loop tells if the room is there to watch
+            self._finish(handshake)
+            return
+
+        if not self.settings["allow_same_source_ip"] and self.roster.is_address(
+            handshake.address
+        ):
+            self._fail(handshake, messages.ADDRESS_IN_USE)
+            return
+
+        handshake.rejoin_code = generate_rejoin_code()
+        self.outbox.write(
+            handshake.socket,
+            messages.encoded(self.game_data["opening"])
+            + messages.WELCOME.render(
+                rejoin_code=handshake.rejoin_code,
+                lobby_time=prettify_time(self.settings["lobby_time"]),
+            ),
+        )
+        self._finish(handshake)
+
+    def _spectate(self, handshake, room_name):
+        if not is_room_name(room_name):
+            self.outbox.write(handshake.socket, messages.BAD_ROOM_NAME)
+            self._drain(handshake)
+            return
+        handshake.spectator = True
+        self._lookup(handshake)
+
+    def _connected(self):
+        """Get the coordinator connection, or None without one for now.
+
+        A coordinator that can't be reached is only tried again COORDINATOR_RETRY
+        seconds later, connecting doesn't hold up every nickname meanwhile."""
+        if self.coordinator is None and monotonic() >= self.coordinator_retry:
+            try:
+                self.coordinator = cluster.connect(self.settings)
+            except OSError:
+                self.coordinator_retry = monotonic() + COORDINATOR_RETRY
+                return None
+            if self.coordinator is not None:
+                self.selector.register(self.coordinator, EVENT_READ)
+        return self.coordinator
+
+    def _lookup(self, handshake):
+        """Ask the coordinator where a handshake belongs, the reply comes later."""
+        coordinator = self._connected()
+        if coordinator is None:
+            self._join(handshake, None)
+            return
+        nickname = None if handshake.spectator else handshake.nickname
+        try:
+            coordinator.send_lookup(nickname, handshake.room)
+        except OSError:
+            self._lost_coordinator()
+            self._join(handshake, None)
+            return
+        handshake.state = LOOKUP
+        self.lookups.append(handshake)
+        self._after(coordinator.timeout, self._lookup_timeout, handshake)
+
+    def _located(self):
+        try:
+            owners = self.coordinator.receive()
+        except OSError:
+            self._lost_coordinator()
+            return
+        if not self.lookups:
+            return
+        # Replies come in the order of the lookups
+        handshake = self.lookups.popleft()
+        if handshake.state == LOOKUP:
+            self._join(handshake, owners)
+
+    def _lookup_timeout(self, handshake):
+        handshake.deadline = None
+        # A late reply would be taken for the next lookup
+        self._lost_coordinator()
+
+    def _lost_coordinator(self):
+        # Without a coordinator, this node carries on alone
+        if self.coordinator is not None:
+            self.selector.unregister(self.coordinator)
+            self.coordinator.close()
+            self.coordinator = None
+        self.coordinator_retry = monotonic() + COORDINATOR_RETRY
+        lookups, self.lookups = self.lookups, deque()
+        for handshake in lookups:
+            if handshake.state == LOOKUP:
+                self._join(handshake, None)
+
+    def _moved(self, handshake, owners):
+        """Get the node a player should join instead, or None to stay here."""
+        if owners is None:
+            return None
+        nickname = None if handshake.spectator else handshake.nickname
+        node = self.settings["node_address"]
+        for owner in (owners["nickname"], owners["room"]):
+            if owner is not None and owner != node:
+                return owner
+        # A full node sends new players to the least loaded one, spectators stay
+        least_loaded = owners["least_loaded"]
+        full = self.roster.count() >= self.settings["max_conn"]
+        if nickname is not None and full and least_loaded not in (None, node):
+            return least_loaded
+        return None
+
+    def _rejoin_code(self, handshake, line):
+        if line != handshake.rejoin_code:
+            self._fail(handshake)
+            return
+        # The server loop replaces the old connection
+        self.outbox.write(handshake.socket, messages.WELCOME_BACK)
+        handshake.rejoined = True
+        self._finish(handshake)
+
+    def _finish(self, handshake):
+        handshake.state = JOINED
+        if handshake.deadline is not None:
+            handshake.deadline.cancel()
+            handshake.deadline = None
+        # Output still buffered is sent first, the socket is handed over when drained
+        if self.outbox.pending(handshake.socket):
+            self.selector.modify(handshake.socket, EVENT_WRITE, handshake)
+        else:
+            self._hand_over(handshake)
+
+    def _hand_over(self, handshake):
+        self.selector.unregister(handshake.socket)
+        self.outbox.discard(handshake.socket)
+        self.on_joined(handshake)
+
+    def _fail(self, handshake, message=None):
+        if handshake.state == FAILED:
+            return
+        self._close(handshake, message)
+        if self.metrics is not None:
+            self.metrics.handshake_failures[self.number].inc()
+
+    def _close(self, handshake, message=None):
+        handshake.state = FAILED
+        if message is not None:
+            # Best effort, the connection gets closed right away
+            self.outbox.write(handshake.socket, message)
+        if handshake.deadline is not None:
+            handshake.deadline.cancel()
+            handshake.deadline = None
+        self.outbox.discard(handshake.socket)
+        self.selector.unregister(handshake.socket)
+        handshake.socket.close()
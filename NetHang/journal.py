@@ -0,0 +1,354 @@
+"""Game event journals, written behind in a compact binary format, and replays"""
+
+
+import argparse
+import os
+import queue
+import struct
+import sys
+from collections import deque
+from threading import Event, Lock, Thread
+from time import monotonic, perf_counter, strftime
+
+from NetHang.players import Player, PlayerList
+
+MAGIC = b"NHJL"
+VERSION = 1
+HEADER = struct.Struct("<4sH")
+# Kind, milliseconds since the journal was opened, and bytes of fields
+RECORD = struct.Struct("<BIH")
+FIELD = struct.Struct("<H")
+
+# Events, with their fields
+START = 1  # room, game class, random seed
+JOIN = 2  # nickname, score, "1" for bots
+INPUT = 3  # nickname, line, as taken by the game from its commands queue
+TIMEOUT = 4  # the game waited for input in vain
+ROUND = 5  # hanger nickname or "", guessword
+SCORE = 6  # nickname, score delta
+END = 7  # nickname and score of each player, in joining order
+
+KIND_NAMES = {
+    START: "start",
+    JOIN: "join",
+    INPUT: "input",
+    TIMEOUT: "timeout",
+    ROUND: "round",
+    SCORE: "score",
+    END: "end",
+}
+# Events the game records itself, checked when replaying
+GAME_EVENTS = (ROUND, SCORE)
+
+
+def pack(kind, milliseconds, fields):
+    """Get the bytes of a record, fields are strings or integers."""
+    payload = b"".join(
+        FIELD.pack(len(data)) + data
+        for data in (str(field).encode("latin-1")[:0xFFFF] for field in fields)
+    )
+    return RECORD.pack(kind, milliseconds, len(payload)) + payload
+
+
+def read_journal(path):
+    """Get the (kind, milliseconds, fields) records of a journal file.
+
+    Records cut short by a crash at the end of the file are left out."""
+    with open(path, "rb") as file:
+        data = file.read()
+    if len(data) < HEADER.size or HEADER.unpack_from(data) != (MAGIC, VERSION):
+        raise ValueError("Not a game journal: " + str(path))
+    records = []
+    offset = HEADER.size
+    while offset + RECORD.size <= len(data):
+        kind, milliseconds, size = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + size > len(data):
+            break
+        fields, end = [], offset + size
+        while offset < end:
+            length = FIELD.unpack_from(data, offset)[0]
+            offset += FIELD.size
+            fields.append(data[offset : offset + length].decode("latin-1"))
+            offset += length
+        records.append((kind, milliseconds, fields))
+    return records
+
+
+class Journal:
+    """Events of one game, buffered in memory until its JournalWriter writes them.
+
+    Recording only packs the event and appends it to a buffer, the game never waits
+    for the disk."""
+
+    def __init__(self, writer, path):
+        self.writer = writer
+        self.path = path
+        self.started = monotonic()
+        self.buffer = bytearray(HEADER.pack(MAGIC, VERSION))
+        self.closed = False
+
+    def record(self, kind, *fields):
+        """Add an event to the journal."""
+        milliseconds = int((monotonic() - self.started) * 1000) & 0xFFFFFFFF
+        data = pack(kind, milliseconds, fields)
+        with self.writer.lock:
+            self.buffer += data
+
+    def close(self):
+        """Close the file once the events recorded so far are written."""
+        with self.writer.lock:
+            self.closed = True
+
+
+class JournalWriter:
+    """Journals of the games of a game host, written behind by one thread.
+
+    Every flush_interval seconds the thread takes the buffered events of all journals
+    at once, appends them to their files, then syncs each file written to the disk
+    once, so a busy host costs a few writes and fsyncs per interval. Files are only
+    opened by the thread, and closed after the last events of their game."""
+
+    def __init__(self, directory, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = Lock()
+        self.journals = []
+        self.files = {}
+        self._stop = Event()
+        self._thread = None
+
+    def open(self, name):
+        """Start the journal of a game, in a new file named after it."""
+        path = os.path.join(self.directory, name + ".nhj")
+        journal = Journal(self, path)
+        with self.lock:
+            self.journals.append(journal)
+        return journal
+
+    def start(self):
+        """Start writing behind, from the process of the games."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = Thread(target=self._write_behind, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Write the last events and stop writing behind."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        else:
+            self.flush()
+        for file in self.files.values():
+            file.close()
+        self.files.clear()
+
+    def flush(self):
+        """Write and sync the events recorded so far, returns the bytes written."""
+        with self.lock:
+            batch = [(j, j.buffer, j.closed) for j in self.journals]
+            for journal, _, _ in batch:
+                journal.buffer = bytearray()
+            self.journals = [journal for journal, _, closed in batch if not closed]
+
+        written = []
+        for journal, data, _ in batch:
+            if data:
+                file = self.files.get(journal)
+                if file is None:
+                    file = self.files[journal] = open(journal.path, "ab")
+                file.write(data)
+                written.append(file)
+        for file in written:
+            file.flush()
+            os.fsync(file.fileno())
+        for journal, _, closed in batch:
+            if closed and journal in self.files:
+                self.files.pop(journal).close()
+        return sum(len(data) for _, data, _ in batch)
+
+    def _write_behind(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as error:
+                print("\x1B[31mGame journal: " + str(error) + "\x1B[0m")
+        self.flush()
+
+
+def journal_name(room_name, seed):
+    """Get the file name of the journal of a game, by room, start time and seed."""
+    return room_name + "-" + strftime("%Y%m%d-%H%M%S") + "-" + format(seed, "08x")
+
+
+class ReplayError(Exception):
+    """The journal does not have the input the replayed game waits for."""
+
+
+class _Discard:
+    """Outbox of replayed games, their output goes nowhere."""
+
+    def send_all(self, players, data):
+        """Drop output for all players."""
+
+    def send(self, player, data):
+        """Drop output for one player."""
+
+
+class _Recorder:
+    """Journal of a replayed game, keeping the events the game records."""
+
+    def __init__(self):
+        self.events = []
+
+    def record(self, kind, *fields):
+        """Keep an event, with fields as strings like in a journal file."""
+        self.events.append((kind, [str(field) for field in fields]))
+
+
+class ReplayQueue:
+    """Commands queue of a replayed game, giving back the recorded input in order.
+
+    Recorded timeouts are raised as soon as the game waits, so a replay runs as fast
+    as the game logic. Bot moves were recorded as input too, so bots putting their
+    moves are ignored."""
+
+    def __init__(self, inputs, players):
+        self.inputs = deque(inputs)
+        self.players = players
+        self.journal = _Recorder()
+
+    def expect(self, *nicknames):
+        """Input was recorded as the game took it, nothing to filter."""
+
+    def put(self, command):
+        """Ignore commands put by the game."""
+
+    def get(self, timeout=None):
+        """Get the next recorded command, raise queue.Empty for a recorded timeout."""
+        if not self.inputs:
+            raise ReplayError("Journal ended before the game.")
+        kind, fields = self.inputs.popleft()
+        if kind == TIMEOUT:
+            raise queue.Empty
+        nickname, line = fields
+        player = self.players.get_player(nickname=nickname) or Player(None, nickname)
+        return (player, line)
+
+
+class Replay:
+    """Outcome of replaying a journal: its events, scores and any divergence."""
+
+    def __init__(self, path, room, game_class, records):
+        self.path = path
+        self.room = room
+        self.game_class = game_class
+        self.records = records
+        self.rounds = 0
+        self.scores = None
+        self.expected_scores = None
+        # First event of the replay that differs from the journal, or None
+        self.divergence = None
+        self.seconds = 0.0
+
+
+def import_game_class(name):
+    """Import a game class by its "module.Class" name."""
+    module_name, class_name = name.rsplit(".", 1)
+    return getattr(__import__(module_name, fromlist=[class_name]), class_name)
+
+
+def replay(path, game_class=None):
+    """Run the game of a journal again on its recorded input, without sockets.
+
+    The game class is the one recorded, unless given, and gets the recorded random
+    seed. The events the replayed game records, rounds and score deltas, are
+    checked against the journal, then the final scores."""
+    records = read_journal(path)
+    if not records or records[0][0] != START:
+        raise ValueError("Journal without a start: " + str(path))
+    room, class_name, seed = records[0][2]
+    game_class = game_class or import_game_class(class_name)
+    result = Replay(path, room, game_class, records)
+
+    players = PlayerList()
+    players.outbox = _Discard()
+    inputs, expected = [], []
+    for kind, _, fields in records[1:]:
+        if kind == JOIN and fields[2] == "0":
+            players.add_player(Player(None, fields[0], score=int(fields[1])))
+        elif kind in (INPUT, TIMEOUT):
+            inputs.append((kind, fields))
+        elif kind in GAME_EVENTS or kind == JOIN:
+            expected.append((kind, fields))
+        elif kind == END:
+            result.expected_scores = dict(zip(fields[0::2], map(int, fields[1::2])))
+
+    commands_queue = ReplayQueue(inputs, players)
+    game = game_class(players, commands_queue)
+    if hasattr(game, "rng"):
+        game.rng.seed(int(seed))
+    started = perf_counter()
+    ended = None
+    try:
+        game.run()
+    except ReplayError as error:
+        ended = str(error)
+    result.seconds = perf_counter() - started
+    result.scores = players.scoreboard()
+
+    events = commands_queue.journal.events
+    result.rounds = sum(kind == ROUND for kind, _ in events)
+    for number, (got, wanted) in enumerate(zip(events, expected)):
+        if got != wanted:
+            result.divergence = "Event {} was {}, replayed {}.".format(
+                number, _describe(wanted), _describe(got)
+            )
+            return result
+    if ended is not None:
+        # Games still running when their host stopped have no end either
+        result.divergence = ended
+    elif len(events) != len(expected):
+        result.divergence = "{} game events, replayed {}.".format(
+            len(expected), len(events)
+        )
+    elif result.expected_scores is not None and result.expected_scores != result.scores:
+        result.divergence = "Final scores differ."
+    return result
+
+
+def _describe(event):
+    kind, fields = event
+    return KIND_NAMES.get(kind, str(kind)) + " " + " ".join(fields)
+
+
+def cli_replay():
+    """Replay game journals from the command line."""
+    parser = argparse.ArgumentParser(description="NetHang game journal replay.")
+    parser.add_argument("journals", nargs="+", help="Journal files (.nhj).")
+    parser.add_argument("--game", help="Game class to replay with, module.Class.")
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Replays of each journal, for timing."
+    )
+    args = parser.parse_args()
+
+    game_class = import_game_class(args.game) if args.game else None
+    diverged = False
+    for path in args.journals:
+        seconds = []
+        for _ in range(max(1, args.repeat)):
+            result = replay(path, game_class)
+            seconds.append(result.seconds)
+        print("\x1B[36m" + path + "\x1B[0m: room " + result.room)
+        print(
+            "  {} events, {} rounds, best replay in {:.2f} ms".format(
+                len(result.records), result.rounds, min(seconds) * 1000
+            )
+        )
+        print("  scores " + str(result.scores))
+        if result.divergence is not None:
+            diverged = True
+            print("  \x1B[31mdiverged: " + result.divergence + "\x1B[0m")
+    sys.exit(1 if diverged else 0)
@@ -0,0 +1,371 @@
+"""Load test harness, playing many simulated clients against a server on localhost"""
+
+
+import argparse
+import asyncio
+import ipaddress
+import os
+import re
+from math import ceil
+from random import choice, expovariate, random
+from time import monotonic
+
+from NetHang.server import NetHangServer
+
+WORDS = ("hangman", "network", "latency", "socket", "terminal", "python")
+LETTERS = "etaoinshrdlcumwfgypbvkjxqz"
+
+_REJOIN_CODE = re.compile(rb"rejoin code is \x1B\[01;91m(\d+)")
+_EVENTS = re.compile(
+    rb"type the guessword: |It's your turn!|Only guess letters|Between 2 and 80"
+    rb"|Round \d+/|Game ended\.|Not enough players\.|ping (\d+):(\d+)\n"
+)
+
+
+def is_local(host):
+    """Check if a host name or address is on this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def percentiles(values):
+    """Get the count, p50, p99 and max of a list of seconds, or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(fraction):
+        return ordered[max(0, ceil(fraction * len(ordered)) - 1)]
+
+    return {
+        "count": len(ordered),
+        "p50": rank(0.5),
+        "p99": rank(0.99),
+        "max": ordered[-1],
+    }
+
+
+def process_tree_usage(pid):
+    """Get CPU seconds and RSS bytes of a process and all its children, from /proc.
+
+    Returns None where /proc is not available."""
+    if not os.path.isdir("/proc"):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    page_size = os.sysconf("SC_PAGE_SIZE")
+
+    stats = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/" + entry + "/stat", encoding="latin-1") as stat_file:
+                # Fields after the command name, which can contain spaces
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        stats[int(entry)] = fields
+
+    tree, pending = set(), [pid]
+    while pending:
+        current = pending.pop()
+        tree.add(current)
+        pending.extend(
+            child
+            for child, fields in stats.items()
+            if int(fields[1]) == current and child not in tree
+        )
+
+    cpu, rss = 0.0, 0
+    for current in tree & stats.keys():
+        fields = stats[current]
+        cpu += (int(fields[11]) + int(fields[12])) / ticks
+        rss += int(fields[21]) * page_size
+    return cpu, rss
+
+
+def _raise_open_files_limit(needed):
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+
+class LoadTest:
+    """Simulated clients, joining and playing full games of hangman.
+
+    Clients arrive at arrival_rate per second, a rejoin_ratio share of them rejoins
+    with its code from a second connection, each sends chat_messages lobby chat lines
+    and types with typing_delay seconds of mean delay. Without a port, a server is
+    started for the test, with the given engine and priority settings."""
+
+    def __init__(
+        self,
+        clients=100,
+        host="localhost",
+        port=None,
+        arrival_rate=50.0,
+        rejoin_ratio=0.1,
+        typing_delay=0.2,
+        chat_messages=1,
+        timeout=120.0,
+        engine=None,
+        settings=None,
+        server_pid=None,
+    ):
+        if not is_local(host):
+            raise ValueError("Load tests only run against this machine: " + host)
+        self.clients = clients
+        self.host = host
+        self.port = port
+        self.arrival_rate = arrival_rate
+        self.rejoin_ratio = rejoin_ratio
+        self.typing_delay = typing_delay
+        self.chat_messages = chat_messages
+        self.timeout = timeout
+        self.engine = engine
+        self.settings = settings or {}
+        self.server_pid = server_pid
+
+        self.samples = {"join": [], "rejoin": [], "fanout": [], "turn": []}
+        # Send times of lobby chat lines, by client number and sequence number
+        self.chats = {}
+        self.joined = 0
+        self.failed = 0
+        self.finished = 0
+
+    def run(self):
+        """Run the load test, returns the report dict."""
+        _raise_open_files_limit(2 * self.clients + 256)
+        server = None
+        port, pid = self.port, self.server_pid
+        if port is None:
+            settings = {
+                "max_conn": max(20, self.clients),
+                "allow_same_source_ip": True,
+                "delay_factor": 0.0,
+                "lobby_time": 5,
+                "room_size": 8,
+            }
+            settings.update(self.settings)
+            server = NetHangServer(
+                self.host, priority_settings=settings, engine=self.engine
+            )
+            server.run()
+            port, pid = server.server_port, server.server_process.pid
+        try:
+            return asyncio.run(self._run(port, pid))
+        finally:
+            if server is not None:
+                server.stop()
+
+    async def _run(self, port, pid):
+        started = monotonic()
+        before = process_tree_usage(pid) if pid is not None else None
+        peak_rss = [0]
+        sampler = None
+        if before is not None:
+            sampler = asyncio.create_task(self._sample_rss(pid, peak_rss))
+
+        tasks = [
+            asyncio.create_task(self._client(number, port))
+            for number in range(self.clients)
+        ]
+        _, pending = await asyncio.wait(tasks, timeout=self.timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        report = {
+            "clients": self.clients,
+            "joined": self.joined,
+            "failed": self.failed,
+            "finished": self.finished,
+            "timed_out": len(pending),
+            "duration": monotonic() - started,
+        }
+        for name, values in self.samples.items():
+            report[name + "_latency"] = percentiles(values)
+
+        if sampler is not None:
+            sampler.cancel()
+            after = process_tree_usage(pid)
+            report["server_cpu_seconds"] = after[0] - before[0]
+            report["server_rss_peak"] = max(peak_rss[0], after[1])
+        return report
+
+    async def _sample_rss(self, pid, peak_rss):
+        while True:
+            peak_rss[0] = max(peak_rss[0], process_tree_usage(pid)[1])
+            await asyncio.sleep(0.5)
+
+    def _typing(self):
+        return expovariate(1 / self.typing_delay) if self.typing_delay > 0 else 0
+
+    async def _client(self, number, port):
+        await asyncio.sleep(number / self.arrival_rate)
+        nickname = "load" + str(number)
+        writer = None
+        try:
+            reader, writer, code = await self._join(port, nickname)
+            if random() < self.rejoin_ratio:
+                old_writer = writer
+                reader, writer = await self._rejoin(port, nickname, code)
+                old_writer.close()
+            self.joined += 1
+            await self._play(number, reader, writer)
+        except (OSError, EOFError, asyncio.IncompleteReadError):
+            self.failed += 1
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def _join(self, port, nickname):
+        started = monotonic()
+        reader, writer = await asyncio.open_connection(self.host, port)
+        await reader.readuntil(b"Nickname: ")
+        writer.write(nickname.encode("latin-1") + b"\n")
+        data = await reader.readuntil(b"You are in room")
+        self.samples["join"].append(monotonic() - started)
+        return reader, writer, _REJOIN_CODE.search(data).group(1)
+
+    async def _rejoin(self, port, nickname, code):
+        started = monotonic()
+        reader, writer = await asyncio.open_connection(self.host, port)
+        await reader.readuntil(b"Nickname: ")
+        writer.write(nickname.encode("latin-1") + b"\n")
+        await reader.readuntil(b"Code: ")
+        writer.write(code + b"\n")
+        await reader.readuntil(b"You are in room")
+        self.samples["rejoin"].append(monotonic() - started)
+        return reader, writer
+
+    async def _play(self, number, reader, writer):
+        """Chat in the lobby, then play as hanger or guesser until the game ends."""
+        buffer = b""
+        word = None
+        tried = []
+        guess_sent = None
+        in_lobby = True
+        chats_left = self.chat_messages
+        next_chat = monotonic() + self._typing()
+
+        while True:
+            wait = None
+            if in_lobby and chats_left > 0:
+                wait = max(0, next_chat - monotonic())
+            try:
+                data = await asyncio.wait_for(reader.read(4096), wait)
+            except asyncio.TimeoutError:
+                sequence = self.chat_messages - chats_left
+                self.chats[(number, sequence)] = monotonic()
+                writer.write(b"ping %d:%d\n" % (number, sequence))
+                chats_left -= 1
+                next_chat = monotonic() + self._typing()
+                continue
+            if not data:
+                raise EOFError
+            if guess_sent is not None:
+                self.samples["turn"].append(monotonic() - guess_sent)
+                guess_sent = None
+
+            buffer += data
+            end = 0
+            for event in _EVENTS.finditer(buffer):
+                end = event.end()
+                token = event.group(0)
+                if token.startswith(b"ping"):
+                    sent = self.chats.get((int(event.group(1)), int(event.group(2))))
+                    if sent is not None:
+                        self.samples["fanout"].append(monotonic() - sent)
+                elif token.startswith(b"Round"):
+                    in_lobby = False
+                    tried = []
+                elif token in (b"type the guessword: ", b"Between 2 and 80"):
+                    await asyncio.sleep(self._typing())
+                    word = choice(WORDS)
+                    writer.write(word.encode("latin-1") + b"\n")
+                elif token in (b"It's your turn!", b"Only guess letters"):
+                    await asyncio.sleep(self._typing())
+                    letter = next(
+                        (letter for letter in LETTERS if letter not in tried), "e"
+                    )
+                    tried.append(letter)
+                    writer.write(letter.encode("latin-1") + b"\n")
+                    guess_sent = monotonic()
+                else:
+                    # Game ended, or not enough players for it
+                    self.finished += 1
+                    return
+            # Keep a tail for events split between reads
+            buffer = buffer[end:][-128:]
+
+
+def format_report(report):
+    """Format a load test report for printing."""
+    lines = [
+        "Clients: {clients} ({joined} joined, {failed} failed, {timed_out} timed out)"
+        ", games finished: {finished}, in {duration:.1f}s".format(**report)
+    ]
+    for name in ("join", "rejoin", "fanout", "turn"):
+        stats = report[name + "_latency"]
+        if stats is None:
+            lines.append(name + " latency: no samples")
+            continue
+        lines.append(
+            "{} latency: p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms ({} samples)".format(
+                name,
+                stats["p50"] * 1000,
+                stats["p99"] * 1000,
+                stats["max"] * 1000,
+                stats["count"],
+            )
+        )
+    if "server_cpu_seconds" in report:
+        lines.append(
+            "Server CPU: {:.2f}s, peak RSS: {:.1f} MiB".format(
+                report["server_cpu_seconds"], report["server_rss_peak"] / 2**20
+            )
+        )
+    return "\n".join(lines)
+
+
+def cli_load_test():
+    """Run a load test from the command line, printing the report."""
+    parser = argparse.ArgumentParser(description="NetHang load test, localhost only.")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--arrival-rate", type=float, default=50.0)
+    parser.add_argument("--rejoin-ratio", type=float, default=0.1)
+    parser.add_argument("--typing-delay", type=float, default=0.2)
+    parser.add_argument("--chat-messages", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--engine", choices=("multiprocessing", "asyncio"))
+    parser.add_argument("--room-size", type=int, default=8)
+    parser.add_argument("--lobby-time", type=int, default=5)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, help="Test a running server instead.")
+    parser.add_argument("--server-pid", type=int, help="Running server, for CPU/RSS.")
+    args = parser.parse_args()
+
+    load_test = LoadTest(
+        clients=args.clients,
+        host=args.host,
+        port=args.port,
+        arrival_rate=args.arrival_rate,
+        rejoin_ratio=args.rejoin_ratio,
+        typing_delay=args.typing_delay,
+        chat_messages=args.chat_messages,
+        timeout=args.timeout,
+        engine=args.engine,
+        settings={"room_size": args.room_size, "lobby_time": args.lobby_time},
+        server_pid=args.server_pid,
+    )
+    print(format_report(load_test.run()))
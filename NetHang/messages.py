@@ -0,0 +1,80 @@
+"""Server messages as pre-encoded bytes, built without re-encoding per player"""
+
+
+import re
+from functools import lru_cache
+
+from NetHang.util import prettify_time
+
+# NetHang globally uses "latin-1", where bytes and characters map one to one
+ENCODING = "latin-1"
+
+
+@lru_cache(maxsize=256)
+def encoded(text):
+    """Get a constant string as bytes, encoding it only the first time."""
+    return text.encode(ENCODING)
+
+
+class Template:
+    """A message with {fields}, its constant parts encoded once.
+
+    Rendering joins the constant bytes with the fields, encoding only the fields given
+    as strings, so the result can be shared by every recipient as it is."""
+
+    def __init__(self, text):
+        parts = re.split(r"\{(\w+)\}", text)
+        self.constants = [part.encode(ENCODING) for part in parts[0::2]]
+        self.fields = parts[1::2]
+
+    def render(self, **fields):
+        """Get the message bytes, fields can be strings or bytes."""
+        chunks = [self.constants[0]]
+        for name, constant in zip(self.fields, self.constants[1:]):
+            value = fields[name]
+            chunks.append(value if isinstance(value, bytes) else value.encode(ENCODING))
+            chunks.append(constant)
+        return b"".join(chunks)
+
+
+BANNED = b"This client IP is banned!\n"
+NICKNAME_PROMPT = b"Nickname: "
+REJOIN_PROMPT = b"Rejoining as this user? Code: "
+WELCOME_BACK = b"Welcome back!\n"
+BAD_NICKNAME = b"Only alphanumeric between 2 and 32 characters!\n"
+BAD_ROOM_NAME = b"Room names are alphanumeric, up to 16 characters!\n"
+ADDRESS_IN_USE = b"This client IP is already in use!\n"
+SERVER_FULL = b"Server is full!\n"
+TOO_MANY_CONNECTIONS = b"Too many connections from this client IP, slow down!\n"
+TIMED_OUT = b"\nToo slow, disconnected!\n"
+UPGRADED = b"\nServer upgraded, back to the lobby!\n"
+NO_ROOM = b"There is no room by that name!\n"
+ROOM_CLOSED = b"\nThe room was closed.\n"
+
+WELCOME = Template(
+    "Your rejoin code is \x1B[01;91m{rejoin_code}\x1B[0m.\n"
+    "Lobby time is \x1B[01;36m{lobby_time}\x1B[0m.\n\n"
+)
+IN_ROOM = Template("You are in room \x1B[01;36m{room}\x1B[0m.\n")
+WATCHING = Template("You are watching room \x1B[01;36m{room}\x1B[0m.\n")
+CHAT_PREFIX = Template("\x1B[90m<{nickname}>:\x1B[0m ")
+MOVED = Template(
+    "This game is on another server, reconnect to \x1B[01;36m{address}\x1B[0m.\n"
+)
+
+
+@lru_cache(maxsize=64)
+def countdown(seconds):
+    """Get the lobby countdown announcement for some seconds left."""
+    return encoded("\r\x1B[01;36mStarting in " + prettify_time(seconds) + ".\x1B[0m\n")
+
+
+def chat_line(nickname, data):
+    """Get lobby chat, received as bytes without the newline, for the other players."""
+    prefix = CHAT_PREFIX.render(nickname=nickname)
+    return b"".join((prefix, data.replace(b"\n", b"\n" + prefix), b"\n"))
+
+
+def server_notice(sign, nickname):
+    """Get a "-nickname" or "+nickname" command, from the server to a game."""
+    return (sign + nickname).encode(ENCODING)
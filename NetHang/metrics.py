@@ -0,0 +1,299 @@
+"""Runtime metrics shared by the server processes, exported in Prometheus format"""
+
+
+from ctypes import c_double
+from selectors import DefaultSelector, EVENT_READ
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing.sharedctypes import RawArray
+
+# Loop tick durations in seconds, ticks over 0.1 count as overruns
+TICK_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class Metric:
+    """A value in the shared array of a registry, with its labels."""
+
+    def __init__(self, registry, index, labels):
+        self.registry = registry
+        self.index = index
+        self.labels = labels
+
+    def get(self):
+        """Get the current value."""
+        return self.registry.values[self.index]
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    def inc(self, value=1):
+        """Add to the counter."""
+        self.registry.values[self.index] += value
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    def set(self, value):
+        """Set the gauge."""
+        self.registry.values[self.index] = value
+
+    def inc(self, value=1):
+        """Add to the gauge."""
+        self.registry.values[self.index] += value
+
+
+class Histogram(Metric):
+    """Observations counted in buckets, with their sum and count.
+
+    Uses len(buckets) + 2 values: one per bucket, then the sum and the count."""
+
+    def __init__(self, registry, index, labels, buckets):
+        super().__init__(registry, index, labels)
+        self.buckets = buckets
+
+    def observe(self, value):
+        """Count an observation in its bucket."""
+        values = self.registry.values
+        for offset, bound in enumerate(self.buckets):
+            if value <= bound:
+                values[self.index + offset] += 1
+                break
+        values[self.index + len(self.buckets)] += value
+        values[self.index + len(self.buckets) + 1] += 1
+
+    def get(self):
+        """Get the count of observations."""
+        return self.registry.values[self.index + len(self.buckets) + 1]
+
+
+class Registry:
+    """Metrics in shared memory, readable by any process forked after declaring them.
+
+    There are no locks: each value must be written by one process only, which is why
+    per-process metrics get labels, like one counter for each accept worker. All
+    metrics must be declared before the processes using them are started."""
+
+    def __init__(self, capacity=256):
+        self.values = RawArray(c_double, capacity)
+        self.families = {}
+        self._used = 0
+
+    def _add(self, name, kind, description, metric, size=1):
+        if self._used + size > len(self.values):
+            raise ValueError("Metrics registry is full.")
+        family = self.families.setdefault(name, (kind, description, []))
+        if family[0] != kind:
+            raise ValueError("Metric " + name + " is already a " + family[0] + ".")
+        family[2].append(metric)
+        self._used += size
+        return metric
+
+    def counter(self, name, description, **labels):
+        """Declare a counter, or one labeled counter of a family."""
+        return self._add(
+            name, "counter", description, Counter(self, self._used, labels)
+        )
+
+    def gauge(self, name, description, **labels):
+        """Declare a gauge, or one labeled gauge of a family."""
+        return self._add(name, "gauge", description, Gauge(self, self._used, labels))
+
+    def histogram(self, name, description, buckets, **labels):
+        """Declare a histogram with the upper bounds of its buckets."""
+        return self._add(
+            name,
+            "histogram",
+            description,
+            Histogram(self, self._used, labels, buckets),
+            len(buckets) + 2,
+        )
+
+    def render(self):
+        """Get all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, (kind, description, metrics) in self.families.items():
+            lines.append("# HELP " + name + " " + description)
+            lines.append("# TYPE " + name + " " + kind)
+            for metric in metrics:
+                values = self.values
+                if kind != "histogram":
+                    lines.append(
+                        name + _labels(metric.labels) + " " + _number(metric.get())
+                    )
+                    continue
+                cumulative = 0
+                for offset, bound in enumerate(metric.buckets):
+                    cumulative += values[metric.index + offset]
+                    lines.append(
+                        name
+                        + "_bucket"
+                        + _labels(dict(metric.labels, le=_number(bound)))
+                        + " "
+                        + _number(cumulative)
+                    )
+                count = values[metric.index + len(metric.buckets) + 1]
+                lines.append(
+                    name
+                    + "_bucket"
+                    + _labels(dict(metric.labels, le="+Inf"))
+                    + " "
+                    + _number(count)
+                )
+                lines.append(
+                    name
+                    + "_sum"
+                    + _labels(metric.labels)
+                    + " "
+                    + _number(values[metric.index + len(metric.buckets)])
+                )
+                lines.append(
+                    name + "_count" + _labels(metric.labels) + " " + _number(count)
+                )
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            key + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+            for key, value in labels.items()
+        )
+        + "}"
+    )
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class ServerMetrics:
+    """All metrics of a NetHangServer, declared before its processes start."""
+
+    def __init__(self, workers=1, hosts=1):
+        self.registry = Registry()
+        registry = self.registry
+
+        self.tick_seconds = registry.histogram(
+            "nethang_loop_tick_seconds",
+            "Time spent handling one server loop tick, or event loop lag.",
+            TICK_BUCKETS,
+        )
+        self.tick_overruns = registry.counter(
+            "nethang_loop_tick_overruns_total",
+            "Server loop ticks longer than a tenth of a second.",
+        )
+        self.accepted = [
+            registry.counter(
+                "nethang_accepted_total",
+                "Connections accepted, by accept worker.",
+                worker=str(number),
+            )
+            for number in range(workers)
+        ]
+        self.handshake_failures = [
+            registry.counter(
+                "nethang_handshake_failures_total",
+                "Connections dropped before joining, by accept worker.",
+                worker=str(number),
+            )
+            for number in range(workers)
+        ]
+        self.refused = [
+            registry.counter(
+                "nethang_refused_total",
+                "Connections refused by admission control, by accept worker.",
+                worker=str(number),
+            )
+            for number in range(workers)
+        ]
+        self.redirects = [
+            registry.counter(
+                "nethang_redirects_total",
+                "Connections sent to another cluster node, by accept worker.",
+                worker=str(number),
+            )
+            for number in range(workers)
+        ]
+        self.joined = [
+            registry.counter(
+                "nethang_joined_total",
+                "Players handed to the server loop, by accept worker.",
+                worker=str(number),
+            )
+            for number in range(workers)
+        ]
+        self.dequeued = registry.counter(
+            "nethang_joined_dequeued_total",
+            "Players taken by the server loop from the accept workers.",
+        )
+        self.write_queue_depth = registry.gauge(
+            "nethang_players_write_queue_depth",
+            "Players waiting for the server loop, from the accept workers.",
+        )
+        self.commands_queue_depth = [
+            registry.gauge(
+                "nethang_commands_queue_depth",
+                "Commands waiting for the games of a game host.",
+                host=str(number),
+            )
+            for number in range(hosts)
+        ]
+        self.sent_messages = registry.counter(
+            "nethang_sent_messages_total", "Messages queued for players."
+        )
+        self.sent_bytes = registry.counter(
+            "nethang_sent_bytes_total", "Bytes written to player sockets."
+        )
+        self.evictions = registry.counter(
+            "nethang_evictions_total", "Players disconnected for falling behind."
+        )
+        self.players = registry.gauge("nethang_players", "Connected players.")
+        self.spectators = registry.gauge("nethang_spectators", "Connected spectators.")
+        self.rooms = registry.gauge("nethang_rooms", "Open rooms.")
+        self.active_games = registry.gauge("nethang_active_games", "Running games.")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve the metrics on any path."""
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsServer(HTTPServer):
+    """HTTP scrape endpoint for a registry, only listening on localhost."""
+
+    def __init__(self, registry, port=0, listener=None):
+        super().__init__(("127.0.0.1", port), _MetricsHandler, listener is None)
+        if listener is not None:
+            # Taken over from a running server, already bound and listening
+            self.socket.close()
+            self.socket = listener
+            self.server_address = listener.getsockname()
+            self.server_name, self.server_port = self.server_address[:2]
+        self.registry = registry
+
+    def serve_while(self, running, stopping):
+        """Serve scrapes until stopping is readable, with the running flag cleared."""
+        with DefaultSelector() as selector:
+            selector.register(self, EVENT_READ)
+            selector.register(stopping, EVENT_READ)
+            try:
+                while bool(running.value):
+                    for key, _ in selector.select():
+                        if key.fileobj is self:
+                            self._handle_request_noblock()
+            except KeyboardInterrupt:
+                pass
+        self.server_close()
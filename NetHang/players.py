@@ -10,18 +10,53 @@ def generate_rejoin_code():
 
 
 def send_all(players, string, enc="latin-1"):
-    """Send all player sockets the same message, quiet fail."""
+    """Send all player sockets the same message, string or bytes, quiet fail."""
+    data = string if isinstance(string, bytes) else string.encode(enc)
+    if players.outbox is not None:
+        players.outbox.send_all(players, data)
+        return
+    for socket in players.get_sockets():
+        if socket is None:
+            continue
+        try:
+            socket.send(data)
+        except (BrokenPipeError, BlockingIOError, ConnectionResetError):
+            pass
+
+
+def send_to(players, player, string, enc="latin-1"):
+    """Send one player a message, string or bytes, through the outbox, quiet fail."""
+    if isinstance(player, Bot):
+        return
+    data = string if isinstance(string, bytes) else string.encode(enc)
+    if players.outbox is not None:
+        players.outbox.send(player, data)
+        return
     try:
-        for socket in players.get_sockets():
-            socket.send(string.encode(enc))
-    except (BrokenPipeError, BlockingIOError):
+        player.socket.send(data)
+    except (BrokenPipeError, BlockingIOError, ConnectionResetError):
         pass
 
 
+def send_frame(players, changes, whole, enc="latin-1"):
+    """Share a game frame with the spectators, if the outbox of the players has any.
+
+    Both are strings encoded once here, changes is None for frames only sent whole."""
+    if not hasattr(players.outbox, "send_frame"):
+        return
+    players.outbox.send_frame(
+        None if changes is None else changes.encode(enc), whole.encode(enc)
+    )
+
+
 class Player:
     """Each Player combines a socket and a nickname, and can have an address or rejoin code."""
 
-    def __init__(self, socket, nickname, address=None, rejoin_code=None, score=None):
+    __slots__ = ("socket", "nickname", "address", "rejoin_code", "score", "room")
+
+    def __init__(
+        self, socket, nickname, address=None, rejoin_code=None, score=None, room=None
+    ):
         self.socket = socket
         self.nickname = nickname
         self.address = address
@@ -30,81 +65,125 @@ class Player:
         else:
             self.rejoin_code = rejoin_code
         self.score = score or 0
+        # Requested room name while joining, then the name of the room the player is in
+        self.room = room
+
+
+class Bot(Player):
+    """Player run by the server, without a socket.
+
+    Bot nicknames aren't alphanumeric, so nobody joining can take them."""
+
+    __slots__ = ()
+
+    def __init__(self, nickname, score=None):
+        super().__init__(None, nickname, score=score)
 
 
 class PlayerList:
-    """List of all players, using the Player class."""
+    """List of all players, using the Player class.
+
+    Players are indexed by nickname, socket and address, while iteration keeps the
+    joining order. Copies share the indexes until either side is modified.
+    If outbox is set, send_all() and send_to() go through it instead of sockets."""
 
     def __init__(self):
-        self.player_list = []
+        self._by_nickname = {}
+        self._by_socket = {}
+        self._addresses = {}
+        self._shared = False
+        self.outbox = None
+
+    def __iter__(self):
+        return iter(tuple(self._by_nickname.values()))
+
+    def __len__(self):
+        return len(self._by_nickname)
+
+    @property
+    def player_list(self):
+        """Get a list of all players, in joining order."""
+        return list(self._by_nickname.values())
+
+    def _own(self):
+        """Copy the shared indexes before the first change (copy-on-write)."""
+        if self._shared:
+            self._by_nickname = self._by_nickname.copy()
+            self._by_socket = self._by_socket.copy()
+            self._addresses = self._addresses.copy()
+            self._shared = False
 
     def count(self):
         """Get the number of players."""
-        return len(self.player_list)
+        return len(self._by_nickname)
 
     def copy(self):
         """Copy and return new list location."""
         new_pl = PlayerList()
-        new_pl.player_list = self.player_list.copy()
+        new_pl._by_nickname = self._by_nickname
+        new_pl._by_socket = self._by_socket
+        new_pl._addresses = self._addresses
+        new_pl._shared = self._shared = True
+        new_pl.outbox = self.outbox
         return new_pl
 
     def is_player(self, nickname=None, socket=None, address=None):
         """Check if there is a player with a certain nickname, socket or address."""
-        if nickname is not None:
-            for player in self.player_list:
-                if player.nickname == nickname:
-                    return True
-        if socket is not None:
-            for player in self.player_list:
-                if player.socket == socket:
-                    return True
-        if address is not None:
-            for player in self.player_list:
-                if player.address == address:
-                    return True
-        return False
+        return (
+            (nickname is not None and nickname in self._by_nickname)
+            or (socket is not None and socket in self._by_socket)
+            or (address is not None and address in self._addresses)
+        )
 
     def get_player(self, nickname=None, socket=None):
         """Get a player by nickname or socket."""
-        if nickname is not None:
-            for player in self.player_list:
-                if player.nickname == nickname:
-                    return player
+        if nickname is not None and nickname in self._by_nickname:
+            return self._by_nickname[nickname]
         if socket is not None:
-            for player in self.player_list:
-                if player.socket == socket:
-                    return player
+            return self._by_socket.get(socket)
         return None
 
-    def get_random_player(self):
-        """Get a player by chance."""
+    def get_random_player(self, rng=None):
+        """Get a player by chance, from a random.Random if given."""
+        if rng is not None:
+            return rng.choice(self.player_list)
         return choice(self.player_list)
 
     def get_sockets(self):
         """Get a list of all player sockets."""
-        return [player.socket for player in self.player_list]
+        return [player.socket for player in self._by_nickname.values()]
 
     def get_nicknames(self):
         """Get a list of all player nicknames."""
-        return [player.nickname for player in self.player_list]
+        return list(self._by_nickname)
 
     def add_player(self, player):
         """Add a player of Player type."""
-        self.player_list.append(player)
+        if player.nickname in self._by_nickname:
+            self.drop_player(nickname=player.nickname)
+        self._own()
+        self._by_nickname[player.nickname] = player
+        if player.socket is not None:
+            self._by_socket[player.socket] = player
+        self._addresses[player.address] = self._addresses.get(player.address, 0) + 1
 
     def drop_player(self, nickname=None, socket=None):
         """Drop a player by nickname or socket."""
-        if nickname is not None:
-            for i, player in enumerate(self.player_list):
-                if player.nickname == nickname:
-                    del self.player_list[i]
-                    break
-        if socket is not None:
-            for i, player in enumerate(self.player_list):
-                if player.socket == socket:
-                    del self.player_list[i]
-                    break
+        for player in (
+            self._by_nickname.get(nickname) if nickname is not None else None,
+            self._by_socket.get(socket) if socket is not None else None,
+        ):
+            if player is None or player.nickname not in self._by_nickname:
+                continue
+            self._own()
+            del self._by_nickname[player.nickname]
+            if self._by_socket.get(player.socket) is player:
+                del self._by_socket[player.socket]
+            if self._addresses[player.address] == 1:
+                del self._addresses[player.address]
+            else:
+                self._addresses[player.address] -= 1
 
     def scoreboard(self):
         """Get a dict of players and scores."""
-        return {player.nickname: player.score for player in self.player_list}
+        return {player.nickname: player.score for player in self._by_nickname.values()}
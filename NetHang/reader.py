@@ -0,0 +1,97 @@
+"""Buffered input of connections, split into lines"""
+
+
+class LineReader:
+    """Input buffer of one connection, received into preallocated memory.
+
+    Lines end with LF or CRLF, and are taken in order however they arrived: many in one
+    packet or one split over many. Lines longer than max_line bytes are cut there, and
+    the rest up to their end is dropped."""
+
+    def __init__(self, max_line=256, capacity=4096):
+        self.max_line = max_line
+        self.buffer = bytearray(max(capacity, 2 * max_line + 2))
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        # Dropping the rest of a line that was too long
+        self.skipping = False
+
+    def __len__(self):
+        return self.end - self.start
+
+    def fill(self, socket):
+        """Receive available input from a socket, returns the byte count, 0 at EOF."""
+        return self.received(socket.recv_into(self.free()))
+
+    def free(self):
+        """Get the free memory to receive input into, followed by received()."""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            self._compact()
+            if self.end == len(self.buffer):
+                # Lines were not taken, rather than stalling drop this input
+                self.clear()
+                self.skipping = True
+        return self.view[self.end :]
+
+    def received(self, count):
+        """Add the byte count received into free(), returns it."""
+        self.end += count
+        return count
+
+    def feed(self, data):
+        """Add input received some other way, as far as it fits."""
+        self._compact()
+        data = data[: len(self.buffer) - self.end]
+        self.buffer[self.end : self.end + len(data)] = data
+        self.end += len(data)
+
+    def read_line(self, max_line=None):
+        """Take the next complete line without its ending, or None if there is none."""
+        limit = max_line or self.max_line
+        while True:
+            newline = self.buffer.find(b"\n", self.start, self.end)
+            if self.skipping:
+                if newline == -1:
+                    self.start = self.end
+                    return None
+                self.start = newline + 1
+                self.skipping = False
+                continue
+
+            if newline == -1 or newline - self.start > limit:
+                if len(self) <= limit:
+                    return None
+                line = bytes(self.view[self.start : self.start + limit])
+                self.start += limit
+                self.skipping = True
+                return line
+
+            line = bytes(self.view[self.start : newline])
+            self.start = newline + 1
+            return line[:-1] if line.endswith(b"\r") else line
+
+    def lines(self):
+        """Take all complete lines, in order."""
+        lines = []
+        while True:
+            line = self.read_line()
+            if line is None:
+                return lines
+            lines.append(line)
+
+    def pending(self):
+        """Get the buffered input not taken as lines yet."""
+        return b"" if self.skipping else bytes(self.view[self.start : self.end])
+
+    def clear(self):
+        """Drop all buffered input."""
+        self.start = self.end = 0
+        self.skipping = False
+
+    def _compact(self):
+        size = len(self)
+        self.buffer[:size] = bytes(self.view[self.start : self.end])
+        self.start, self.end = 0, size
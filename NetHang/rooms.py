@@ -0,0 +1,443 @@
+"""Rooms of players, and the pool of game host processes running their games"""
+
+
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+from random import getrandbits
+from socket import socketpair
+from threading import Lock, Thread
+
+from NetHang.commands import CommandQueue
+from NetHang.journal import END, JOIN, START, JournalWriter, journal_name
+from NetHang.messages import countdown
+from NetHang.players import Player, PlayerList, send_all
+from NetHang.spectators import Spectators
+from NetHang.timers import Timers
+from NetHang.util import COUNTDOWN_MARKS
+from NetHang.writer import PipeOutbox
+
+
+def parse_room_request(line):
+    """Split a "nickname@room" answer into nickname and room name (or None)."""
+    nickname, at, room_name = line.partition("@")
+    return nickname, room_name if at else None
+
+
+def is_room_name(room_name):
+    """Check if a requested room name is acceptable."""
+    return room_name.isalnum() and len(room_name) <= 16
+
+
+class Room:
+    """Players sharing a lobby countdown, a chat and a game, and its spectators."""
+
+    def __init__(self, name, outbox=None):
+        self.name = name
+        self.players = PlayerList()
+        self.players.outbox = outbox
+        self.spectators = Spectators()
+
+        # The game host running the game of this room, None while in the lobby
+        self.host = None
+        # Nicknames the game is waiting for input from, None for everyone
+        self.expecting = None
+        # Deadline of the game start, None while the game runs
+        self.starts_at = None
+        # Timer handles of the lobby countdown announcements and game start
+        self.countdown = []
+
+    def is_playing(self):
+        """Check if the room has a game running."""
+        return self.host is not None
+
+
+class RoomList:
+    """All rooms of a server, placing players in rooms by request or by room size.
+
+    With room_size None everybody is placed in one shared room, named "lobby". Lobby
+    countdowns are scheduled on timers, then on_start(room) is called to start the
+    game, so the countdown works the same for every engine running the timers. Once
+    the game ended, on_end(room) is called with the new scores kept. Spectators watch
+    rooms that exist, when a room is removed on_close(room) is called for them."""
+
+    def __init__(
+        self,
+        outbox=None,
+        room_size=None,
+        lobby_time=60,
+        timers=None,
+        on_start=None,
+        on_end=None,
+        on_close=None,
+    ):
+        self.outbox = outbox
+        self.room_size = room_size
+        self.lobby_time = lobby_time
+        self.timers = timers
+        self.on_start = on_start
+        self.on_end = on_end
+        self.on_close = on_close
+        self.rooms = {}
+        self._next_number = 1
+
+    def __iter__(self):
+        return iter(tuple(self.rooms.values()))
+
+    def count(self):
+        """Get the number of rooms."""
+        return len(self.rooms)
+
+    def get_room(self, name):
+        """Get a room by name, or None."""
+        return self.rooms.get(name)
+
+    def _new_room(self, name):
+        room = Room(name, self.outbox)
+        self.rooms[name] = room
+        self._start_countdown(room)
+        return room
+
+    def _start_countdown(self, room):
+        if self.timers is None:
+            return
+        room.starts_at = self.timers.clock() + self.lobby_time
+        room.countdown = [
+            self.timers.call_at(room.starts_at - mark, self._announce, room, mark)
+            for mark in sorted(COUNTDOWN_MARKS, reverse=True)
+            if mark <= self.lobby_time
+        ]
+        room.countdown.append(self.timers.call_at(room.starts_at, self._start, room))
+
+    def _stop_countdown(self, room):
+        for handle in room.countdown:
+            handle.cancel()
+        room.countdown = []
+        room.starts_at = None
+
+    def _announce(self, room, mark):
+        send_all(room.players, countdown(mark))
+
+    def _start(self, room):
+        room.countdown = []
+        room.starts_at = None
+        if self.on_start is not None:
+            self.on_start(room)
+
+    def _free_room(self):
+        if self.room_size is None:
+            return self.rooms.get("lobby") or self._new_room("lobby")
+        for room in self.rooms.values():
+            if not room.is_playing() and room.players.count() < self.room_size:
+                return room
+        while "room" + str(self._next_number) in self.rooms:
+            self._next_number += 1
+        return self._new_room("room" + str(self._next_number))
+
+    def place(self, player, room_name=None):
+        """Add a player to the requested room, or to a free one, and return the room."""
+        if room_name is not None:
+            room = self.rooms.get(room_name) or self._new_room(room_name)
+        else:
+            room = self._free_room()
+        player.room = room.name
+        room.players.add_player(player)
+        return room
+
+    def watch(self, spectator):
+        """Add a spectator to its room and return the room, or None if there is none."""
+        room = self.rooms.get(spectator.room)
+        if room is not None:
+            room.spectators.add(spectator.socket, self.outbox)
+        return room
+
+    def unwatch(self, spectator):
+        """Drop a spectator from its room."""
+        room = self.rooms.get(spectator.room)
+        if room is not None:
+            room.spectators.discard(spectator.socket)
+
+    def leave(self, player):
+        """Drop a player from its room, removing the room if idle and empty."""
+        room = self.rooms.get(player.room)
+        if room is None:
+            return None
+        if room.players.get_player(nickname=player.nickname) is player:
+            room.players.drop_player(nickname=player.nickname)
+        self.discard_if_empty(room)
+        return room
+
+    def discard_if_empty(self, room):
+        """Remove a room without players, unless its game is still running."""
+        if room.players.count() == 0 and not room.is_playing():
+            self._stop_countdown(room)
+            self.rooms.pop(room.name, None)
+            if self.on_close is not None and len(room.spectators):
+                self.on_close(room)
+
+    def game_ended(self, room_name, scores):
+        """Return a room to its lobby after the game, keeping the new scores."""
+        room = self.rooms.get(room_name)
+        if room is None:
+            return None
+        room.host = None
+        room.expecting = None
+        room.spectators.reset()
+        for nickname, score in scores.items():
+            player = room.players.get_player(nickname=nickname)
+            if player is not None:
+                player.score = score
+        if self.on_end is not None:
+            self.on_end(room)
+        if room.players.count() == 0:
+            self.discard_if_empty(room)
+        else:
+            self._start_countdown(room)
+        return room
+
+    def route_frame(self, room_name, changes, whole):
+        """Share a game frame with the spectators of a room."""
+        room = self.rooms.get(room_name)
+        if room is None or self.outbox is None or not len(room.spectators):
+            return
+        room.spectators.frame(self.outbox, changes, whole)
+
+    def route_output(self, room_name, nicknames, data):
+        """Send game output to the current connection of each player in the room."""
+        room = self.rooms.get(room_name)
+        if room is None or self.outbox is None:
+            return
+        for nickname in nicknames:
+            player = room.players.get_player(nickname=nickname)
+            if player is not None:
+                self.outbox.send(player, data)
+
+
+def _game_host_worker(game_class, connection, policy, depth=None, journal_dir=None):
+    """Game host process, running the games of many rooms as threads.
+
+    The main thread only reads the pipe and runs the turn deadlines, it never sends,
+    so output of the games blocked on a full pipe can't keep it from reading the
+    commands the server sends meanwhile. The games dict has its own lock, taken by
+    no thread while sending. The depth gauge gets the number of commands waiting for
+    the games of the host. With a journal directory, every game gets a journal of its events there, written
+    behind by one thread of the host, and games with an rng get the seed it records."""
+    # Pipe writes of the game threads, and the games by room, never held together
+    send_lock = Lock()
+    games_lock = Lock()
+    games = {}
+    writer = None
+    if journal_dir is not None:
+        writer = JournalWriter(journal_dir)
+        writer.start()
+
+    def send(message):
+        with send_lock:
+            connection.send(message)
+
+    def play(room_name, game):
+        try:
+            game.run()
+        finally:
+            game_journal = game.commands_queue.journal
+            if game_journal is not None:
+                game_journal.record(
+                    END,
+                    *[field for p in game.players for field in (p.nickname, p.score)],
+                )
+                game_journal.close()
+            with games_lock:
+                games.pop(room_name, None)
+            send(("ended", room_name, game.players.scoreboard()))
+
+    def start_journal(room_name, roster):
+        seed = getrandbits(32)
+        game_journal = writer.open(journal_name(room_name, seed))
+        game_journal.record(
+            START,
+            room_name,
+            game_class.__module__ + "." + game_class.__qualname__,
+            seed,
+        )
+        for nickname, score in roster:
+            game_journal.record(JOIN, nickname, score, 0)
+        return game_journal, seed
+
+    # Turn deadlines of all games are run by this loop, woken up by earlier deadlines
+    wakeup, waker = socketpair()
+    waker.setblocking(False)
+
+    def wake():
+        try:
+            waker.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    timers = Timers(on_change=wake)
+
+    try:
+        while True:
+            timers.run_due()
+            if depth is not None:
+                with games_lock:
+                    depth.set(
+                        sum(
+                            game.commands_queue.queue.qsize() for game in games.values()
+                        )
+                    )
+            try:
+                ready = wait([connection, wakeup], timers.timeout())
+                if wakeup in ready:
+                    wakeup.recv(4096)
+                if connection not in ready:
+                    continue
+                message = connection.recv()
+            except (EOFError, KeyboardInterrupt):
+                return
+
+            if message[0] == "stop":
+                return
+
+            if message[0] == "start":
+                _, room_name, roster = message
+                players = PlayerList()
+                for nickname, score in roster:
+                    players.add_player(Player(None, nickname, score=score))
+                players.outbox = PipeOutbox(connection, room_name, send_lock)
+                game_journal, seed = None, None
+                if writer is not None:
+                    game_journal, seed = start_journal(room_name, roster)
+                commands_queue = CommandQueue(
+                    policy,
+                    on_expect=lambda nicknames, room_name=room_name: send(
+                        ("expect", room_name, nicknames)
+                    ),
+                    timers=timers,
+                    journal=game_journal,
+                )
+                game = game_class(players, commands_queue)
+                if seed is not None and hasattr(game, "rng"):
+                    game.rng.seed(seed)
+                with games_lock:
+                    games[room_name] = game
+                Thread(target=play, args=(room_name, game), daemon=True).start()
+
+            elif message[0] == "command":
+                # Player nickname and the line as bytes, decoded only for running games
+                _, room_name, nickname, data = message
+                with games_lock:
+                    game = games.get(room_name)
+                if game is not None:
+                    player = game.players.get_player(nickname=nickname)
+                    game.commands_queue.put(
+                        (player or Player(None, nickname), data.decode("latin-1"))
+                    )
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+class GameHost:
+    """Handle of one game host process, connected through a duplex pipe."""
+
+    def __init__(self, game_class, policy="drop", depth=None, journal_dir=None):
+        self.connection, host_connection = Pipe()
+        self.games = 0
+        self.process = Process(
+            target=_game_host_worker,
+            args=(game_class, host_connection, policy, depth, journal_dir),
+            daemon=True,
+        )
+        self.process.start()
+        host_connection.close()
+
+    def fileno(self):
+        """Connection file descriptor, to wait for host messages."""
+        return self.connection.fileno()
+
+    def receive(self):
+        """Get all host messages ready to be read."""
+        messages = []
+        while self.connection.poll():
+            messages.append(self.connection.recv())
+        return messages
+
+
+class GameHostPool:
+    """Game host processes sharing the games of all rooms, by least running games.
+
+    With metrics (ServerMetrics), each host reports its commands queue depth. With
+    a journal directory, hosts journal the events of their games there."""
+
+    def __init__(
+        self, game_class, size=2, policy="drop", metrics=None, journal_dir=None
+    ):
+        self.policy = policy
+        self.hosts = [
+            GameHost(
+                game_class,
+                policy,
+                None if metrics is None else metrics.commands_queue_depth[number],
+                journal_dir,
+            )
+            for number in range(max(1, size))
+        ]
+
+    def start_game(self, room):
+        """Start the game of a room on the least busy host."""
+        host = min(self.hosts, key=lambda host: host.games)
+        host.games += 1
+        room.host = host
+        host.connection.send(
+            (
+                "start",
+                room.name,
+                [(player.nickname, player.score) for player in room.players],
+            )
+        )
+
+    def send_command(self, room, nickname, data):
+        """Pass a line of player input (bytes) to the game of a room.
+
+        With the drop policy, input the game is not waiting for is dropped here."""
+        if room.host is None:
+            return
+        if (
+            self.policy == "drop"
+            and room.expecting is not None
+            and nickname != "."
+            and nickname not in room.expecting
+        ):
+            return
+        room.host.connection.send(("command", room.name, nickname, data))
+
+    def handle(self, host, rooms):
+        """Apply messages from a host to the rooms, return rooms that ended a game."""
+        ended = []
+        for message in host.receive():
+            if message[0] == "output":
+                rooms.route_output(*message[1:])
+            elif message[0] == "frame":
+                rooms.route_frame(*message[1:])
+            elif message[0] == "expect":
+                room = rooms.get_room(message[1])
+                if room is not None:
+                    room.expecting = None if message[2] is None else set(message[2])
+            elif message[0] == "ended":
+                host.games -= 1
+                room = rooms.game_ended(*message[1:])
+                if room is not None:
+                    ended.append(room)
+        return ended
+
+    def close(self):
+        """Stop all host processes."""
+        for host in self.hosts:
+            try:
+                host.connection.send(("stop",))
+            except OSError:
+                pass
+            host.connection.close()
+        for host in self.hosts:
+            host.process.join(1)
+            if host.process.is_alive():
+                host.process.terminate()
@@ -0,0 +1,160 @@
+"""Shared memory roster of connected players, for lookups from accept workers"""
+
+
+from ctypes import Structure, c_char, c_ubyte, c_uint
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+from zlib import crc32
+
+# Slot states of the open addressing tables
+EMPTY, USED, DELETED = 0, 1, 2
+
+
+class _NicknameSlot(Structure):
+    _fields_ = [
+        ("state", c_ubyte),
+        ("nickname", c_char * 33),
+        ("address", c_char * 46),
+        ("rejoin_code", c_char * 5),
+    ]
+
+
+class _AddressSlot(Structure):
+    _fields_ = [
+        ("state", c_ubyte),
+        ("address", c_char * 46),
+        ("count", c_uint),
+    ]
+
+
+def _encode(string):
+    return (string or "").encode("latin-1")
+
+
+def _find(slots, field, key):
+    """Probe for key, returns its slot index (or None) and the first reusable index."""
+    mask = len(slots) - 1
+    index = crc32(key) & mask
+    reusable = None
+    for _ in range(len(slots)):
+        slot = slots[index]
+        if slot.state == EMPTY:
+            return None, index if reusable is None else reusable
+        if slot.state == DELETED:
+            if reusable is None:
+                reusable = index
+        elif getattr(slot, field) == key:
+            return index, reusable
+        index = (index + 1) & mask
+    return None, reusable
+
+
+class SharedRoster:
+    """Index of nicknames, addresses and rejoin codes in shared memory.
+
+    The server loop is the only writer, updating it on each join and leave, while
+    accept workers query it directly instead of receiving PlayerList copies."""
+
+    def __init__(self, capacity=256):
+        # Capacity is rounded up to a power of two, for masking hashes
+        capacity = 1 << max(1, (capacity - 1).bit_length())
+        self.lock = Lock()
+        self.nicknames = RawArray(_NicknameSlot, capacity)
+        self.addresses = RawArray(_AddressSlot, capacity)
+        # Used and deleted slots, for nicknames and then addresses
+        self.counters = RawArray(c_uint, 4)
+
+    def count(self):
+        """Get the number of indexed players."""
+        return self.counters[0]
+
+    def is_nickname(self, nickname):
+        """Check if a nickname is taken."""
+        with self.lock:
+            return _find(self.nicknames, "nickname", _encode(nickname))[0] is not None
+
+    def is_address(self, address):
+        """Check if at least one player is connected from an address."""
+        with self.lock:
+            return _find(self.addresses, "address", _encode(address))[0] is not None
+
+    def get_rejoin_code(self, nickname):
+        """Get the rejoin code of a nickname, or None if not taken."""
+        with self.lock:
+            index = _find(self.nicknames, "nickname", _encode(nickname))[0]
+            if index is None:
+                return None
+            return self.nicknames[index].rejoin_code.decode("latin-1")
+
+    def add(self, nickname, address, rejoin_code):
+        """Index a player, returns False if the nickname is taken or no room is left."""
+        nickname, address = _encode(nickname), _encode(address)
+        with self.lock:
+            index, free = _find(self.nicknames, "nickname", nickname)
+            if index is not None or free is None:
+                return False
+            address_index, address_free = _find(self.addresses, "address", address)
+            if address_index is None and address_free is None:
+                return False
+
+            slot = self.nicknames[free]
+            if slot.state == DELETED:
+                self.counters[1] -= 1
+            slot.nickname = nickname
+            slot.address = address
+            slot.rejoin_code = _encode(rejoin_code)
+            slot.state = USED
+            self.counters[0] += 1
+
+            if address_index is None:
+                address_slot = self.addresses[address_free]
+                if address_slot.state == DELETED:
+                    self.counters[3] -= 1
+                address_slot.address = address
+                address_slot.count = 1
+                address_slot.state = USED
+                self.counters[2] += 1
+            else:
+                self.addresses[address_index].count += 1
+            return True
+
+    def remove(self, nickname):
+        """Drop a player from the index by nickname."""
+        with self.lock:
+            index = _find(self.nicknames, "nickname", _encode(nickname))[0]
+            if index is None:
+                return
+            slot = self.nicknames[index]
+            slot.state = DELETED
+            self.counters[0] -= 1
+            self.counters[1] += 1
+
+            address_index = _find(self.addresses, "address", slot.address)[0]
+            if address_index is not None:
+                address_slot = self.addresses[address_index]
+                address_slot.count -= 1
+                if address_slot.count == 0:
+                    address_slot.state = DELETED
+                    self.counters[2] -= 1
+                    self.counters[3] += 1
+
+            # Too many tombstones make probing long, so tables get rebuilt
+            if self.counters[1] + self.counters[3] > len(self.nicknames) // 2:
+                self._rehash()
+
+    def _rehash(self):
+        for slots, field, used, deleted in (
+            (self.nicknames, "nickname", 0, 1),
+            (self.addresses, "address", 2, 3),
+        ):
+            live = [
+                slots._type_.from_buffer_copy(slot)
+                for slot in slots
+                if slot.state == USED
+            ]
+            for slot in slots:
+                slot.state = EMPTY
+            for slot in live:
+                slots[_find(slots, field, getattr(slot, field))[1]] = slot
+            self.counters[used] = len(live)
+            self.counters[deleted] = 0
@@ -0,0 +1,84 @@
+"""Screen model of player terminals, redrawing only the lines that changed"""
+
+
+import re
+
+from NetHang.players import PlayerList, send_all, send_frame, send_to
+
+_ESCAPE = re.compile("\x1B\\[[0-9;]*[A-Za-z]")
+
+
+def visible_width(line):
+    """Get the width of a line on the terminal, without escape sequences."""
+    return len(_ESCAPE.sub("", line))
+
+
+class Screen:
+    """Frames shown to the players of a game, sent as changes to the previous frame.
+
+    A player gets the whole frame after a clear the first time, or after invalidate().
+    Then only lines that changed are rewritten in place with cursor moves, and all
+    below the frame (prompts and typed input) is erased. Frames that would scroll the
+    terminal, too tall or too wide, are always sent whole. Each frame is also shared
+    with the spectators of the game, whole and as changes, rendered just once."""
+
+    def __init__(self, clear="\x1B[2J\x1B[H", rows=24, columns=80):
+        self.clear = clear
+        self.rows = rows
+        self.columns = columns
+        self.lines = None
+        # Nicknames of the players showing the last frame
+        self.synced = set()
+
+    def invalidate(self, nickname=None):
+        """Send the next frame whole to a player, or to everyone."""
+        if nickname is None:
+            self.synced.clear()
+        else:
+            self.synced.discard(nickname)
+
+    def _fits(self, lines):
+        return len(lines) < self.rows and all(
+            visible_width(line) < self.columns for line in lines
+        )
+
+    def _changes(self, lines):
+        out = []
+        for row, line in enumerate(lines[:-1]):
+            if row >= len(self.lines) or self.lines[row] != line:
+                out.append("\x1B[" + str(row + 1) + "H" + line + "\x1B[K")
+        # The cursor ends after the last line, like after a full frame
+        out.append("\x1B[" + str(len(lines)) + "H" + lines[-1] + "\x1B[J")
+        return "".join(out)
+
+    def draw(self, players, text):
+        """Send the next frame to the players, whole or as changes by player."""
+        lines = text.split("\n")
+        synced, fresh = PlayerList(), PlayerList()
+        synced.outbox = fresh.outbox = players.outbox
+        changes = None
+        if self.lines is not None and self._fits(lines):
+            changes = self._changes(lines)
+            for player in players:
+                if player.nickname in self.synced:
+                    synced.add_player(player)
+                else:
+                    fresh.add_player(player)
+        else:
+            fresh = players
+
+        if synced.count() > 0:
+            send_all(synced, changes)
+        if fresh.count() > 0:
+            send_all(fresh, self.clear + text)
+        send_frame(players, changes, self.clear + text)
+        self.lines = lines
+        self.synced = set(players.get_nicknames())
+
+    def redraw(self, players, nickname):
+        """Send the last frame whole to one player, after a rejoin."""
+        player = players.get_player(nickname=nickname)
+        if player is None or self.lines is None:
+            return
+        send_to(players, player, self.clear + "\n".join(self.lines))
+        self.synced.add(nickname)
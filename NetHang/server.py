@@ -1,38 +1,34 @@
 """Contains NetHangServer, which runs the server"""
 
 
+import asyncio
 import socket as so
 from os import path
-from multiprocessing import Process, SimpleQueue, Value
+from multiprocessing import Process, Value
 from random import randint
-from select import select
-from time import sleep, time
-
-from NetHang.players import Player, PlayerList, generate_rejoin_code, send_all
-from NetHang.util import load_json_dict, prettify_time
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+from time import monotonic
+
+from NetHang.admission import Admission
+from NetHang.async_engine import AsyncEngine
+from NetHang import cluster, messages, upgrade
+from NetHang.handoff import SocketHandoff
+from NetHang.handshake import Handshakes
+from NetHang.metrics import MetricsServer, ServerMetrics
+from NetHang.players import Player, PlayerList, send_all, send_to
+from NetHang.reader import LineReader
+from NetHang.rooms import GameHost, GameHostPool, RoomList
+from NetHang.roster import SharedRoster
+from NetHang.sessions import SessionStore
+from NetHang.spectators import Spectator
+from NetHang.timers import Timers
+from NetHang.writer import Outbox
+from NetHang.util import load_json_dict
 
 # Default game gets loaded if no game is available
 from NetHang.examples.hangman import Game as DefaultHangman
 
 
-def should_countdown(number):
-    """Countdown values should be printed if here"""
-    return number in [
-        1.0,
-        2.0,
-        3.0,
-        4.0,
-        5.0,
-        10.0,
-        30.0,
-        60.0,
-        90.0,
-        120.0,
-        180.0,
-        300.0,
-    ]
-
-
 class NetHangServer:
     """Contains all methods to run the game server for hangman."""
 
@@ -43,18 +39,31 @@ class NetHangServer:
         game_class=DefaultHangman,
         priority_settings=None,
         bypass_json=False,
+        # "multiprocessing" (accept worker processes) or "asyncio" (one event loop)
+        engine=None,
     ):
         self.game_class = game_class
 
         self.server_address = server_address
         self.server_port = None
         self.server_socket = None
+        # Connection to the server taken over, passing its players once running
+        self.predecessor = None
 
         self.server_process = None
         self.running = Value("B", 0)
+        # Readable end and signalling end, the processes sleep until stopping
+        self._stopping = None
+        self._stop_signal = None
 
         self._setup_settings(priority_settings, bypass_json)
+        self.engine = engine or self.settings.get("engine") or "multiprocessing"
+        if self.engine not in ("multiprocessing", "asyncio"):
+            raise ValueError("Unknown server engine: " + str(self.engine))
         self._setup_server()
+        self._setup_metrics()
+        self._setup_sessions()
+        self._setup_cluster()
 
         print(
             "Ready to be started on [\x1B[36m"
@@ -62,8 +71,11 @@ class NetHangServer:
             + ":"
             + str(self.server_port)
             + "\x1B[0m] with "
-            + str(self.settings["new_conn_processes"])
-            + " client workers, "
+            + (
+                str(self.settings["new_conn_processes"]) + " client workers, "
+                if self.engine == "multiprocessing"
+                else "the asyncio engine, "
+            )
             + str(self.settings["max_conn"])
             + " max clients."
         )
@@ -91,7 +103,15 @@ class NetHangServer:
 
     def _setup_server(self):
         """Binds the server instance defined address and port to a new server socket"""
+        if self._take_over():
+            return
         self.server_socket = so.socket(so.AF_INET, so.SOCK_STREAM)
+        if self.settings.get("reuse_port") and self.engine == "multiprocessing":
+            if hasattr(so, "SO_REUSEPORT"):
+                self.server_socket.setsockopt(so.SOL_SOCKET, so.SO_REUSEPORT, 1)
+            else:
+                print("\x1B[33mNo SO_REUSEPORT, accepting on one socket.\x1B[0m")
+                self.settings["reuse_port"] = False
         port_ok = False
         bind_tries = 0
         fatal = BaseException("Unknown exception caused server socket to fail bind!")
@@ -113,255 +133,637 @@ class NetHangServer:
         self.server_socket.listen(self.settings["max_conn"])
         self.server_port = port
 
+    def _take_over(self):
+        """Gets the listener of a server running with the same upgrade socket"""
+        self._metrics_listener = None
+        if self.settings.get("upgrade_socket") is None:
+            return False
+        if self.engine != "multiprocessing":
+            print("\x1B[33mHot upgrades need the multiprocessing engine.\x1B[0m")
+            self.settings["upgrade_socket"] = None
+            return False
+        predecessor = upgrade.connect(self.settings["upgrade_socket"])
+        if predecessor is None:
+            return False
+        try:
+            self.server_socket, fields = predecessor.receive()
+            if fields.get("metrics"):
+                self._metrics_listener, _ = predecessor.receive()
+        except (EOFError, OSError) as error:
+            print("\x1B[31mTaking over failed: " + str(error) + "\x1B[0m")
+            predecessor.close()
+            return False
+        self.server_port = fields["port"]
+        self.predecessor = predecessor
+        print("\x1B[36mTaking over the running server.\x1B[0m")
+        return True
+
+    def _setup_metrics(self):
+        """Declares the metrics shared by all processes, and binds their endpoint"""
+        self.metrics = ServerMetrics(
+            self.settings["new_conn_processes"]
+            if self.engine == "multiprocessing"
+            else 1,
+            self.settings["game_hosts"],
+        )
+        self.metrics_server = None
+        self.metrics_port = None
+        self.metrics_process = None
+        if self.settings.get("metrics_port") is not None:
+            self.metrics_server = MetricsServer(
+                self.metrics.registry,
+                self.settings["metrics_port"],
+                self._metrics_listener,
+            )
+            self.metrics_port = self.metrics_server.server_port
+        elif self._metrics_listener is not None:
+            self._metrics_listener.close()
+
+    def _setup_sessions(self):
+        """Loads the session store, before the processes using it start"""
+        self.sessions = None
+        if self.settings.get("session_store") is not None:
+            self.sessions = SessionStore(
+                self.settings["session_store"], self.settings["session_ttl"]
+            )
+
+    def _setup_cluster(self):
+        """Names this server as a cluster node, by the address its clients connect to"""
+        if self.settings.get("coordinator") is None:
+            return
+        if self.engine != "multiprocessing":
+            print("\x1B[33mCluster mode needs the multiprocessing engine.\x1B[0m")
+            self.settings["coordinator"] = None
+            return
+        if not self.settings.get("node_address"):
+            self.settings["node_address"] = (
+                self.server_address + ":" + str(self.server_port)
+            )
+
+    def _listen_again(self):
+        """Get another listener on the server port, the kernel balances between them."""
+        listener = so.socket(so.AF_INET, so.SOCK_STREAM)
+        listener.setsockopt(so.SOL_SOCKET, so.SO_REUSEPORT, 1)
+        listener.bind((self.server_address, self.server_port))
+        listener.listen(self.settings["max_conn"])
+        return listener
+
     def _accept_clients_worker(
-        self, server_socket, players_read_queue, players_write_queue
+        self, server_socket, roster, handoff, number=0, drain=None, admission=None
     ):
-        """Worker daemon process that accepts new client connections."""
-        while True:
-            try:
-                client_socket, client_addr_port = server_socket.accept()
-                client_address = client_addr_port[0]
-                sleep(0.5 * self.settings["delay_factor"])
-                client_socket.send(self.game_class.game_data["title"].encode("latin-1"))
-                worker_players = players_read_queue.get()
-                rejoined = False
-                old_player = None
-
-                if client_address in (self.settings["blacklisted"] or []):
-                    client_socket.send("This client IP is banned!\n".encode("latin-1"))
-                    client_socket.close()
-                    continue
-
-                while True:
-                    client_socket.settimeout(0.08 + self.settings["delay_factor"])
-                    try:
-                        while True:
-                            sleep(0.25 * self.settings["delay_factor"])
-                            dirty = client_socket.recv(512)
-                            if not dirty:
-                                break
-                    except (TimeoutError, so.timeout):
-                        pass
-                    client_socket.settimeout(None)
-                    client_nickname = ""
-                    client_socket.send("Nickname: ".encode("latin-1"))
-
-                    client_nickname = client_socket.recv(34)[:-1].decode("latin-1")
-                    if worker_players.is_player(nickname=client_nickname):
-                        client_socket.send(
-                            "Rejoining as this user? Code: ".encode("latin-1")
-                        )
-                        input_code = client_socket.recv(5)[:-1].decode("latin-1")
-                        old_player = worker_players.get_player(nickname=client_nickname)
-                        if input_code == old_player.rejoin_code:
-                            client_socket.send("Welcome back!\n".encode("latin-1"))
-                            old_player.socket.shutdown(so.SHUT_RDWR)
-                            old_player.socket.close()
-                            rejoined = True
-                            break
-                        client_socket.close()
-                        raise RuntimeError
-
-                    if (
-                        not client_nickname.isalnum()
-                        or len(client_nickname) < 2
-                        or len(client_nickname) > 32
-                    ):
-                        client_socket.send(
-                            "Only alphanumeric between 2 and 32 characters!\n".encode(
-                                "latin-1"
-                            )
-                        )
-                        continue
-
-                    break
-
-                if not rejoined:
-                    worker_players = players_read_queue.get()
-                    if not self.settings[
-                        "allow_same_source_ip"
-                    ] and worker_players.is_player(address=client_address):
-                        client_socket.send(
-                            "This client IP is already in use!\n".encode("latin-1")
-                        )
-                        client_socket.close()
-                        raise RuntimeError
-
-                if rejoined:
-                    players_write_queue.put(
-                        Player(
-                            client_socket,
-                            client_nickname,
-                            address=client_address,
-                            rejoin_code=old_player.rejoin_code,
-                            score=old_player.score,
-                        )
-                    )
-                    print("\x1B[33m" + client_nickname + " rejoined\x1B[0m")
-                else:
-                    rejoin_code = generate_rejoin_code()
-                    players_write_queue.put(
-                        Player(
-                            client_socket,
-                            client_nickname,
-                            address=client_address,
-                            rejoin_code=rejoin_code,
-                        )
-                    )
-                    client_socket.send(
-                        self.game_class.game_data["opening"].encode("latin-1")
-                    )
-                    client_socket.send(
-                        (
-                            "Your rejoin code is \x1B[01;91m"
-                            + rejoin_code
-                            + "\x1B[0m.\nLobby time is \x1B[01;36m"
-                            + prettify_time(self.settings["lobby_time"])
-                            + "\x1B[0m.\n\n"
-                        ).encode("latin-1")
-                    )
-                    print("\x1B[36m" + client_nickname + " joined\x1B[0m")
-
-            except (ConnectionResetError, RuntimeError):
-                pass
-            except BrokenPipeError:
-                sleep(0.5 * self.settings["delay_factor"])
-            except KeyboardInterrupt:
-                return
+        """Worker daemon process that handshakes with new client connections."""
+        if self.settings.get("reuse_port") and number > 0:
+            server_socket = self._listen_again()
+
+        def joined(handshake):
+            # Welcome is sent first, the server loop owns the socket after
+            handoff.send(
+                handshake.socket,
+                nickname=handshake.nickname,
+                address=handshake.address,
+                rejoin_code=handshake.rejoin_code,
+                room=handshake.room,
+                rejoined=handshake.rejoined,
+                spectator=handshake.spectator,
+                pending=handshake.reader.pending().decode("latin-1"),
+            )
+            self.metrics.joined[number].inc()
+            if handshake.spectator:
+                print("\x1B[36mSpectator of " + handshake.room + " joined\x1B[0m")
+            elif handshake.rejoined:
+                print("\x1B[33m" + handshake.nickname + " rejoined\x1B[0m")
+            else:
+                print("\x1B[36m" + handshake.nickname + " joined\x1B[0m")
+
+        # Every connection of this worker is one state machine, slow ones hold none up
+        handshakes = Handshakes(
+            roster,
+            self.settings,
+            self.game_class.game_data,
+            joined,
+            self.metrics,
+            number,
+            self.sessions,
+            admission,
+        )
+        handshakes.listen(server_socket)
+        if drain is not None:
+            handshakes.drain_on(drain)
+        try:
+            handshakes.run()
+        except KeyboardInterrupt:
+            return
 
     def _run_worker(self, running):
         """Run the hangman server."""
         print("\r\x1B[36mServer process started.\x1B[0m")
         players = PlayerList()
 
-        players_read_queue = SimpleQueue()
-        players_write_queue = SimpleQueue()
-
-        for _ in range(self.settings["new_conn_processes"]):
-            Process(
+        # Nickname, address and rejoin code index shared with the accept workers
+        roster = SharedRoster(max(256, 4 * self.settings["max_conn"]))
+        # Bans, caps and connection rate buckets, shared with the accept workers
+        admission = Admission(self.settings)
+        # Finished handshakes pass their client socket descriptor to this process
+        handoff = SocketHandoff()
+
+        # Written to once taken over, the accept workers stop accepting and finish
+        drain, drain_signal = so.socketpair()
+        workers = []
+        for number in range(self.settings["new_conn_processes"]):
+            worker = Process(
                 target=self._accept_clients_worker,
-                args=(self.server_socket, players_read_queue, players_write_queue),
+                args=(self.server_socket, roster, handoff, number, drain, admission),
                 daemon=True,
-            ).start()
+            )
+            worker.start()
+            workers.append(worker)
+
+        # Player sockets stay registered from joining to leaving, carrying the Player
+        selector = DefaultSelector()
+
+        # All output to players is non-blocking, slow clients get evicted
+        evicted = []
+        outbox = Outbox(
+            self.settings["send_high_water"],
+            on_pending=lambda socket: selector.modify(
+                socket, EVENT_READ | EVENT_WRITE, selector.get_key(socket).data
+            ),
+            on_drained=lambda socket: selector.modify(
+                socket, EVENT_READ, selector.get_key(socket).data
+            ),
+            on_evict=lambda socket: evicted.append(selector.get_key(socket).data),
+            metrics=self.metrics,
+        )
+        players.outbox = outbox
+
+        # Each room has its own lobby countdown, chat and game, games run on the hosts
+        hosts = GameHostPool(
+            self.game_class,
+            self.settings["game_hosts"],
+            self.settings["command_policy"],
+            self.metrics,
+            self.settings.get("journal_dir"),
+        )
+        for host in hosts.hosts:
+            selector.register(host, EVENT_READ, host)
+        selector.register(handoff, EVENT_READ, handoff)
+        selector.register(self._stopping, EVENT_READ, self._stopping)
+
+        # A new server can take over the listener and players, this one drains then
+        upgrades = None
+        successor = None
+        if self.settings.get("upgrade_socket") is not None:
+            upgrades = upgrade.UpgradeListener(self.settings["upgrade_socket"])
+            selector.register(upgrades, EVENT_READ, upgrades)
+        predecessor = self.predecessor
+        if predecessor is not None:
+            selector.register(predecessor, EVENT_READ, predecessor)
+
+        # Sessions are saved on joining, leaving and game end, then written behind
+        sessions = self.sessions
+        if sessions is not None:
+            sessions.start()
+
+        # As a cluster node, tells the coordinator its players, rooms and load
+        coordinator = None
+        if self.settings.get("coordinator") is not None:
+            try:
+                coordinator = cluster.connect(
+                    self.settings, self.settings["node_address"]
+                )
+            except OSError as error:
+                print("\x1B[31mCoordinator unreachable: " + str(error) + "\x1B[0m")
 
-        # The class parameter game class is used for making any game
-        game = self.game_class()
+        def tell(update, *args):
+            nonlocal coordinator
+            if coordinator is None:
+                return
+            try:
+                update(coordinator, *args)
+            except OSError as error:
+                print("\x1B[31mLost coordinator: " + str(error) + "\x1B[0m")
+                coordinator.close()
+                coordinator = None
+
+        def report_load():
+            tell(cluster.CoordinatorClient.report_load, players.count(), rooms.count())
+            if coordinator is not None:
+                timers.call_later(1.0, report_load)
+
+        def remember(player):
+            if sessions is not None:
+                sessions.save(player.nickname, player.rejoin_code, player.score)
+
+        def end_game(room):
+            for player in room.players:
+                remember(player)
+
+        def start_game(room):
+            send_all(room.players, messages.encoded(self.game_class.game_data["clear"]))
+            hosts.start_game(room)
+
+        # Spectator sockets are registered with their Spectator, watching one room
+        spectators = set()
+
+        def watch(client_socket, fields, output=None):
+            room = rooms.get_room(fields["room"])
+            if room is None:
+                try:
+                    client_socket.send(messages.NO_ROOM)
+                except OSError:
+                    pass
+                client_socket.close()
+                return
+            spectator = Spectator(client_socket, fields["address"], room.name)
+            spectators.add(spectator)
+            client_socket.setblocking(False)
+            client_socket.setsockopt(so.IPPROTO_TCP, so.TCP_NODELAY, 1)
+            selector.register(client_socket, EVENT_READ, spectator)
+            if output is not None:
+                # Taken over, output the previous server couldn't send yet goes first
+                outbox.write(client_socket, output + messages.UPGRADED)
+            outbox.write(client_socket, messages.WATCHING.render(room=room.name))
+            rooms.watch(spectator)
+
+        def unwatch(spectator):
+            rooms.unwatch(spectator)
+            spectators.discard(spectator)
+            outbox.discard(spectator.socket)
+            selector.unregister(spectator.socket)
+            spectator.socket.close()
+
+        def spectate(spectator, mask):
+            if mask & EVENT_WRITE:
+                outbox.flush(spectator.socket)
+            if not mask & EVENT_READ:
+                return
+            # Spectators only watch, anything they type is thrown away
+            try:
+                data = spectator.socket.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                data = b""
+            if not data:
+                unwatch(spectator)
+
+        def close_room(room):
+            for socket in tuple(room.spectators.sockets):
+                outbox.write(socket, messages.ROOM_CLOSED)
+                unwatch(selector.get_key(socket).data)
+
+        # Lobby countdowns are deadlines, the loop waits for the next one at most
+        timers = Timers()
+        rooms = RoomList(
+            outbox,
+            self.settings["room_size"],
+            self.settings["lobby_time"],
+            timers,
+            start_game,
+            end_game,
+            close_room,
+        )
 
-        # start_timer determines if game is on or not:
-        #   a float if not, value is deciseconds countdown
-        #   None if running
-        start_timer = None
+        # Input of each player socket, split into lines
+        readers = {}
 
-        while bool(running.value):
-            # One second delay while waiting, but not ingame
-            if start_timer is not None:
+        def handle_lines(player):
+            lines = readers[player.socket].lines()
+            if not lines:
+                return
+            # Send the received lines to the game host, which will route the requests
+            # for the game of the room by time of reception, paired with the nickname
+            # of the source player. In the lobby, lines are chat for the other players.
+            room = rooms.get_room(player.room)
+            if room.is_playing():
+                for line in lines:
+                    hosts.send_command(room, player.nickname, line)
+                return
+            other_players = room.players.copy()
+            other_players.drop_player(nickname=player.nickname)
+            for line in lines:
+                send_all(other_players, messages.chat_line(player.nickname, line))
+
+        def drop(player, reason):
+            print(reason)
+            remember(player)
+            readers.pop(player.socket, None)
+            outbox.discard(player.socket)
+            selector.unregister(player.socket)
+            player.socket.close()
+            players.drop_player(nickname=player.nickname)
+            roster.remove(player.nickname)
+            tell(cluster.CoordinatorClient.release_nickname, player.nickname)
+            room = rooms.leave(player)
+            if room is not None:
+                # Send a command from server management player (nickname="."), telling "-player"
+                hosts.send_command(
+                    room, ".", messages.server_notice("-", player.nickname)
+                )
+
+        metrics = self.metrics
+
+        def admit(got_player, pending=b"", rejoined=False, output=None):
+            old_player = players.get_player(nickname=got_player.nickname)
+            if old_player is not None:
+                # Rejoined, the new connection takes over the score and room
+                got_player.score = old_player.score
+                got_player.room = old_player.room
+                readers.pop(old_player.socket, None)
+                outbox.discard(old_player.socket)
+                selector.unregister(old_player.socket)
+                try:
+                    old_player.socket.shutdown(so.SHUT_RDWR)
+                except OSError:
+                    pass
+                old_player.socket.close()
+                players.drop_player(nickname=old_player.nickname)
+                roster.remove(old_player.nickname)
+            elif rejoined and sessions is not None:
+                # Returning after leaving, or after a restart, with the stored score
+                session = sessions.get(got_player.nickname)
+                if (
+                    session is not None
+                    and session.rejoin_code == got_player.rejoin_code
+                ):
+                    got_player.score = session.score
+            # Accept workers only see their own handshakes, the cap is enforced here
+            if players.count() >= self.settings["max_conn"] or not roster.add(
+                got_player.nickname, got_player.address, got_player.rejoin_code
+            ):
                 try:
-                    sleep(0.1 - time() % 0.1)
-                except KeyboardInterrupt:
-                    running.value = 0
-
-            while not players_write_queue.empty():
-                got_player = players_write_queue.get()
-                if players.is_player(nickname=got_player.nickname):
-                    players.drop_player(nickname=got_player.nickname)
-                players.add_player(got_player)
-            while not players_read_queue.empty():
-                players_read_queue.get()
-            for _ in range(2 * self.settings["new_conn_processes"]):
-                players_read_queue.put(players)
-
-            if not game.is_alive():
-                if start_timer is None:
-                    # Game is done, new timer
-                    start_timer = self.settings["lobby_time"]
-                elif start_timer <= 0.01:
-                    # Game start
-                    send_all(players, self.game_class.game_data["clear"])
-                    game.players = players
-                    game.start()
-                    start_timer = None
-                else:
-                    # Countdown
-                    if should_countdown(start_timer):
-                        send_all(
-                            players,
-                            "\r\x1B[01;36mStarting in "
-                            + prettify_time(int(start_timer))
-                            + ".\x1B[0m\n",
-                        )
-                    start_timer = round(start_timer - 0.1, 1)
+                    got_player.socket.send(messages.SERVER_FULL)
+                except OSError:
+                    pass
+                got_player.socket.close()
+                return
+            players.add_player(got_player)
+            remember(got_player)
+            tell(cluster.CoordinatorClient.claim_nickname, got_player.nickname)
+            # Lines typed right after the handshake come along with the socket
+            readers[got_player.socket] = LineReader(self.settings["max_line_length"])
+            readers[got_player.socket].feed(pending)
+            got_player.socket.setblocking(False)
+            # Messages are small separate writes, not worth waiting to coalesce
+            got_player.socket.setsockopt(so.IPPROTO_TCP, so.TCP_NODELAY, 1)
+            selector.register(got_player.socket, EVENT_READ, got_player)
+            if output is not None:
+                # Taken over, output the previous server couldn't send yet goes first
+                outbox.write(got_player.socket, output + messages.UPGRADED)
+            requested = got_player.room
+            room = rooms.place(got_player, requested)
+            if requested is not None:
+                tell(cluster.CoordinatorClient.claim_room, room.name)
+            send_to(players, got_player, messages.IN_ROOM.render(room=room.name))
+            if old_player is not None:
+                # Server notice "+player", the game redraws the rejoined screen
+                hosts.send_command(
+                    room, ".", messages.server_notice("+", got_player.nickname)
+                )
+            handle_lines(got_player)
 
+        def join(client_socket, fields):
+            if successor is not None:
+                # Joined while draining, passed on to the new server
+                try:
+                    successor.send(client_socket, **fields)
+                except OSError:
+                    client_socket.close()
+                return
+            output = fields.get("output")
+            output = None if output is None else output.encode("latin-1")
+            if fields.get("spectator"):
+                watch(client_socket, fields, output)
+                return
+            admit(
+                Player(
+                    client_socket,
+                    fields["nickname"],
+                    address=fields["address"],
+                    rejoin_code=fields["rejoin_code"],
+                    score=fields.get("score"),
+                    room=fields.get("room"),
+                ),
+                fields.get("pending", "").encode("latin-1"),
+                fields.get("rejoined", False),
+                output,
+            )
+
+        def hand_over(new_server):
+            nonlocal successor
+            print("\x1B[36mHanding over to the new server...\x1B[0m")
+            # Scores reach the disk before the new server loads them
+            if sessions is not None:
+                sessions.flush()
             try:
-                ready_sockets = select(
-                    # No longer one second delay, now realtime (poll)
-                    players.get_sockets(),
-                    [],
-                    [],
-                    1 if start_timer is None else 0,
-                )[0]
+                new_server.send(
+                    self.server_socket,
+                    port=self.server_port,
+                    metrics=self.metrics_server is not None,
+                )
+                if self.metrics_server is not None:
+                    new_server.send(self.metrics_server.socket)
+            except OSError as error:
+                print("\x1B[31mHanding over failed: " + str(error) + "\x1B[0m")
+                new_server.close()
+                return False
+            successor = new_server
+            drain_signal.send(b"!")
+            for worker in workers:
+                selector.register(worker.sentinel, EVENT_READ, worker)
+
+            # Games can't move, their players start over in the lobby of the new server
+            for host in hosts.hosts:
+                selector.unregister(host)
+            hosts.close()
+            # Spectators follow their rooms, recreated by the players passed first
+            watching = []
+            for spectator in tuple(spectators):
+                watching.append((spectator, outbox.buffered(spectator.socket)))
+                rooms.unwatch(spectator)
+                spectators.discard(spectator)
+                outbox.discard(spectator.socket)
+                selector.unregister(spectator.socket)
+            for player in players:
+                pending = readers.pop(player.socket).pending()
+                output = outbox.buffered(player.socket)
+                outbox.discard(player.socket)
+                selector.unregister(player.socket)
+                players.drop_player(nickname=player.nickname)
+                roster.remove(player.nickname)
+                rooms.leave(player)
+                join(
+                    player.socket,
+                    {
+                        "nickname": player.nickname,
+                        "address": player.address,
+                        "rejoin_code": player.rejoin_code,
+                        "room": player.room,
+                        "score": player.score,
+                        "pending": pending.decode("latin-1"),
+                        "output": output.decode("latin-1"),
+                    },
+                )
+            for spectator, output in watching:
+                join(
+                    spectator.socket,
+                    {
+                        "spectator": True,
+                        "address": spectator.address,
+                        "room": spectator.room,
+                        "output": output.decode("latin-1"),
+                    },
+                )
+            return True
+
+        report_load()
+        tick_started = monotonic()
+        while bool(running.value):
+            timers.run_due()
+
+            metrics.write_queue_depth.set(
+                sum(joined.get() for joined in metrics.joined) - metrics.dequeued.get()
+            )
+            metrics.players.set(players.count())
+            metrics.spectators.set(len(spectators))
+            metrics.rooms.set(rooms.count())
+            metrics.active_games.set(sum(room.is_playing() for room in rooms))
+            busy = monotonic() - tick_started
+            metrics.tick_seconds.observe(busy)
+            if busy > 0.1:
+                metrics.tick_overruns.inc()
+
+            try:
+                # Sleeps until readiness, the next deadline or the stop signal
+                ready_keys = selector.select(timers.timeout())
             except KeyboardInterrupt:
                 running.value = 0
                 break
-
-            # Server manages all incoming data efficiently into a SimpleQueue of command tuples
-            # Outgoing data is not centralized, using socket.send()
-            for socket in ready_sockets:
-                socket.settimeout(1)
-                player = players.get_player(socket=socket)
+            tick_started = monotonic()
+
+            # Server sends incoming lines to the game host of the room as commands
+            # Outgoing data is buffered by the outbox, flushed when sockets are writable
+            for key, mask in ready_keys:
+                socket, player = key.fileobj, key.data
+                if isinstance(player, GameHost):
+                    hosts.handle(player, rooms)
+                    continue
+                if player is self._stopping:
+                    break
+                if player is handoff:
+                    for client_socket, fields in handoff.receive():
+                        metrics.dequeued.inc()
+                        join(client_socket, fields)
+                    continue
+                if player is upgrades:
+                    new_server = upgrades.accept()
+                    if new_server is not None:
+                        selector.unregister(upgrades)
+                        upgrades.close()
+                        if not hand_over(new_server):
+                            upgrades = upgrade.UpgradeListener(
+                                self.settings["upgrade_socket"]
+                            )
+                            selector.register(upgrades, EVENT_READ, upgrades)
+                    continue
+                if player is predecessor:
+                    try:
+                        join(*predecessor.receive())
+                    except (EOFError, OSError):
+                        selector.unregister(predecessor)
+                        predecessor.close()
+                        predecessor = None
+                        print("\x1B[36mTook over from the previous server.\x1B[0m")
+                    continue
+                if isinstance(player, Process):
+                    # Accept worker done draining
+                    selector.unregister(socket)
+                    workers.remove(player)
+                    continue
+                if isinstance(player, Spectator):
+                    # Left already if its room was closed during this tick
+                    if player in spectators:
+                        spectate(player, mask)
+                    continue
+                if mask & EVENT_WRITE:
+                    outbox.flush(socket)
+                if not mask & EVENT_READ:
+                    continue
                 try:
-                    data = socket.recv(256)
-                    if not data:
-                        print("\x1B[36m" + player.nickname + " left\x1B[0m")
-                        socket.close()
-                        players.drop_player(nickname=player.nickname)
-                        # Send a command from server management player (nickname="."), telling "-player"
-                        game.commands_queue.put(
-                            (Player(None, "."), "-" + player.nickname)
-                        )
+                    if not readers[socket].fill(socket):
+                        drop(player, "\x1B[36m" + player.nickname + " left\x1B[0m")
                     else:
-                        try:
-                            decoded_data = data[:-1].decode("latin-1")
-                        except UnicodeDecodeError:
-                            continue
-
-                        # Send received string of decoded data to the commands queue
-                        # of the game process, which will queue all requests by
-                        # time of reception, paired with the source player.
-                        if game.is_alive():
-                            game.commands_queue.put((player, decoded_data))
-
-                        else:
-                            other_players = players.copy()
-                            other_players.drop_player(nickname=player.nickname)
-                            send_all(
-                                other_players,
-                                "\x1B[90m<"
-                                + player.nickname
-                                + ">:\x1B[0m "
-                                + decoded_data.replace(
-                                    "\n", "\n\x1B[90m<" + player.nickname + ">:\x1B[0m "
-                                )
-                                + "\n",
-                            )
+                        handle_lines(player)
                 except ConnectionResetError:
-                    print("\x1B[33m" + player.nickname + " reset connection.\x1B[0m")
-                    socket.close()
-                    players.drop_player(nickname=player.nickname)
-                    game.commands_queue.put((Player(None, "."), "-" + player.nickname))
+                    drop(
+                        player,
+                        "\x1B[33m" + player.nickname + " reset connection.\x1B[0m",
+                    )
                 except BlockingIOError:
-                    print("\x1B[01;91mUnavailable socket.\x1B[0m")
-                    sleep(0.5 * self.settings["delay_factor"])
-                except (TimeoutError, so.timeout):
-                    # Fixes hanging on game ended
                     pass
 
+            while evicted:
+                player = evicted.pop()
+                if isinstance(player, Spectator):
+                    if player in spectators:
+                        unwatch(player)
+                    continue
+                if players.get_player(nickname=player.nickname) is player:
+                    drop(player, "\x1B[33m" + player.nickname + " fell behind.\x1B[0m")
+
+            if successor is not None and not workers:
+                # The last players joined while draining go to the new server too
+                for client_socket, fields in handoff.receive():
+                    metrics.dequeued.inc()
+                    join(client_socket, fields)
+                successor.close()
+                running.value = 0
+                self._stop_signal.send(b"!")
+                break
+
+        hosts.close()
+        selector.close()
+        handoff.close()
+        drain.close()
+        drain_signal.close()
+        if upgrades is not None:
+            upgrades.close()
+        if predecessor is not None:
+            predecessor.close()
+        if sessions is not None:
+            sessions.close()
+        if coordinator is not None:
+            coordinator.close()
+        self.server_socket.close()
+        print("\r\x1B[36mServer gracefully stopped.\n\x1B[0m")
+
+    def _run_async_worker(self, running):
+        """Run the hangman server on the asyncio engine."""
+        print("\r\x1B[36mServer process started.\x1B[0m")
+        try:
+            asyncio.run(AsyncEngine(self).serve(self._stopping))
+        except KeyboardInterrupt:
+            running.value = 0
+
         self.server_socket.close()
         print("\r\x1B[36mServer gracefully stopped.\n\x1B[0m")
 
     def run(self):
         """Run the hangman server."""
         self.running.value = 1
-        self.server_process = Process(target=self._run_worker, args=(self.running,))
+        self._stopping, self._stop_signal = so.socketpair()
+        if self.metrics_server is not None:
+            self.metrics_process = Process(
+                target=self.metrics_server.serve_while,
+                args=(self.running, self._stopping),
+            )
+            self.metrics_process.start()
+        self.server_process = Process(
+            target=self._run_worker
+            if self.engine == "multiprocessing"
+            else self._run_async_worker,
+            args=(self.running,),
+        )
         self.server_process.start()
         print("\r\x1B[36mRunning server...\x1B[0m")
 
@@ -371,7 +773,15 @@ class NetHangServer:
             raise RuntimeError("Server is not running.")
         print("\r\x1B[36mStopping server...\x1B[0m")
         self.running.value = 0
+        self._stop_signal.send(b"!")
         self.server_process.join(5)
         if self.server_process.is_alive():
             self.server_process.terminate()
             self.server_process.join()
+        if self.metrics_process is not None:
+            self.metrics_process.join(1)
+            if self.metrics_process.is_alive():
+                self.metrics_process.terminate()
+            self.metrics_server.server_close()
+        self._stopping.close()
+        self._stop_signal.close()
@@ -0,0 +1,143 @@
+"""Persistent player sessions, with rejoin codes and scores kept across restarts"""
+
+
+import sqlite3
+from threading import Event, Lock, Thread
+from time import time
+
+from NetHang.roster import SharedRoster
+
+
+class Session:
+    """Rejoin code, cumulative score and last seen time of a nickname."""
+
+    __slots__ = ("rejoin_code", "score", "last_seen")
+
+    def __init__(self, rejoin_code, score=0, last_seen=None):
+        self.rejoin_code = rejoin_code
+        self.score = score
+        self.last_seen = time() if last_seen is None else last_seen
+
+
+class SessionStore:
+    """Sessions by nickname in an SQLite file, cached in memory and written behind.
+
+    Sessions seen in the last ttl seconds are loaded when the store is created, and
+    their rejoin codes indexed in shared memory, for accept workers forked after. The
+    server loop is the only writer: save() only updates memory, while a thread started
+    by start() writes the changes to disk in one transaction every flush_interval
+    seconds, so the loop never waits for the disk. Up to capacity sessions are
+    indexed, the most recent when loading."""
+
+    def __init__(self, path, ttl=None, flush_interval=1.0, capacity=16384):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.sessions = {}
+        self.index = SharedRoster(capacity)
+
+        self._dirty = {}
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+        connection = self._connect()
+        try:
+            if ttl is not None:
+                with connection:
+                    connection.execute(
+                        "DELETE FROM sessions WHERE last_seen < ?", (time() - ttl,)
+                    )
+            rows = connection.execute(
+                "SELECT nickname, rejoin_code, score, last_seen FROM sessions"
+                " ORDER BY last_seen DESC"
+            )
+            for nickname, rejoin_code, score, last_seen in rows:
+                self.sessions[nickname] = Session(rejoin_code, score, last_seen)
+                self.index.add(nickname, "", rejoin_code)
+        finally:
+            connection.close()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (nickname TEXT PRIMARY KEY,"
+            " rejoin_code TEXT NOT NULL, score INTEGER NOT NULL,"
+            " last_seen REAL NOT NULL)"
+        )
+        return connection
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, nickname):
+        """Get the Session of a nickname, or None."""
+        return self.sessions.get(nickname)
+
+    def get_rejoin_code(self, nickname):
+        """Get the rejoin code of a nickname from the shared index, from any process."""
+        return self.index.get_rejoin_code(nickname)
+
+    def save(self, nickname, rejoin_code, score):
+        """Update the session of a nickname, to be written to disk soon."""
+        session = self.sessions.get(nickname)
+        if session is None or session.rejoin_code != rejoin_code:
+            self.index.remove(nickname)
+            self.index.add(nickname, "", rejoin_code)
+        session = self.sessions[nickname] = Session(rejoin_code, score)
+        with self._lock:
+            self._dirty[nickname] = (rejoin_code, score, session.last_seen)
+
+    def start(self):
+        """Start writing behind, from the process owning the store."""
+        self._stop.clear()
+        self._thread = Thread(target=self._write_behind, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Write the last changes and stop writing behind."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        else:
+            self.flush()
+
+    def flush(self, connection=None):
+        """Write the changes saved so far in one transaction, returns how many."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+        own = connection is None
+        if own:
+            connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                    [(nickname, *values) for nickname, values in dirty.items()],
+                )
+        except sqlite3.Error:
+            # Kept for the next flush, unless saved again since
+            with self._lock:
+                for nickname, values in dirty.items():
+                    self._dirty.setdefault(nickname, values)
+            raise
+        finally:
+            if own:
+                connection.close()
+        return len(dirty)
+
+    def _write_behind(self):
+        connection = self._connect()
+        try:
+            while not self._stop.wait(self.flush_interval):
+                try:
+                    self.flush(connection)
+                except sqlite3.Error as error:
+                    print("\x1B[31mSession store: " + str(error) + "\x1B[0m")
+            self.flush(connection)
+        finally:
+            connection.close()
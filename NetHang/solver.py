@@ -0,0 +1,164 @@
+"""Hangman solver, guessing the letters that tell the most about dictionary words"""
+
+
+import math
+from collections import Counter
+
+from NetHang.wordlist import signature
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Letters by frequency in English, for words the dictionary doesn't have
+FREQUENCY_ORDER = "etaoinshrdlcumwfgypbvkjxqz"
+# Candidates scored at most for each guess, evenly spread over all of them
+SAMPLE_SIZE = 4096
+
+
+def _entropy(counts, total):
+    return -sum(count / total * math.log2(count / total) for count in counts if count)
+
+
+class Solver:
+    """Candidate words of a guessword, narrowed down by each guess.
+
+    Candidates are the dictionary words of the same length with the letters revealed
+    so far, and none of the letters tried at the hidden positions. The guess is the
+    letter whose positions split them in the most even groups, the best information
+    gain, or the word itself once it is the only one left. With NumPy, candidates
+    are rows of a byte matrix taken from the memory-mapped dictionary as it is, and
+    get filtered and scored as arrays. One solver serves all bots of a round."""
+
+    # Best first guess of each length, it only depends on the dictionary
+    _openings = {}
+
+    def __init__(self, dictionary, length, use_numpy=True):
+        self.dictionary = dictionary
+        self.length = length
+        self.use_numpy = use_numpy and numpy is not None
+        self.candidates = None
+        self.count = 0
+
+    def guess(self, known, tried):
+        """Get the next letter or whole word to guess.
+
+        known has the lowercase character of each position, None for hidden ones,
+        tried has the letters guessed so far."""
+        tried = {letter for letter in tried if "a" <= letter <= "z"}
+        if any(c is not None and not "a" <= c <= "z" for c in known):
+            # Not a dictionary word, no candidates to go by
+            return self._fallback(tried)
+
+        opening_key = (id(self.dictionary), self.length)
+        if not tried and opening_key in Solver._openings:
+            return Solver._openings[opening_key]
+
+        self._narrow(known, tried)
+        if self.count == 0:
+            return self._fallback(tried)
+        if self.count == 1:
+            # Dropped right away, a wrong guess can't be made twice
+            return self._pop_word()
+
+        untried = [letter for letter in FREQUENCY_ORDER if letter not in tried]
+        if self.use_numpy:
+            gains = self._numpy_gains(untried)
+        else:
+            gains = self._python_gains(untried)
+        # Ties go to the most frequent letter, listed first
+        best = max(untried, key=lambda letter: gains.get(letter, 0.0))
+        if not tried:
+            Solver._openings[opening_key] = best
+        return best
+
+    def _fallback(self, tried):
+        for letter in FREQUENCY_ORDER:
+            if letter not in tried:
+                return letter
+        return FREQUENCY_ORDER[0]
+
+    def _pop_word(self):
+        if self.use_numpy:
+            word = self.candidates[0].tobytes().decode("ascii")
+        else:
+            word = self.candidates[0]
+        self.candidates = self.candidates[1:]
+        self.count -= 1
+        return word
+
+    def _narrow(self, known, tried):
+        revealed = [(i, c) for i, c in enumerate(known) if c is not None]
+        hidden = [i for i, c in enumerate(known) if c is None]
+        if self.use_numpy:
+            self._numpy_narrow(revealed, hidden, tried)
+        else:
+            self._python_narrow(revealed, hidden, tried)
+
+    def _python_narrow(self, revealed, hidden, tried):
+        if self.candidates is None:
+            present = {c for _, c in revealed}
+            self.candidates = list(
+                self.dictionary.words(
+                    self.length, signature(present), signature(tried - present)
+                )
+            )
+        self.candidates = [
+            word
+            for word in self.candidates
+            if all(word[i] == c for i, c in revealed)
+            and not any(word[i] in tried for i in hidden)
+        ]
+        self.count = len(self.candidates)
+
+    def _numpy_narrow(self, revealed, hidden, tried):
+        if self.candidates is None:
+            self.candidates = numpy.frombuffer(
+                self.dictionary.block(self.length), dtype=numpy.uint8
+            ).reshape(-1, self.length)
+        keep = numpy.ones(len(self.candidates), dtype=bool)
+        for i, c in revealed:
+            keep &= self.candidates[:, i] == ord(c)
+        if tried and hidden:
+            codes = numpy.array([ord(letter) for letter in tried], dtype=numpy.uint8)
+            keep &= ~numpy.isin(self.candidates[:, hidden], codes).any(axis=1)
+        if not keep.all():
+            self.candidates = self.candidates[keep]
+        self.count = len(self.candidates)
+
+    def _python_gains(self, untried):
+        sample = self.candidates[:: max(1, self.count // SAMPLE_SIZE)]
+        untried = set(untried)
+        groups = {}
+        for word in sample:
+            patterns = {}
+            for i, letter in enumerate(word):
+                if letter in untried:
+                    patterns[letter] = patterns.get(letter, 0) | 1 << i
+            for letter, pattern in patterns.items():
+                groups.setdefault(letter, Counter())[pattern] += 1
+        total = len(sample)
+        gains = {}
+        for letter, counts in groups.items():
+            # Words without the letter are one more group
+            absent = total - sum(counts.values())
+            gains[letter] = _entropy([*counts.values(), absent], total)
+        return gains
+
+    def _numpy_gains(self, untried):
+        sample = self.candidates[:: max(1, self.count // SAMPLE_SIZE)]
+        # Positions of a letter as bits, longer words than 64 wrap around
+        weights = numpy.left_shift(
+            numpy.uint64(1), numpy.arange(self.length, dtype=numpy.uint64) % 64
+        )
+        total = len(sample)
+        gains = {}
+        for letter in untried:
+            matches = sample == ord(letter)
+            patterns = matches.astype(numpy.uint64) @ weights
+            counts = numpy.unique(patterns, return_counts=True)[1]
+            if len(counts) > 1:
+                shares = counts / total
+                gains[letter] = float(-(shares * numpy.log2(shares)).sum())
+        return gains
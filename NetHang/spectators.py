@@ -0,0 +1,59 @@
+"""Spectators, read-only connections watching the game of a room"""
+
+
+class Spectator:
+    """A connection watching a room, it never joins the players or the game input."""
+
+    __slots__ = ("socket", "address", "room")
+
+    def __init__(self, socket, address=None, room=None):
+        self.socket = socket
+        self.address = address
+        self.room = room
+
+
+class Spectators:
+    """Spectator sockets of a room, sharing the frames of its game.
+
+    Frames come from the game host encoded once, whole and as changes to the frame
+    before. Spectators showing the frame before get the changes, the others the whole
+    frame, each written to all of them by one fan-out on the outbox. New spectators
+    get the last frame whole, then the changes like everyone else."""
+
+    def __init__(self):
+        self.sockets = set()
+        # Sockets showing the last frame
+        self.synced = set()
+        self.whole = None
+
+    def __len__(self):
+        return len(self.sockets)
+
+    def add(self, socket, outbox):
+        """Start sending frames to a socket, from the last one."""
+        self.sockets.add(socket)
+        if self.whole is not None:
+            outbox.write(socket, self.whole)
+            self.synced.add(socket)
+
+    def discard(self, socket):
+        """Stop sending frames to a socket."""
+        self.sockets.discard(socket)
+        self.synced.discard(socket)
+
+    def frame(self, outbox, changes, whole):
+        """Send the next frame, changes being None if it can't be sent as changes."""
+        if changes is not None and self.synced:
+            outbox.fan_out(self.synced, changes)
+            fresh = self.sockets - self.synced
+        else:
+            fresh = self.sockets
+        if fresh:
+            outbox.fan_out(fresh, whole)
+        self.synced = set(self.sockets)
+        self.whole = whole
+
+    def reset(self):
+        """Forget the last frame once the game ended, the next game starts whole."""
+        self.synced.clear()
+        self.whole = None
@@ -0,0 +1,104 @@
+"""Deadline scheduler for turn timeouts, lobby countdowns and idle timeouts"""
+
+
+from heapq import heapify, heappop, heappush
+from itertools import count
+from threading import Lock
+from time import monotonic
+
+
+class TimerHandle:
+    """A scheduled callback, which can be cancelled until it runs."""
+
+    __slots__ = ("when", "callback", "args", "cancelled", "timers")
+
+    def __init__(self, when, callback, args, timers):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.timers = timers
+
+    def cancel(self):
+        """Cancel the callback, no effect if it already ran."""
+        self.timers._cancel(self)
+
+
+class Timers:
+    """Heap of deadlines, run by whichever loop owns it.
+
+    Any number of timers costs one heap: the owning loop waits for timeout() at most,
+    then calls run_due(). Timers can be added from other threads, and on_change is
+    called when the earliest deadline moves closer, to wake the owning loop up."""
+
+    def __init__(self, clock=monotonic, on_change=None):
+        self.clock = clock
+        self.on_change = on_change
+        self._heap = []
+        self._sequence = count()
+        self._lock = Lock()
+        self._cancelled_count = 0
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled_count
+
+    def call_at(self, when, callback, *args):
+        """Run callback(*args) at a deadline of the clock, returns a TimerHandle."""
+        handle = TimerHandle(when, callback, args, self)
+        with self._lock:
+            heappush(self._heap, (when, next(self._sequence), handle))
+            earliest = self._heap[0][2] is handle
+        if earliest and self.on_change is not None:
+            self.on_change()
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) in delay seconds, returns a TimerHandle."""
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def _cancel(self, handle):
+        # Under the lock, racing cancels and runs count each timer once
+        with self._lock:
+            if handle.cancelled:
+                return
+            handle.cancelled = True
+            self._cancelled_count += 1
+            # Cancelled timers are left in the heap, until they are too many
+            cancelled = self._cancelled_count
+            if cancelled > 64 and cancelled > len(self._heap) // 2:
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapify(self._heap)
+                self._cancelled_count = 0
+
+    def next_deadline(self):
+        """Get the earliest deadline, or None without timers."""
+        with self._lock:
+            while self._heap and self._heap[0][2].cancelled:
+                heappop(self._heap)
+                self._cancelled_count -= 1
+            return self._heap[0][0] if self._heap else None
+
+    def timeout(self, default=None):
+        """Get the seconds to wait until the earliest deadline, or default."""
+        deadline = self.next_deadline()
+        if deadline is None:
+            return default
+        timeout = max(0.0, deadline - self.clock())
+        return timeout if default is None else min(timeout, default)
+
+    def run_due(self):
+        """Run all callbacks past their deadline, returns how many ran."""
+        now = self.clock()
+        ran = 0
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                handle = heappop(self._heap)[2]
+                if handle.cancelled:
+                    self._cancelled_count -= 1
+                    continue
+                handle.cancelled = True
+            handle.callback(*handle.args)
+            ran += 1
+        return ran
@@ -0,0 +1,104 @@
+"""Hot upgrades, handing the listener and players of a server over to a new one"""
+
+
+import json
+import os
+import socket as so
+import stat
+from multiprocessing.connection import Client, Connection
+from multiprocessing.reduction import recv_handle, send_handle
+
+
+class UpgradeListener:
+    """Unix socket of a running server, where a new server asks to take over.
+
+    Once a new server connects, closing removes the path, so the new server can listen
+    on the same path for the next upgrade. A socket left at the path by a server that
+    is gone gets replaced."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self.socket = so.socket(so.AF_UNIX, so.SOCK_STREAM)
+        self.socket.bind(path)
+        self.socket.listen(1)
+        self.socket.setblocking(False)
+
+    def fileno(self):
+        """Listening socket file descriptor, to wait for a new server."""
+        return self.socket.fileno()
+
+    def accept(self):
+        """Get the Successor connected, or None."""
+        try:
+            connection, _ = self.socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return None
+        connection.setblocking(True)
+        return Successor(Connection(connection.detach()))
+
+    def close(self):
+        """Stop listening and remove the path."""
+        if self.socket.fileno() == -1:
+            return
+        self.socket.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class Successor:
+    """Connection to the new server, taking over the sockets of this one.
+
+    Each socket is sent as its fields in JSON, then the file descriptor as SCM_RIGHTS,
+    and closed here once sent. The new server listens first, then gets the players."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def send(self, socket, **fields):
+        """Pass a socket with its fields, closing it in this process."""
+        self.connection.send_bytes(json.dumps(fields).encode("utf-8"))
+        send_handle(self.connection, socket.fileno(), None)
+        socket.close()
+
+    def close(self):
+        """Tell the new server everything was handed over."""
+        self.connection.close()
+
+
+class Predecessor:
+    """Connection to the running server being taken over, receiving its sockets."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def fileno(self):
+        """Connection file descriptor, to wait for sockets."""
+        return self.connection.fileno()
+
+    def receive(self):
+        """Get the next (socket, fields) pair, raises EOFError after the last one."""
+        fields = json.loads(self.connection.recv_bytes())
+        try:
+            fd = recv_handle(self.connection)
+        except RuntimeError as error:
+            raise OSError("Socket not received from the previous server.") from error
+        return so.socket(fileno=fd), fields
+
+    def close(self):
+        """Disconnect from the previous server."""
+        self.connection.close()
+
+
+def connect(path):
+    """Connect to the server running with this upgrade socket, or get None."""
+    try:
+        return Predecessor(Client(path, "AF_UNIX"))
+    except OSError:
+        return None
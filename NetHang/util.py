@@ -45,3 +45,7 @@ def prettify_time(seconds):
     if seconds > 0:
         time_parts.append(f"{seconds} {'second' if seconds == 1 else 'seconds'}")
     return ", ".join(time_parts)
+
+
+# Remaining lobby seconds at which the countdown gets announced
+COUNTDOWN_MARKS = (1, 2, 3, 4, 5, 10, 30, 60, 90, 120, 180, 300)
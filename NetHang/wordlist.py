@@ -0,0 +1,274 @@
+"""Word dictionaries compiled once to a binary index, memory-mapped read-only"""
+
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+
+MAGIC = b"NHWL"
+VERSION = 1
+# Longest word kept, words are lowercase a-z only
+MAX_LENGTH = 80
+
+# Magic, version, words, bytes of words, buckets, hash table slots
+HEADER = struct.Struct("<4sIIIII")
+# Length, letter signature and first word of a bucket
+BUCKET = struct.Struct("<III")
+U32 = struct.Struct("<I")
+SPAN = struct.Struct("<II")
+
+
+def is_word(word):
+    """Check if a lowercase string can be in a dictionary."""
+    return 2 <= len(word) <= MAX_LENGTH and word.isascii() and word.isalpha()
+
+
+def signature(word):
+    """Get the bit mask of the letters in a lowercase word, "a" being bit 0."""
+    mask = 0
+    for letter in set(word):
+        mask |= 1 << (ord(letter) - 97)
+    return mask
+
+
+def _pack(values):
+    values = array("I", values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def compile_words(words, index_path):
+    """Write the index of some words, returns how many were kept.
+
+    Words are normalized to lowercase, duplicates and words with other than letters
+    dropped, then sorted by length and letter signature, so each length and each
+    (length, signature) bucket is a range of word numbers."""
+    keyed = sorted(
+        (len(word), signature(word), word)
+        for word in {word.strip().lower() for word in words}
+        if is_word(word)
+    )
+    count = len(keyed)
+
+    offsets = [0]
+    buckets = []
+    for number, (length, mask, word) in enumerate(keyed):
+        offsets.append(offsets[-1] + length)
+        if not buckets or buckets[-1][:2] != (length, mask):
+            buckets.append((length, mask, number))
+    # First word, and first bucket, of each length
+    word_lengths = [key[0] for key in keyed]
+    bucket_lengths = [bucket[0] for bucket in buckets]
+    length_starts = [
+        bisect_left(word_lengths, length) for length in range(MAX_LENGTH + 2)
+    ]
+    bucket_starts = [
+        bisect_left(bucket_lengths, length) for length in range(MAX_LENGTH + 2)
+    ]
+
+    # Open addressing by crc32, with linear probing, slots hold word number + 1
+    slots = 8
+    while slots * 3 < count * 4:
+        slots *= 2
+    table = [0] * slots
+    for number, (_, _, word) in enumerate(keyed):
+        slot = zlib.crc32(word.encode("ascii")) & (slots - 1)
+        while table[slot]:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = number + 1
+
+    words_blob = "".join(key[2] for key in keyed).encode("ascii")
+    parts = [
+        HEADER.pack(MAGIC, VERSION, count, len(words_blob), len(buckets), slots),
+        _pack(offsets),
+        _pack(length_starts),
+        _pack(bucket_starts),
+        b"".join(BUCKET.pack(*bucket) for bucket in buckets),
+        _pack(table),
+        words_blob,
+    ]
+
+    # Written aside then renamed, processes compiling at once don't see half a file
+    directory = os.path.dirname(os.path.abspath(index_path))
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.writelines(parts)
+        os.replace(temporary_path, index_path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    return count
+
+
+def compile_wordlist(source_path, index_path):
+    """Write the index of a text file with one word per line, returns the words."""
+    with open(source_path, encoding="latin-1") as file:
+        return compile_words(file, index_path)
+
+
+class Dictionary:
+    """Words of a compiled index, read from a read-only memory map.
+
+    Nothing gets loaded: processes mapping the same index share its pages. Picking a
+    random word, of any length or in a range of lengths, and checking a word are O(1)
+    whatever the size of the dictionary."""
+
+    def __init__(self, index_path):
+        with open(index_path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, count, _, bucket_count, slots = HEADER.unpack_from(self.map)
+        except struct.error:
+            magic, version = None, None
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise ValueError("Not a word index: " + str(index_path))
+        self.count = count
+        self.slots = slots
+
+        # Offsets of the sections after the header
+        self._offsets = HEADER.size
+        self._length_starts = self._offsets + U32.size * (count + 1)
+        self._bucket_starts = self._length_starts + U32.size * (MAX_LENGTH + 2)
+        self._buckets = self._bucket_starts + U32.size * (MAX_LENGTH + 2)
+        self._table = self._buckets + BUCKET.size * bucket_count
+        self._words = self._table + U32.size * slots
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, word):
+        word = word.lower()
+        if not is_word(word):
+            return False
+        data = word.encode("ascii")
+        slot = zlib.crc32(data) & (self.slots - 1)
+        while True:
+            number = U32.unpack_from(self.map, self._table + U32.size * slot)[0]
+            if not number:
+                return False
+            if self._word_bytes(number - 1) == data:
+                return True
+            slot = (slot + 1) & (self.slots - 1)
+
+    def _word_bytes(self, number):
+        start, end = SPAN.unpack_from(self.map, self._offsets + U32.size * number)
+        return self.map[self._words + start : self._words + end]
+
+    def word(self, number):
+        """Get a word by its number, in order of length and letter signature."""
+        return self._word_bytes(number).decode("ascii")
+
+    def lengths(self, min_length=0, max_length=MAX_LENGTH):
+        """Get the range of word numbers with a length between the two, included."""
+        min_length = max(0, min(min_length, MAX_LENGTH + 1))
+        max_length = max(min_length - 1, min(max_length, MAX_LENGTH))
+        return range(
+            U32.unpack_from(self.map, self._length_starts + U32.size * min_length)[0],
+            U32.unpack_from(
+                self.map, self._length_starts + U32.size * (max_length + 1)
+            )[0],
+        )
+
+    def random_word(self, min_length=0, max_length=MAX_LENGTH, rng=random):
+        """Get a random word with a length between the two, or None without any."""
+        numbers = self.lengths(min_length, max_length)
+        if not numbers:
+            return None
+        return self.word(rng.randrange(numbers.start, numbers.stop))
+
+    def block(self, length):
+        """Get the bytes of all words with a length, one after the other.
+
+        Words of the same length are stored back to back, so the block is a matrix of
+        one row per word, without copying anything out of the memory map."""
+        numbers = self.lengths(length, length)
+        start = U32.unpack_from(self.map, self._offsets + U32.size * numbers.start)[0]
+        end = U32.unpack_from(self.map, self._offsets + U32.size * numbers.stop)[0]
+        return memoryview(self.map)[self._words + start : self._words + end]
+
+    def buckets(self, length):
+        """Get (signature, word numbers) of the buckets of words with a length."""
+        if not 0 <= length <= MAX_LENGTH:
+            return []
+        first, last = SPAN.unpack_from(
+            self.map, self._bucket_starts + U32.size * length
+        )
+        end = self.lengths(length, length).stop
+        buckets = []
+        for index in range(last - 1, first - 1, -1):
+            _, mask, start = BUCKET.unpack_from(
+                self.map, self._buckets + BUCKET.size * index
+            )
+            buckets.append((mask, range(start, end)))
+            end = start
+        buckets.reverse()
+        return buckets
+
+    def words(self, length, include=0, exclude=0):
+        """Get the words of a length having all letters of include and none of exclude.
+
+        Both are letter signatures, whole buckets are skipped by their signature."""
+        for mask, numbers in self.buckets(length):
+            if mask & include == include and not mask & exclude:
+                for number in numbers:
+                    yield self.word(number)
+
+    def close(self):
+        """Unmap the index."""
+        self.map.close()
+
+
+def index_path_for(source_path):
+    """Get the index path of a word list, in the temporary directory.
+
+    Indexes are never written next to the word list, which can be in an installed
+    package. The name has the path of the list hashed in, for lists of the same
+    name in other directories."""
+    source_path = os.path.abspath(source_path)
+    return os.path.join(
+        tempfile.gettempdir(),
+        "nethang-{}-{:08x}.idx".format(
+            os.path.basename(source_path), zlib.crc32(source_path.encode("utf-8"))
+        ),
+    )
+
+
+@lru_cache(maxsize=8)
+def open_dictionary(source_path, index_path=None):
+    """Get the Dictionary of a word list, compiled first if missing or outdated.
+
+    Opened once per process, the games of a game host all share it."""
+    if index_path is None:
+        index_path = index_path_for(source_path)
+    try:
+        outdated = os.path.getmtime(index_path) < os.path.getmtime(source_path)
+    except FileNotFoundError:
+        outdated = True
+    if outdated:
+        compile_wordlist(source_path, index_path)
+    return Dictionary(index_path)
+
+
+def cli_compile_wordlist():
+    """Compile a word list from the command line."""
+    parser = argparse.ArgumentParser(description="NetHang word list compiler.")
+    parser.add_argument("source", help="Text file with one word per line.")
+    parser.add_argument(
+        "index", nargs="?", help="Index path, or in the temporary directory."
+    )
+    args = parser.parse_args()
+
+    index_path = args.index or index_path_for(args.source)
+    count = compile_wordlist(args.source, index_path)
+    print("\x1B[36m" + str(count) + " words indexed in " + index_path + "\x1B[0m")
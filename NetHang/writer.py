@@ -0,0 +1,161 @@
+"""Non-blocking output for player connections, with bounded buffers"""
+
+
+class Outbox:
+    """Output buffers for each connection, flushed when sockets become writable.
+
+    Data is sent right away as far as the socket takes it, the rest is buffered and
+    on_pending asks the engine to watch the socket for writability. A connection
+    buffering more than high_water bytes is reported to on_evict, so one stalled
+    client can't hold up a broadcast to everyone else. With metrics (ServerMetrics),
+    messages, bytes and evictions get counted."""
+
+    def __init__(
+        self,
+        high_water=65536,
+        on_pending=None,
+        on_drained=None,
+        on_evict=None,
+        metrics=None,
+    ):
+        self.high_water = high_water
+        self.on_pending = on_pending
+        self.on_drained = on_drained
+        self.on_evict = on_evict
+        self.metrics = metrics
+        self.buffers = {}
+        self.evicted = set()
+
+    def send_all(self, players, data):
+        """Queue the same bytes for all players."""
+        for player in players:
+            self.write(player.socket, data)
+
+    def send(self, player, data):
+        """Queue bytes for one player."""
+        self.write(player.socket, data)
+
+    def write(self, socket, data):
+        """Send or buffer bytes for a socket."""
+        if socket in self.evicted:
+            return
+        sent = self._write(socket, data)
+        if self.metrics is not None:
+            self.metrics.sent_messages.inc()
+            self.metrics.sent_bytes.inc(sent)
+
+    def fan_out(self, sockets, data):
+        """Send or buffer the same bytes for many sockets, as write() for each.
+
+        Metrics are counted once for the whole batch, so sharing one frame with
+        thousands of sockets costs little more than their send() calls."""
+        messages, sent = 0, 0
+        evicted = self.evicted
+        for socket in sockets:
+            if socket not in evicted:
+                messages += 1
+                sent += self._write(socket, data)
+        if self.metrics is not None:
+            self.metrics.sent_messages.inc(messages)
+            self.metrics.sent_bytes.inc(sent)
+
+    def _write(self, socket, data):
+        """Send what a socket takes and buffer the rest, returns the bytes sent."""
+        buffer = self.buffers.get(socket)
+        if buffer is not None:
+            buffer += data
+            if len(buffer) > self.high_water:
+                self._evict(socket)
+            return 0
+
+        try:
+            sent = socket.send(data)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._evict(socket)
+            return 0
+        if sent < len(data):
+            self.buffers[socket] = bytearray(memoryview(data)[sent:])
+            if self.on_pending is not None:
+                self.on_pending(socket)
+            if len(data) - sent > self.high_water:
+                self._evict(socket)
+        return sent
+
+    def flush(self, socket):
+        """Send buffered bytes of a writable socket, handling partial sends."""
+        buffer = self.buffers.get(socket)
+        if buffer is None or socket in self.evicted:
+            return
+        try:
+            sent = socket.send(buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._evict(socket)
+            return
+        if self.metrics is not None:
+            self.metrics.sent_bytes.inc(sent)
+        del buffer[:sent]
+        if not buffer:
+            del self.buffers[socket]
+            if self.on_drained is not None:
+                self.on_drained(socket)
+
+    def pending(self, socket):
+        """Get the number of bytes still buffered for a socket."""
+        return len(self.buffers.get(socket, b""))
+
+    def buffered(self, socket):
+        """Get a copy of the bytes still buffered for a socket."""
+        return bytes(self.buffers.get(socket, b""))
+
+    def discard(self, socket):
+        """Forget a connection before it gets closed."""
+        self.evicted.discard(socket)
+        if self.buffers.pop(socket, None) is not None and self.on_drained is not None:
+            self.on_drained(socket)
+
+    def _evict(self, socket):
+        if self.metrics is not None:
+            self.metrics.evictions.inc()
+        self.evicted.add(socket)
+        if self.on_evict is not None:
+            self.on_evict(socket)
+
+
+class PipeOutbox:
+    """Outbox for game hosts, forwarding the output of a room to the server by pipe.
+
+    Messages are ("output", room, nicknames, bytes) tuples, so the server writes them
+    to the current connection of each player, even if the player rejoined during the
+    game. The lock is shared by all games sending over the same connection."""
+
+    def __init__(self, connection, room=None, lock=None):
+        self.connection = connection
+        self.room = room
+        self.lock = lock
+
+    def _forward(self, nicknames, data):
+        if self.lock is None:
+            self.connection.send(("output", self.room, nicknames, data))
+            return
+        with self.lock:
+            self.connection.send(("output", self.room, nicknames, data))
+
+    def send_all(self, players, data):
+        """Forward the same bytes for all players."""
+        self._forward(players.get_nicknames(), data)
+
+    def send(self, player, data):
+        """Forward bytes for one player."""
+        self._forward([player.nickname], data)
+
+    def send_frame(self, changes, whole):
+        """Forward a frame for the spectators of the room, whole and as changes."""
+        if self.lock is None:
+            self.connection.send(("frame", self.room, changes, whole))
+            return
+        with self.lock:
+            self.connection.send(("frame", self.room, changes, whole))
@@ -0,0 +1,80 @@
+"""Functional tests for cluster mode, with two nodes and a coordinator."""
+
+import random
+import socket as so
+from multiprocessing import Process
+from time import sleep
+
+import NetHang
+import NetHang.cluster
+
+
+def new_node(coordinator):
+    port = random.randint(49152, 65535)
+    return NetHang.server.NetHangServer(
+        "localhost",
+        priority_settings={"avail_ports": [port], "coordinator": coordinator},
+        engine="multiprocessing",
+    )
+
+
+def recv_until(socket, bytestring):
+    recv_buf = b""
+    while bytestring not in recv_buf:
+        data = socket.recv(1)
+        if not data:
+            break
+        recv_buf += data
+    return recv_buf
+
+
+def serve_coordinator(tmp_path):
+    NetHang.cluster.Coordinator(str(tmp_path / "coordinator")).serve()
+
+
+def join(node, line):
+    client = so.create_connection(("localhost", node.server_port))
+    recv_until(client, b"Nickname: ")
+    client.send(line)
+    return client
+
+
+def test_nodes_send_players_to_owner(tmp_path):
+    """Are players of another node's nickname or room sent to that node?"""
+    process = Process(target=serve_coordinator, args=(tmp_path,), daemon=True)
+    process.start()
+    while not (tmp_path / "coordinator").exists():
+        sleep(0.01)
+    first_node = new_node(str(tmp_path / "coordinator"))
+    second_node = new_node(str(tmp_path / "coordinator"))
+    moved = b"reconnect to \x1B[01;36mlocalhost:" + str(first_node.server_port).encode()
+    try:
+        first_node.run()
+        second_node.run()
+
+        NetHang.util.timeout_in(5)
+        owner = join(first_node, b"ClusterUser@red\n")
+        recv_until(owner, b"You are in room \x1B[01;36mred")
+        sleep(0.1)
+
+        with join(second_node, b"OtherUser@red\n") as client:
+            assert moved in recv_until(client, b"\x1B[0m.\n")
+        with join(second_node, b"ClusterUser\n") as client:
+            assert moved in recv_until(client, b"\x1B[0m.\n")
+        with join(second_node, b"OtherUser\n") as client:
+            recv_until(client, b"You are in room")
+        NetHang.util.timeout_kill()
+
+        owner.close()
+        sleep(0.08)
+        first_node.stop()
+        second_node.stop()
+
+    except Exception:
+        first_node.stop()
+        second_node.stop()
+        raise
+    finally:
+        process.terminate()
+
+    assert True
@@ -0,0 +1,31 @@
+"""Functional tests for the load test harness, against both engines."""
+
+import pytest
+
+import NetHang.loadtest
+
+
+@pytest.fixture(params=["multiprocessing", "asyncio"])
+def engine(request):
+    return request.param
+
+
+def test_load_test_plays_games(capfd, engine):
+    """Do the simulated clients join, rejoin, chat and play full games?"""
+    with capfd.disabled():
+        print("\n--- TEST LOAD TEST HARNESS (" + engine + ") ---")
+        report = NetHang.loadtest.LoadTest(
+            clients=4,
+            rejoin_ratio=0.5,
+            typing_delay=0,
+            timeout=30,
+            engine=engine,
+            settings={"room_size": 2, "lobby_time": 1},
+        ).run()
+        print(NetHang.loadtest.format_report(report))
+        print("-----------------------------")
+
+    assert report["joined"] == 4
+    assert report["finished"] == 4
+    assert report["join_latency"]["count"] == 4
+    assert report["turn_latency"] is not None
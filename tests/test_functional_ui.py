@@ -8,6 +8,9 @@
 import random
 import socket as so
 from time import sleep
+from urllib.request import urlopen
+
+import pytest
 
 import NetHang
 
@@ -22,10 +25,12 @@ def generate_string(length, charset=LATIN1_PRINTABLE):
     return "".join([random.choices(charset)[0] for _ in range(length)])
 
 
-def new_server():
+def new_server(engine="multiprocessing", **settings):
     port = random.randint(49152, 65535)
     return NetHang.server.NetHangServer(
-        "localhost", priority_settings={"avail_ports": [port]}
+        "localhost",
+        priority_settings={"avail_ports": [port], **settings},
+        engine=engine,
     )
 
 
@@ -36,13 +41,19 @@ def recv_until(socket, bytestring):
     return recv_buf
 
 
+@pytest.fixture(params=["multiprocessing", "asyncio"])
+def engine(request):
+    """Every functional test runs against both server engines."""
+    return request.param
+
+
 # ------------------------------ tests ------------------------------
 
 
-def test_simple_user_joining():
+def test_simple_user_joining(engine):
     """Can a simple nickname join the server from localhost?"""
     try:
-        server = new_server()
+        server = new_server(engine)
         server.run()
         with so.create_connection(("localhost", server.server_port)) as client:
             recv_until(client, b"Nickname: ")
@@ -64,10 +75,10 @@ def test_simple_user_joining():
     assert True
 
 
-def test_bad_name_length_joining():
+def test_bad_name_length_joining(engine):
     """Does the server block too long/short nicknames?"""
     try:
-        server = new_server()
+        server = new_server(engine)
         server.run()
         with so.create_connection(("localhost", server.server_port)) as client:
             recv_until(client, b"Nickname: ")
@@ -90,10 +101,10 @@ def test_bad_name_length_joining():
     assert True
 
 
-def test_user_rejoining():
+def test_user_rejoining(engine):
     """Can the rejoin code be used to rejoin as user?"""
     try:
-        server = new_server()
+        server = new_server(engine)
         server.run()
 
         first_client = so.create_connection(("localhost", server.server_port))
@@ -134,7 +145,7 @@ def test_user_rejoining():
     assert True
 
 
-def test_user_chat_communication():
+def test_user_chat_communication(engine):
     """Can two users chat?"""
     n_messages = 6
     try:
@@ -142,7 +153,7 @@ def test_user_chat_communication():
             generate_string(length).encode("latin1") + b"\n"
             for length in range(1, 4 * n_messages + 1, 4)
         ]
-        server = new_server()
+        server = new_server(engine)
         server.run()
         with so.create_connection(
             ("localhost", server.server_port)
@@ -179,3 +190,343 @@ def test_user_chat_communication():
         raise
 
     assert True
+
+
+def test_rooms_chat_separately(engine):
+    """Do players only chat with players of the same room?"""
+    try:
+        server = new_server(engine)
+        server.run()
+        with so.create_connection(
+            ("localhost", server.server_port)
+        ) as red_client, so.create_connection(
+            ("localhost", server.server_port)
+        ) as other_red_client, so.create_connection(
+            ("localhost", server.server_port)
+        ) as blue_client:
+            for client, nickname in [
+                (red_client, b"RedOne@red\n"),
+                (other_red_client, b"RedTwo@red\n"),
+                (blue_client, b"BlueOne@blue\n"),
+            ]:
+                recv_until(client, b"Nickname: ")
+                client.send(nickname)
+
+            # Check room placement and chat, or raise TimeoutError
+            NetHang.util.timeout_in(3)
+            recv_until(red_client, b"room \x1B[01;36mred")
+            recv_until(other_red_client, b"room \x1B[01;36mred")
+            recv_until(blue_client, b"room \x1B[01;36mblue")
+            blue_client.send(b"Blue message\n")
+            red_client.send(b"Red message\n")
+            assert b"Blue message" not in recv_until(other_red_client, b"Red message")
+            NetHang.util.timeout_kill()
+
+            red_client.shutdown(so.SHUT_RDWR)
+            other_red_client.shutdown(so.SHUT_RDWR)
+            blue_client.shutdown(so.SHUT_RDWR)
+        sleep(0.08)
+        server.stop()
+
+    except Exception:
+        server.stop()
+        raise
+
+    assert True
+
+
+def test_metrics_endpoint(engine):
+    """Are joins and sent bytes counted on the metrics endpoint?"""
+    try:
+        server = new_server(engine, metrics_port=0)
+        server.run()
+        with so.create_connection(("localhost", server.server_port)) as client:
+            recv_until(client, b"Nickname: ")
+            client.send(b"MetricsUser\n")
+
+            NetHang.util.timeout_in(3)
+            recv_until(client, b"You are in room")
+            sleep(0.2)
+            with urlopen(
+                "http://127.0.0.1:" + str(server.metrics_port) + "/metrics"
+            ) as response:
+                text = response.read().decode("utf-8")
+            NetHang.util.timeout_kill()
+            client.shutdown(so.SHUT_RDWR)
+        sleep(0.08)
+        server.stop()
+
+    except Exception:
+        server.stop()
+        raise
+
+    assert "# TYPE nethang_accepted_total counter" in text
+    assert 'nethang_joined_total{worker="0"}' in text
+    assert "\nnethang_players 1\n" in text
+    assert "\nnethang_sent_bytes_total 0\n" not in text
+    assert "nethang_loop_tick_seconds_count" in text
+
+
+def test_reuse_port_joining():
+    """Do players join when each accept worker has its own SO_REUSEPORT listener?"""
+    if not hasattr(so, "SO_REUSEPORT"):
+        pytest.skip("SO_REUSEPORT is not available.")
+    try:
+        server = new_server("multiprocessing", reuse_port=True, new_conn_processes=3)
+        server.run()
+        clients = []
+        NetHang.util.timeout_in(5)
+        for number in range(12):
+            client = so.create_connection(("localhost", server.server_port))
+            recv_until(client, b"Nickname: ")
+            client.send(b"ReusePortUser" + str(number).encode("latin-1") + b"\n")
+            recv_until(client, b"You are in room")
+            clients.append(client)
+        NetHang.util.timeout_kill()
+        for client in clients:
+            client.shutdown(so.SHUT_RDWR)
+            client.close()
+        sleep(0.08)
+        server.stop()
+
+    except Exception:
+        server.stop()
+        raise
+
+    assert sum(joined.get() for joined in server.metrics.joined) == 12
+
+
+def test_idle_clients_dont_block_joining(engine):
+    """Can a user join while other connections never answer the nickname prompt?"""
+    try:
+        server = new_server(engine, new_conn_processes=1, handshake_timeout=0.5)
+        server.run()
+        idle_clients = []
+        for _ in range(5):
+            idle_client = so.create_connection(("localhost", server.server_port))
+            recv_until(idle_client, b"Nickname: ")
+            idle_clients.append(idle_client)
+
+        with so.create_connection(("localhost", server.server_port)) as client:
+            NetHang.util.timeout_in(1)
+            recv_until(client, b"Nickname: ")
+            client.send(b"NotIdleUser\n")
+            recv_until(client, b"You are in room")
+            NetHang.util.timeout_kill()
+
+            # Idle connections get disconnected at the deadline
+            NetHang.util.timeout_in(2)
+            for idle_client in idle_clients:
+                recv_until(idle_client, b"Too slow")
+                idle_client.close()
+            NetHang.util.timeout_kill()
+            client.shutdown(so.SHUT_RDWR)
+        sleep(0.08)
+        server.stop()
+
+    except Exception:
+        server.stop()
+        raise
+
+    assert True
+
+
+def test_pipelined_and_split_lines(engine):
+    """Are lines sent together with the nickname, or split in parts, all chatted?"""
+    try:
+        server = new_server(engine)
+        server.run()
+        with so.create_connection(
+            ("localhost", server.server_port)
+        ) as first_client, so.create_connection(
+            ("localhost", server.server_port)
+        ) as second_client:
+            NetHang.util.timeout_in(3)
+            recv_until(first_client, b"Nickname: ")
+            first_client.send(b"PipelineOne\n")
+            recv_until(first_client, b"You are in room")
+
+            recv_until(second_client, b"Nickname: ")
+            second_client.send(b"PipelineTwo\r\nfirst line\r\nsecond line\nthi")
+            recv_until(first_client, b"first line\n")
+            recv_until(first_client, b"second line\n")
+            sleep(0.04)
+            second_client.send(b"rd line\n")
+            recv_until(first_client, b"<PipelineTwo>:\x1B[0m third line\n")
+            NetHang.util.timeout_kill()
+
+            first_client.shutdown(so.SHUT_RDWR)
+            second_client.shutdown(so.SHUT_RDWR)
+        sleep(0.08)
+        server.stop()
+
+    except Exception:
+        server.stop()
+        raise
+
+    assert True
+
+
+def test_rejoining_after_restart(engine, tmp_path):
+    """Can a player rejoin with its code after leaving and a server restart?"""
+    store = str(tmp_path / "sessions.db")
+    try:
+        server = new_server(engine, session_store=store)
+        server.run()
+        with so.create_connection(("localhost", server.server_port)) as client:
+            recv_until(client, b"Nickname: ")
+            client.send(b"ReturningUser\n")
+
+            NetHang.util.timeout_in(1)
+            rejoin_code = (
+                recv_until(client, b"You are in room")
+                .split(b"\x1B[01;91m", 1)[1]
+                .split(b"\x1B[0m", 1)[0]
+            )
+            NetHang.util.timeout_kill()
+            client.shutdown(so.SHUT_RDWR)
+        sleep(0.08)
+        server.stop()
+
+        server = new_server(engine, session_store=store)
+        server.run()
+        with so.create_connection(("localhost", server.server_port)) as client:
+            recv_until(client, b"Nickname: ")
+            client.send(b"ReturningUser\n")
+
+            NetHang.util.timeout_in(1)
+            recv_until(client, b"Code: ")
+            client.send(rejoin_code + b"\n")
+            recv_until(client, b"Welcome back!")
+            recv_until(client, b"You are in room")
+            NetHang.util.timeout_kill()
+            client.shutdown(so.SHUT_RDWR)
+        sleep(0.08)
+        server.stop()
+
+    except Exception:
+        server.stop()
+        raise
+
+    assert True
+
+
+def test_spectator_watching(engine, tmp_path, monkeypatch):
+    """Do spectators of a room see its game, and not the rooms that aren't there?"""
+    # Compiled for the test, not in the temporary directory
+    game_data = NetHang.examples.hangman.GAME_DATA
+    monkeypatch.setitem(game_data, "wordlist_index", str(tmp_path / "words.idx"))
+    try:
+        server = NetHang.server.NetHangServer(
+            "localhost",
+            game_class=NetHang.examples.hangman.WordlistGame,
+            priority_settings={
+                "avail_ports": [random.randint(49152, 65535)],
+                "lobby_time": 1,
+            },
+            engine=engine,
+        )
+        server.run()
+        with so.create_connection(
+            ("localhost", server.server_port)
+        ) as player, so.create_connection(
+            ("localhost", server.server_port)
+        ) as spectator, so.create_connection(
+            ("localhost", server.server_port)
+        ) as lost_spectator:
+            NetHang.util.timeout_in(5)
+            recv_until(player, b"Nickname: ")
+            player.send(b"PlayingUser@red\n")
+            recv_until(player, b"room \x1B[01;36mred")
+
+            recv_until(lost_spectator, b"Nickname: ")
+            lost_spectator.send(b"@blue\n")
+            recv_until(lost_spectator, b"There is no room")
+
+            recv_until(spectator, b"Nickname: ")
+            spectator.send(b"@red\n")
+            recv_until(spectator, b"watching room \x1B[01;36mred")
+            # The game starts after the lobby time, the spectator sees its frames
+            recv_until(spectator, b"GUESSWORD")
+            NetHang.util.timeout_kill()
+
+            player.shutdown(so.SHUT_RDWR)
+            spectator.shutdown(so.SHUT_RDWR)
+        sleep(0.08)
+        server.stop()
+
+    except Exception:
+        server.stop()
+        raise
+
+    assert True
+
+
+def test_connection_flood_refused(engine):
+    """Are connections over the rate of an IP address refused before the title?"""
+    try:
+        server = new_server(engine, connection_rate=0.1, connection_burst=2)
+        server.run()
+        clients = [
+            so.create_connection(("localhost", server.server_port)) for _ in range(3)
+        ]
+        NetHang.util.timeout_in(2)
+        recv_until(clients[0], b"Nickname: ")
+        recv_until(clients[1], b"Nickname: ")
+        assert recv_until(clients[2], b"slow down!\n").startswith(b"Too many")
+        NetHang.util.timeout_kill()
+        for client in clients:
+            client.close()
+        sleep(0.08)
+        server.stop()
+
+    except Exception:
+        server.stop()
+        raise
+
+    assert True
+
+
+def test_games_journaled(engine, tmp_path, monkeypatch):
+    """Do game hosts journal the players, word and guesses of a game?"""
+    # Compiled for the test, not in the temporary directory
+    game_data = NetHang.examples.hangman.GAME_DATA
+    monkeypatch.setitem(game_data, "wordlist_index", str(tmp_path / "words.idx"))
+    journal_dir = tmp_path / "journals"
+    try:
+        server = NetHang.server.NetHangServer(
+            "localhost",
+            game_class=NetHang.examples.hangman.WordlistGame,
+            priority_settings={
+                "avail_ports": [random.randint(49152, 65535)],
+                "lobby_time": 1,
+                "journal_dir": str(journal_dir),
+            },
+            engine=engine,
+        )
+        server.run()
+        with so.create_connection(("localhost", server.server_port)) as player:
+            NetHang.util.timeout_in(5)
+            recv_until(player, b"Nickname: ")
+            player.send(b"JournaledUser\n")
+            recv_until(player, b"your turn")
+            player.send(b"e\n")
+            recv_until(player, b'"E"')
+            NetHang.util.timeout_kill()
+            player.shutdown(so.SHUT_RDWR)
+        sleep(0.08)
+        server.stop()
+
+    except Exception:
+        server.stop()
+        raise
+
+    (path,) = journal_dir.iterdir()
+    records = NetHang.journal.read_journal(str(path))
+    kinds = [kind for kind, _, _ in records]
+    assert kinds[:2] == [NetHang.journal.START, NetHang.journal.JOIN]
+    assert records[0][2][1] == "NetHang.examples.hangman.WordlistGame"
+    assert NetHang.journal.ROUND in kinds
+    assert (NetHang.journal.INPUT, ["JournaledUser", "e"]) in [
+        (kind, fields) for kind, _, fields in records
+    ]
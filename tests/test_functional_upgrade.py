@@ -0,0 +1,84 @@
+"""Functional tests for hot upgrades, a new server taking over a running one."""
+
+import socket as so
+from time import sleep
+
+import NetHang
+
+
+def new_server(path):
+    return NetHang.server.NetHangServer(
+        "localhost",
+        priority_settings={"upgrade_socket": path},
+        engine="multiprocessing",
+    )
+
+
+def recv_until(socket, bytestring):
+    recv_buf = b""
+    while bytestring not in recv_buf:
+        data = socket.recv(1)
+        if not data:
+            break
+        recv_buf += data
+    return recv_buf
+
+
+def join(port, line):
+    client = so.create_connection(("localhost", port))
+    recv_until(client, b"Nickname: ")
+    client.send(line)
+    recv_until(client, b"You are in room \x1B[01;36mred")
+    return client
+
+
+def test_upgrade_keeps_players(tmp_path):
+    """Do players stay connected, in their room, when a new server takes over?"""
+    old_server = new_server(str(tmp_path / "upgrade"))
+    old_server.run()
+    try:
+        NetHang.util.timeout_in(5)
+        player = join(old_server.server_port, b"UpgradeUser@red\n")
+        spectator = so.create_connection(("localhost", old_server.server_port))
+        recv_until(spectator, b"Nickname: ")
+        spectator.send(b"@red\n")
+        recv_until(spectator, b"watching room \x1B[01;36mred")
+
+        upgraded_server = new_server(str(tmp_path / "upgrade"))
+        assert upgraded_server.server_port == old_server.server_port
+        upgraded_server.run()
+    except Exception:
+        old_server.stop()
+        raise
+
+    try:
+        assert b"Server upgraded" in recv_until(
+            player, b"You are in room \x1B[01;36mred"
+        )
+        assert b"Server upgraded" in recv_until(
+            spectator, b"watching room \x1B[01;36mred"
+        )
+        old_server.server_process.join(5)
+        assert not old_server.server_process.is_alive()
+
+        # Same room and nickname on the new server, and the port still accepts
+        other = join(upgraded_server.server_port, b"OtherUser@red\n")
+        player.send(b"still here\n")
+        assert b"still here" in recv_until(other, b"still here")
+        with so.create_connection(("localhost", upgraded_server.server_port)) as client:
+            recv_until(client, b"Nickname: ")
+            client.send(b"UpgradeUser\n")
+            assert b"Code: " in recv_until(client, b"Code: ")
+        NetHang.util.timeout_kill()
+
+        player.close()
+        other.close()
+        spectator.close()
+        sleep(0.08)
+        upgraded_server.stop()
+
+    except Exception:
+        upgraded_server.stop()
+        raise
+
+    assert True
@@ -0,0 +1,41 @@
+"""Tests for the admission.py module."""
+
+import pytest
+
+import NetHang
+import NetHang.admission as admission
+
+
+def test_ban_list():
+    """Are addresses in banned networks found, of both IP versions?"""
+    bans = admission.BanList(["10.0.0.0/8", "192.168.1.7", "2001:db8::/32"])
+    assert len(bans) == 3
+    for address in ("10.255.0.1", "192.168.1.7", "2001:db8::1", "::ffff:10.0.0.1"):
+        assert address in bans
+    for address in ("11.0.0.1", "192.168.1.8", "2001:db9::1", "not an address"):
+        assert address not in bans
+    with pytest.raises(ValueError):
+        admission.BanList(["10.0.0.0/33"])
+
+
+def test_rate_limiter():
+    """Are bursts let through, then connections at the refill rate only?"""
+    now = [100.0]
+    limiter = admission.RateLimiter(2, 3, clock=lambda: now[0])
+    assert [limiter.allow("10.0.0.1") for _ in range(4)] == [True] * 3 + [False]
+    assert limiter.allow("10.0.0.2")
+    now[0] += 0.5
+    assert limiter.allow("10.0.0.1")
+    assert not limiter.allow("10.0.0.1")
+    now[0] += 60
+    assert [limiter.allow("10.0.0.1") for _ in range(4)] == [True] * 3 + [False]
+
+
+def test_admission_caps():
+    """Are connections past max_conn refused, unless a cluster can take them?"""
+    check = admission.Admission({"max_conn": 4, "max_handshakes": 2}).check
+    assert check("10.0.0.1", 1, 1) is None
+    assert check("10.0.0.1", 1, 2) == NetHang.messages.SERVER_FULL
+    assert check("10.0.0.1", 3, 1) == NetHang.messages.SERVER_FULL
+    clustered = {"max_conn": 4, "coordinator": "/tmp/coordinator"}
+    assert admission.Admission(clustered).check("10.0.0.1", 10, 1) is None
@@ -0,0 +1,77 @@
+"""Tests for the cluster.py module."""
+
+from threading import Thread
+from time import sleep
+
+import pytest
+
+import NetHang
+
+
+def new_coordinator(tmp_path, authkey=None):
+    coordinator = NetHang.cluster.Coordinator(str(tmp_path / "coordinator"), authkey)
+    Thread(target=coordinator.serve, daemon=True).start()
+    return coordinator
+
+
+def test_parse_address():
+    """Are TCP addresses told apart from Unix socket paths?"""
+    assert NetHang.cluster.parse_address("localhost:5000") == ("localhost", 5000)
+    assert NetHang.cluster.parse_address(":5000") == ("localhost", 5000)
+    assert NetHang.cluster.parse_address("/tmp/nethang") == "/tmp/nethang"
+
+
+def test_coordinator_ownership(tmp_path):
+    """Are nicknames and rooms owned by the nodes claiming them, until they leave?"""
+    coordinator = new_coordinator(tmp_path)
+    first = NetHang.cluster.CoordinatorClient(coordinator.address, "host:1")
+    second = NetHang.cluster.CoordinatorClient(coordinator.address, "host:2")
+    lookups = NetHang.cluster.CoordinatorClient(coordinator.address)
+
+    first.claim_nickname("Nickname1")
+    first.claim_room("red")
+    # Nodes are served by threads of their own, claims of both race without a pause
+    sleep(0.05)
+    second.claim_room("red")
+    second.claim_nickname("Nickname2")
+    first.report_load(10, 2)
+    second.report_load(3, 1)
+    sleep(0.05)
+    assert lookups.lookup("Nickname1", "red") == {
+        "nickname": "host:1",
+        "room": "host:1",
+        "least_loaded": "host:2",
+    }
+
+    # Rejoining on another node moves the nickname there
+    second.claim_nickname("Nickname1")
+    sleep(0.05)
+    assert lookups.lookup("Nickname1")["nickname"] == "host:2"
+
+    # Leaving frees the nickname, unless it moved to another node meanwhile
+    second.claim_nickname("Nickname3")
+    first.release_nickname("Nickname1")
+    second.release_nickname("Nickname3")
+    sleep(0.05)
+    assert lookups.lookup("Nickname1")["nickname"] == "host:2"
+    assert lookups.lookup("Nickname3")["nickname"] is None
+
+    second.close()
+    sleep(0.05)
+    assert lookups.lookup("Nickname2", "red") == {
+        "nickname": None,
+        "room": "host:1",
+        "least_loaded": "host:1",
+    }
+    first.close()
+    lookups.close()
+
+
+def test_coordinator_authkey(tmp_path):
+    """Are nodes without the shared key refused?"""
+    coordinator = new_coordinator(tmp_path, b"secret")
+    with pytest.raises(OSError):
+        NetHang.cluster.CoordinatorClient(coordinator.address, "host:1", b"wrong")
+    client = NetHang.cluster.CoordinatorClient(coordinator.address, "host:1", b"secret")
+    assert client.lookup("Nickname1")["least_loaded"] == "host:1"
+    client.close()
@@ -0,0 +1,93 @@
+"""Tests for the commands.py module."""
+
+import queue
+import threading
+
+import pytest
+
+import NetHang
+
+
+def command(nickname, line):
+    return (NetHang.players.Player(None, nickname), line)
+
+
+def test_command_queue_open_by_default():
+    """Are commands from everyone accepted before expect() is called?"""
+    commands = NetHang.commands.CommandQueue()
+    commands.put(command("Nickname1", "a"))
+    commands.put(command("Nickname2", "b"))
+    assert commands.get(timeout=1)[1] == "a"
+    assert commands.get(timeout=1)[1] == "b"
+
+
+def test_command_queue_drop_policy():
+    """Are commands from players not awaited dropped, but server notices kept?"""
+    expected = []
+    commands = NetHang.commands.CommandQueue("drop", on_expect=expected.append)
+    commands.expect("Nickname1")
+    assert expected == [["Nickname1"]]
+
+    commands.put(command("Nickname2", "ignored"))
+    commands.put(command(".", "-Nickname3"))
+    commands.put(command("Nickname1", "a"))
+    assert commands.get(timeout=1)[1] == "-Nickname3"
+    assert commands.get(timeout=1)[1] == "a"
+    with pytest.raises(queue.Empty):
+        commands.get(timeout=0.01)
+
+
+def test_command_queue_buffer_policy():
+    """Are commands typed ahead released once their player is awaited?"""
+    commands = NetHang.commands.CommandQueue("buffer", buffer_size=2)
+    commands.expect("Nickname1")
+    for line in ["x", "y", "z"]:
+        commands.put(command("Nickname2", line))
+    with pytest.raises(queue.Empty):
+        commands.get(timeout=0.01)
+
+    commands.expect("Nickname2")
+    assert commands.get(timeout=1)[1] == "y"
+    assert commands.get(timeout=1)[1] == "z"
+
+
+def test_command_queue_bad_policy():
+    """Is an unknown policy refused?"""
+    with pytest.raises(ValueError):
+        NetHang.commands.CommandQueue("keep")
+
+
+def test_command_queue_timers_deadline():
+    """Do timed gets run out on the timers, skipping deadlines of earlier gets?"""
+    timers = NetHang.timers.Timers()
+    commands = NetHang.commands.CommandQueue(timers=timers)
+    commands.put(command("Nickname1", "a"))
+    assert commands.get(timeout=5)[1] == "a"
+    assert len(timers) == 0
+
+    # The deadline runs out once the owner of the timers runs them
+    runner = threading.Timer(0.05, timers.run_due)
+    runner.start()
+    with pytest.raises(queue.Empty):
+        commands.get(timeout=0.01)
+    runner.join()
+
+    commands.queue.put(NetHang.commands._Deadline())
+    commands.put(command("Nickname1", "b"))
+    assert commands.get(timeout=5)[1] == "b"
+
+
+def test_command_queue_journal():
+    """Are the commands the game gets, and its timeouts, journaled in order?"""
+    journal = NetHang.journal._Recorder()
+    commands = NetHang.commands.CommandQueue("drop", journal=journal)
+    commands.expect("Nickname1")
+    commands.put(command("Nickname2", "ignored"))
+    commands.put(command("Nickname1", "a"))
+    commands.get(timeout=1)
+    with pytest.raises(queue.Empty):
+        commands.get(timeout=0.01)
+    assert journal.events == [
+        (NetHang.journal.INPUT, ["Nickname1", "a"]),
+        (NetHang.journal.TIMEOUT, []),
+    ]
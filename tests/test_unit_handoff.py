@@ -0,0 +1,51 @@
+"""Tests for the handoff.py module."""
+
+import socket as so
+from multiprocessing import Process
+
+import NetHang
+
+
+def _send_from_child(handoff, client_socket):
+    handoff.send(client_socket, nickname="Nickname1", address="127.0.0.1", room=None)
+
+
+def test_handoff_between_processes():
+    """Does a socket passed by another process keep its connection and fields?"""
+    handoff = NetHang.handoff.SocketHandoff()
+    assert handoff.receive() == []
+
+    local, remote = so.socketpair()
+    process = Process(target=_send_from_child, args=(handoff, remote))
+    process.start()
+    process.join()
+    remote.close()
+
+    received = handoff.receive()
+    assert len(received) == 1
+    client_socket, fields = received[0]
+    assert fields == {"nickname": "Nickname1", "address": "127.0.0.1", "room": None}
+
+    client_socket.send(b"hello\n")
+    assert local.recv(16) == b"hello\n"
+    local.send(b"back\n")
+    assert client_socket.recv(16) == b"back\n"
+
+    client_socket.close()
+    local.close()
+    handoff.close()
+
+
+def test_handoff_closes_sent_socket():
+    """Is the sending copy closed, leaving the received socket the only one?"""
+    handoff = NetHang.handoff.SocketHandoff()
+    local, remote = so.socketpair()
+    handoff.send(remote, nickname="Nickname1")
+    assert remote.fileno() == -1
+
+    client_socket, _ = handoff.receive()[0]
+    client_socket.close()
+    assert local.recv(16) == b""
+
+    local.close()
+    handoff.close()
@@ -0,0 +1,227 @@
+"""Tests for the handshake.py module."""
+
+import json
+import socket as so
+from multiprocessing.connection import Listener
+from threading import Event, Thread
+from time import monotonic
+
+import NetHang
+
+SETTINGS = {
+    "send_high_water": 65536,
+    "delay_factor": 0.0,
+    "handshake_timeout": 30,
+    "blacklisted": None,
+    "allow_same_source_ip": True,
+    "lobby_time": 60,
+}
+GAME_DATA = {"title": "Title\n", "opening": "Opening\n"}
+
+
+def new_handshakes(roster=None, **settings):
+    joined = []
+    handshakes = NetHang.handshake.Handshakes(
+        roster or NetHang.roster.SharedRoster(),
+        {**SETTINGS, **settings},
+        GAME_DATA,
+        joined.append,
+    )
+    return handshakes, joined
+
+
+def connect(handshakes, address="127.0.0.1"):
+    client, server_side = so.socketpair()
+    client.settimeout(0)
+    handshakes.start(server_side, address)
+    return client
+
+
+def poll_until(handshakes, client, bytestring, limit=2.0):
+    """Poll the handshakes until the client received bytestring, returns all it got."""
+    received = b""
+    started = monotonic()
+    while bytestring not in received:
+        assert monotonic() - started < limit, received
+        handshakes.poll(0.01)
+        try:
+            data = client.recv(4096)
+        except BlockingIOError:
+            continue
+        if not data:
+            break
+        received += data
+    return received
+
+
+def test_handshake_joins():
+    """Does a nickname and room get a rejoin code and the welcome?"""
+    handshakes, joined = new_handshakes()
+    client = connect(handshakes)
+    assert poll_until(handshakes, client, b"Nickname: ").startswith(b"Title\n")
+    client.send(b"Nickname1@red\n")
+    received = poll_until(handshakes, client, b"Lobby time is")
+    assert received.startswith(b"Opening\nYour rejoin code is")
+
+    assert len(joined) == 1
+    handshake = joined[0]
+    assert (handshake.nickname, handshake.room) == ("Nickname1", "red")
+    assert handshake.rejoin_code.encode("latin-1") in received
+    assert not handshake.rejoined
+    assert len(handshakes) == 0
+    handshake.socket.close()
+    client.close()
+
+
+def test_handshake_rejoins_pipelined():
+    """Is a rejoin code sent along with the nickname accepted?"""
+    roster = NetHang.roster.SharedRoster()
+    roster.add("Nickname1", "127.0.0.1", "0042")
+    handshakes, joined = new_handshakes(roster)
+    client = connect(handshakes)
+    poll_until(handshakes, client, b"Nickname: ")
+    client.send(b"Nickname1\n0042\n")
+    assert poll_until(handshakes, client, b"Welcome back!\n").endswith(
+        b"Code: Welcome back!\n"
+    )
+    assert joined[0].rejoined and joined[0].rejoin_code == "0042"
+    joined[0].socket.close()
+    client.close()
+
+
+def test_handshake_bad_nickname_prompts_again():
+    """Is a bad nickname answered, with input until the new prompt thrown away?"""
+    handshakes, joined = new_handshakes()
+    client = connect(handshakes)
+    poll_until(handshakes, client, b"Nickname: ")
+    client.send(b"A\nNickname1\n")
+    received = poll_until(handshakes, client, b"Nickname: ")
+    assert received.startswith(b"Only alphanumeric")
+    assert not joined
+
+    client.send(b"Nickname2\n")
+    poll_until(handshakes, client, b"Lobby time is")
+    assert joined[0].nickname == "Nickname2"
+    joined[0].socket.close()
+    client.close()
+
+
+def test_handshake_slow_client_times_out():
+    """Does an idle client get dropped, while others join meanwhile?"""
+    handshakes, joined = new_handshakes(handshake_timeout=0.3)
+    idle = connect(handshakes)
+    poll_until(handshakes, idle, b"Nickname: ")
+
+    client = connect(handshakes)
+    poll_until(handshakes, client, b"Nickname: ")
+    client.send(b"Nickname1\n")
+    poll_until(handshakes, client, b"Lobby time is")
+    assert len(joined) == 1 and len(handshakes) == 1
+
+    assert poll_until(handshakes, idle, b"Too slow").endswith(b"disconnected!\n")
+    poll_until(handshakes, idle, b"\0")
+    assert len(handshakes) == 0
+    joined[0].socket.close()
+    client.close()
+    idle.close()
+
+
+def test_handshake_blacklisted():
+    """Is a blacklisted network refused at once, before the title?"""
+    handshakes, joined = new_handshakes(blacklisted=["10.0.0.0/8"])
+    client = connect(handshakes, "10.1.2.3")
+    received = poll_until(handshakes, client, b"\0")
+    assert received == b"This client IP is banned!\n"
+    assert not joined and len(handshakes) == 0
+    client.close()
+
+
+def test_handshake_caps():
+    """Are connections past the handshakes cap refused, until one finishes?"""
+    handshakes, joined = new_handshakes(max_conn=2, max_handshakes=1)
+    first = connect(handshakes)
+    second = connect(handshakes)
+    assert poll_until(handshakes, second, b"\0") == b"Server is full!\n"
+    poll_until(handshakes, first, b"Nickname: ")
+    first.send(b"Nickname1\n")
+    poll_until(handshakes, first, b"Lobby time is")
+    third = connect(handshakes)
+    assert poll_until(handshakes, third, b"Nickname: ").startswith(b"Title\n")
+    joined[0].socket.close()
+    for client in (first, second, third):
+        client.close()
+
+
+def test_handshake_drain():
+    """Are handshakes in progress finished once draining, with no new accepts?"""
+    handshakes, joined = new_handshakes()
+    listener = so.create_server(("localhost", 0))
+    handshakes.listen(listener)
+    drain, drain_signal = so.socketpair()
+    handshakes.drain_on(drain)
+
+    client = connect(handshakes)
+    poll_until(handshakes, client, b"Nickname: ")
+    assert len(handshakes) == 1
+    drain_signal.send(b"!")
+    handshakes.poll(0.01)
+    assert listener.fileno() == -1 and len(handshakes) == 1
+
+    client.send(b"Nickname1\n")
+    handshakes.run()
+    assert [handshake.nickname for handshake in joined] == ["Nickname1"]
+    drain.close()
+    drain_signal.close()
+
+
+def test_handshake_lookup_doesnt_block():
+    """Do other handshakes go on while the coordinator is slow to reply?"""
+    listener = Listener()
+    release = Event()
+
+    def slow_coordinator():
+        connection = listener.accept()
+        assert json.loads(connection.recv_bytes()) == ["lookup", "Nickname1", None]
+        release.wait(5)
+        reply = {"nickname": "host:2", "room": None, "least_loaded": "host:1"}
+        connection.send_bytes(json.dumps(reply).encode("utf-8"))
+
+    Thread(target=slow_coordinator, daemon=True).start()
+    handshakes, joined = new_handshakes(
+        coordinator=listener.address, node_address="host:1", max_conn=20
+    )
+    first = connect(handshakes)
+    poll_until(handshakes, first, b"Nickname: ")
+    first.send(b"Nickname1\n")
+    second = connect(handshakes)
+    assert poll_until(handshakes, second, b"Nickname: ").startswith(b"Title\n")
+
+    release.set()
+    assert b"reconnect to \x1B[01;36mhost:2" in poll_until(handshakes, first, b".\n")
+    assert not joined
+    for client in (first, second):
+        client.close()
+    listener.close()
+
+
+def test_handshake_coordinator_retry(tmp_path, monkeypatch):
+    """Is an unreachable coordinator not tried again on every nickname?"""
+    attempts = []
+    connect_coordinator = NetHang.cluster.connect
+    monkeypatch.setattr(
+        NetHang.cluster,
+        "connect",
+        lambda settings: attempts.append(1) or connect_coordinator(settings),
+    )
+    handshakes, joined = new_handshakes(
+        coordinator=str(tmp_path / "nowhere"), node_address="host:1", max_conn=20
+    )
+    for nickname in (b"Nickname1", b"Nickname2"):
+        client = connect(handshakes)
+        poll_until(handshakes, client, b"Nickname: ")
+        client.send(nickname + b"\n")
+        poll_until(handshakes, client, b"Lobby time is")
+        client.close()
+    assert len(joined) == 2 and len(attempts) == 1
+    for handshake in joined:
+        handshake.socket.close()
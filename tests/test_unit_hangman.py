@@ -0,0 +1,112 @@
+"""Tests for the examples/hangman.py module."""
+
+import socket as so
+from queue import Queue
+
+import NetHang.examples.hangman as hangman
+from NetHang.players import Player, PlayerList
+
+
+def test_guessword_matches_string_to_masked():
+    """Is the incremental masked word the same as a full render, on long words?"""
+    word = ("Hangman over the network, " * 4)[:80]
+    guessword = hangman.GuessWord(word)
+    tried = []
+    assert guessword.masked == hangman.string_to_masked(word, tried)
+    for letter in "nzatheowrkgmv":
+        tried.append(letter)
+        guessword.reveal(letter)
+        assert guessword.masked == hangman.string_to_masked(word, tried)
+        assert guessword.is_guessed() == hangman.is_guessed(word, tried)
+    assert guessword.is_guessed()
+
+
+def test_guessword_reveal_all():
+    """Does a whole word guess reveal every letter?"""
+    guessword = hangman.GuessWord("x-ray")
+    assert not guessword.is_guessed()
+    assert "-" in guessword.letters
+    guessword.reveal_all()
+    assert guessword.is_guessed()
+    assert guessword.masked == hangman.string_to_masked("x-ray", list("xray"))
+
+
+def new_player(nickname):
+    local, remote = so.socketpair()
+    remote.setblocking(False)
+    return Player(local, nickname), remote
+
+
+def received(remote):
+    data = b""
+    while True:
+        try:
+            chunk = remote.recv(65536)
+        except BlockingIOError:
+            return data
+        if not chunk:
+            return data
+        data += chunk
+
+
+def use_wordlist(tmp_path, monkeypatch, words):
+    """Play on a word list of the test, compiled next to it."""
+    (tmp_path / "words.txt").write_text(words)
+    monkeypatch.setitem(hangman.GAME_DATA, "wordlist", str(tmp_path / "words.txt"))
+    monkeypatch.setitem(
+        hangman.GAME_DATA, "wordlist_index", str(tmp_path / "words.idx")
+    )
+
+
+def test_wordlist_game(tmp_path, monkeypatch):
+    """Does a wordlist game play a round on a word of the wordlist, with no hanger?"""
+    use_wordlist(tmp_path, monkeypatch, "network\n")
+    player, remote = new_player("Nickname1")
+    players = PlayerList()
+    players.add_player(player)
+    commands = Queue()
+    commands.put((player, "network"))
+
+    game = hangman.WordlistGame(players, commands)
+    game.rounds = 1
+    game.run()
+    assert b"Guessers win!" in received(remote)
+    assert player.score == 200
+
+
+def test_hanger_word_checked(tmp_path, monkeypatch):
+    """Are hanger words not in the wordlist refused, with check_words?"""
+    use_wordlist(tmp_path, monkeypatch, "network\n")
+    monkeypatch.setitem(hangman.GAME_DATA, "check_words", True)
+    hanger, hanger_remote = new_player("Nickname1")
+    guesser, _ = new_player("Nickname2")
+    players = PlayerList()
+    players.add_player(hanger)
+    players.add_player(guesser)
+    commands = Queue()
+    commands.put((hanger, "notaword"))
+    commands.put((hanger, "Network"))
+    commands.put((guesser, "network"))
+
+    hangman.Round(hanger, players, commands, rounds=1)
+    assert b"Not in the wordlist" in received(hanger_remote)
+    assert guesser.score == 200
+
+
+def test_bots_fill_game(tmp_path, monkeypatch):
+    """Do bots join a lone player, and guess through the commands queue?"""
+    use_wordlist(tmp_path, monkeypatch, "network\n")
+    monkeypatch.setitem(hangman.GAME_DATA, "fill_bots", 2)
+    monkeypatch.setitem(hangman.GAME_DATA, "bot_delay", 0)
+    player, remote = new_player("Nickname1")
+    players = PlayerList()
+    players.add_player(player)
+    commands = Queue()
+    commands.put((player, "z"))
+
+    game = hangman.WordlistGame(players, commands)
+    game.rounds = 1
+    game.run()
+    assert players.get_nicknames() == ["Nickname1", "Bot-1"]
+    assert b"Guessers win!" in received(remote)
+    assert players.get_player(nickname="Bot-1").score == 200
@@ -0,0 +1,125 @@
+"""Tests for the journal.py module."""
+
+import os
+
+import NetHang
+import NetHang.examples.hangman as hangman
+from NetHang.journal import END, INPUT, JOIN, ROUND, SCORE, START, TIMEOUT
+
+
+def test_journal_round_trip(tmp_path):
+    """Are events read back as recorded, without a record cut short at the end?"""
+    writer = NetHang.journal.JournalWriter(str(tmp_path))
+    journal = writer.open("room")
+    journal.record(START, "room", "NetHang.examples.hangman.Game", 42)
+    journal.record(INPUT, "Nickname1", "a\0b\xe9")
+    journal.record(TIMEOUT)
+    journal.close()
+    writer.close()
+
+    path = str(tmp_path / "room.nhj")
+    with open(path, "ab") as file:
+        file.write(NetHang.journal.pack(SCORE, 0, ["Nickname1", 50])[:-3])
+    records = NetHang.journal.read_journal(path)
+    assert [(kind, fields) for kind, _, fields in records] == [
+        (START, ["room", "NetHang.examples.hangman.Game", "42"]),
+        (INPUT, ["Nickname1", "a\0b\xe9"]),
+        (TIMEOUT, []),
+    ]
+
+
+def test_journal_writes_in_batches(tmp_path):
+    """Do events reach the file only once flushed, all journals in one batch?"""
+    writer = NetHang.journal.JournalWriter(str(tmp_path))
+    first, second = writer.open("first"), writer.open("second")
+    for number in range(100):
+        first.record(INPUT, "Nickname1", str(number))
+        second.record(INPUT, "Nickname2", str(number))
+    assert not os.listdir(str(tmp_path))
+
+    assert writer.flush() > 0
+    assert sorted(os.listdir(str(tmp_path))) == ["first.nhj", "second.nhj"]
+    assert writer.flush() == 0
+    first.close()
+    writer.flush()
+    assert list(writer.files) == [second]
+    assert len(NetHang.journal.read_journal(str(tmp_path / "first.nhj"))) == 100
+    writer.close()
+
+
+class ScriptedOutbox:
+    """Outbox answering the prompts of the game for Nickname1, like a client."""
+
+    def __init__(self, commands):
+        self.commands = commands
+        self.letters = iter("etaoinshrdlcumwfgypbvkjxqz")
+
+    def send_all(self, players, data):
+        pass
+
+    def send(self, player, data):
+        if player.nickname != "Nickname1":
+            return
+        if b"type the guessword" in data:
+            self.commands.put((player, "network"))
+        elif b"your turn" in data:
+            self.commands.put((player, next(self.letters)))
+
+
+def play_journaled(tmp_path, seed):
+    """Play a journaled game with a player and a bot, like a game host does."""
+    writer = NetHang.journal.JournalWriter(str(tmp_path))
+    journal = writer.open("room")
+    journal.record(START, "room", "NetHang.examples.hangman.Game", seed)
+    journal.record(JOIN, "Nickname1", 0, 0)
+
+    players = NetHang.players.PlayerList()
+    players.add_player(NetHang.players.Player(None, "Nickname1", score=0))
+    commands = NetHang.commands.CommandQueue("drop", journal=journal)
+    players.outbox = ScriptedOutbox(commands)
+    game = hangman.Game(players, commands)
+    game.rng.seed(seed)
+    game.run()
+
+    scores = [field for p in players for field in (p.nickname, p.score)]
+    journal.record(END, *scores)
+    journal.close()
+    writer.close()
+    return str(tmp_path / "room.nhj"), players.scoreboard()
+
+
+def use_wordlist(tmp_path, monkeypatch, words):
+    """Play on a word list of the test, compiled next to it."""
+    (tmp_path / "words.txt").write_text(words)
+    monkeypatch.setitem(hangman.GAME_DATA, "wordlist", str(tmp_path / "words.txt"))
+    monkeypatch.setitem(
+        hangman.GAME_DATA, "wordlist_index", str(tmp_path / "words.idx")
+    )
+
+
+def test_replay_matches_game(tmp_path, monkeypatch):
+    """Does a replay play the recorded game again, bots and chance included?"""
+    use_wordlist(tmp_path, monkeypatch, "network\nhangman\nserver\n")
+    monkeypatch.setitem(hangman.GAME_DATA, "fill_bots", 2)
+    monkeypatch.setitem(hangman.GAME_DATA, "bot_delay", 0)
+    monkeypatch.setitem(hangman.GAME_DATA, "rounds", 2)
+    path, scores = play_journaled(tmp_path, 7)
+    kinds = [kind for kind, _, _ in NetHang.journal.read_journal(path)]
+    assert kinds.count(ROUND) == 2 and SCORE in kinds and kinds.count(JOIN) == 2
+
+    result = NetHang.journal.replay(path)
+    assert result.divergence is None
+    assert result.rounds == 2
+    assert result.scores == scores == result.expected_scores
+
+
+def test_replay_divergence(tmp_path, monkeypatch):
+    """Is a journal replayed by a different game reported as diverging?"""
+    use_wordlist(tmp_path, monkeypatch, "network\nhangman\nserver\n")
+    monkeypatch.setitem(hangman.GAME_DATA, "fill_bots", 2)
+    monkeypatch.setitem(hangman.GAME_DATA, "bot_delay", 0)
+    monkeypatch.setitem(hangman.GAME_DATA, "rounds", 2)
+    path, _ = play_journaled(tmp_path, 7)
+
+    result = NetHang.journal.replay(path, hangman.WordlistGame)
+    assert result.divergence is not None
@@ -0,0 +1,33 @@
+"""Tests for the loadtest.py module."""
+
+import os
+
+import pytest
+
+import NetHang.loadtest
+
+
+def test_percentiles():
+    """Are nearest-rank percentiles picked from the samples?"""
+    stats = NetHang.loadtest.percentiles([i / 100 for i in range(100, 0, -1)])
+    assert stats == {"count": 100, "p50": 0.5, "p99": 0.99, "max": 1.0}
+    assert NetHang.loadtest.percentiles([]) is None
+
+
+def test_localhost_only():
+    """Are load tests refused for hosts not on this machine?"""
+    assert NetHang.loadtest.is_local("localhost")
+    assert NetHang.loadtest.is_local("127.0.0.2")
+    assert NetHang.loadtest.is_local("::1")
+    assert not NetHang.loadtest.is_local("192.168.1.1")
+    assert not NetHang.loadtest.is_local("example.com")
+    with pytest.raises(ValueError):
+        NetHang.loadtest.LoadTest(host="10.0.0.1")
+
+
+def test_process_tree_usage():
+    """Is the CPU time and RSS of this process read?"""
+    usage = NetHang.loadtest.process_tree_usage(os.getpid())
+    if usage is not None:
+        assert usage[0] > 0
+        assert usage[1] > 0
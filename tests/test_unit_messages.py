@@ -0,0 +1,28 @@
+"""Tests for the messages.py module."""
+
+import NetHang.messages
+
+
+def test_template_render():
+    """Are string and bytes fields spliced between the encoded constants?"""
+    template = NetHang.messages.Template("<{nickname}> {text}!")
+    assert template.render(nickname="Nick", text=b"hi") == b"<Nick> hi!"
+    assert NetHang.messages.IN_ROOM.render(room="red") == (
+        b"You are in room \x1B[01;36mred\x1B[0m.\n"
+    )
+
+
+def test_chat_line():
+    """Is every line of a chat message prefixed by the nickname?"""
+    prefix = b"\x1B[90m<Nick>:\x1B[0m "
+    assert NetHang.messages.chat_line("Nick", b"one\ntwo\xe8") == (
+        prefix + b"one\n" + prefix + b"two\xe8\n"
+    )
+
+
+def test_cached_encodings():
+    """Are constant strings and countdowns encoded once?"""
+    assert NetHang.messages.encoded("Hangman") is NetHang.messages.encoded("Hangman")
+    assert NetHang.messages.countdown(60) is NetHang.messages.countdown(60)
+    assert b"Starting in 1 minute." in NetHang.messages.countdown(60)
+    assert NetHang.messages.server_notice("-", "Nick") == b"-Nick"
@@ -0,0 +1,80 @@
+"""Tests for the metrics.py module."""
+
+import socket as so
+import urllib.request
+from multiprocessing import Process, Value
+
+import pytest
+
+import NetHang.metrics
+
+
+def test_registry_render():
+    """Are counters, labeled gauges and histograms rendered for Prometheus?"""
+    registry = NetHang.metrics.Registry()
+    counter = registry.counter("test_total", "A counter.")
+    gauges = [registry.gauge("test_depth", "A gauge.", host=str(i)) for i in range(2)]
+    histogram = registry.histogram("test_seconds", "A histogram.", (0.1, 1))
+    counter.inc()
+    counter.inc(2)
+    gauges[1].set(0.5)
+    for value in [0.05, 0.5, 5]:
+        histogram.observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP test_total A counter.",
+        "# TYPE test_total counter",
+        "test_total 3",
+        "# HELP test_depth A gauge.",
+        "# TYPE test_depth gauge",
+        'test_depth{host="0"} 0',
+        'test_depth{host="1"} 0.5',
+        "# HELP test_seconds A histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_sum 5.55",
+        "test_seconds_count 3",
+    ]
+
+
+def test_registry_shared_with_processes():
+    """Are values written by a child process seen by the parent?"""
+    registry = NetHang.metrics.Registry()
+    counter = registry.counter("test_total", "A counter.")
+    process = Process(target=counter.inc, args=(5,))
+    process.start()
+    process.join()
+    assert counter.get() == 5
+
+
+def test_registry_kind_conflict():
+    """Is a name refused for a second kind of metric?"""
+    registry = NetHang.metrics.Registry()
+    registry.counter("test_total", "A counter.")
+    with pytest.raises(ValueError):
+        registry.gauge("test_total", "A gauge.")
+
+
+def test_metrics_server_stops_on_signal():
+    """Are scrapes served until the stop signal, without polling in between?"""
+    registry = NetHang.metrics.Registry()
+    registry.counter("test_total", "A counter.").inc(3)
+    server = NetHang.metrics.MetricsServer(registry)
+    running = Value("B", 1)
+    stopping, stop_signal = so.socketpair()
+    process = Process(target=server.serve_while, args=(running, stopping))
+    process.start()
+
+    url = "http://127.0.0.1:" + str(server.server_port) + "/metrics"
+    with urllib.request.urlopen(url, timeout=2) as response:
+        assert b"test_total 3" in response.read()
+    running.value = 0
+    stop_signal.send(b"!")
+    process.join(2)
+    assert not process.is_alive()
+
+    server.server_close()
+    stopping.close()
+    stop_signal.close()
@@ -109,3 +109,69 @@ def test_player_list_scoreboard():
 
     scoreboard = player_list.scoreboard()
     assert scoreboard == {"Nickname1": 100, "Nickname2": 200, "Nickname3": 300}
+
+
+def test_player_slots():
+    """Is Player compact, without a per-instance dict?"""
+    player = NetHang.players.Player(so.socket(), "TestNickname")
+    assert not hasattr(player, "__dict__")
+
+
+def test_player_list_indexes():
+    """Are players found by socket and address, and forgotten after dropping?"""
+    player_list = NetHang.players.PlayerList()
+    player1 = NetHang.players.Player("Socket1", "Nickname1", address="10.0.0.1")
+    player2 = NetHang.players.Player("Socket2", "Nickname2", address="10.0.0.1")
+
+    player_list.add_player(player1)
+    player_list.add_player(player2)
+    assert player_list.is_player(socket="Socket2")
+    assert player_list.is_player(address="10.0.0.1")
+
+    player_list.drop_player(socket="Socket1")
+    assert player_list.get_player(socket="Socket1") is None
+    assert player_list.is_player(address="10.0.0.1")
+
+    player_list.drop_player(nickname="Nickname2")
+    assert not player_list.is_player(address="10.0.0.1")
+    assert player_list.count() == 0
+
+
+def test_player_list_order():
+    """Is joining order kept for iteration, also after a player leaves?"""
+    player_list = NetHang.players.PlayerList()
+    for i in range(5):
+        player_list.add_player(
+            NetHang.players.Player("Socket" + str(i), "Nickname" + str(i))
+        )
+    player_list.drop_player(nickname="Nickname2")
+    assert [player.nickname for player in player_list] == [
+        "Nickname0",
+        "Nickname1",
+        "Nickname3",
+        "Nickname4",
+    ]
+    assert player_list.get_nicknames() == [
+        player.nickname for player in player_list.player_list
+    ]
+
+
+def test_player_list_copy_on_write():
+    """Are copies independent, while still sharing the Player instances?"""
+    player_list = NetHang.players.PlayerList()
+    player1 = NetHang.players.Player("Socket1", "Nickname1")
+    player2 = NetHang.players.Player("Socket2", "Nickname2")
+    player_list.add_player(player1)
+    player_list.add_player(player2)
+
+    copied = player_list.copy()
+    copied.drop_player(nickname="Nickname1")
+    assert player_list.count() == 2
+    assert copied.count() == 1
+
+    player_list.add_player(NetHang.players.Player("Socket3", "Nickname3"))
+    assert copied.count() == 1
+    assert not copied.is_player(socket="Socket3")
+
+    copied.get_player(nickname="Nickname2").score = 50
+    assert player_list.scoreboard()["Nickname2"] == 50
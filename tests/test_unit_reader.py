@@ -0,0 +1,68 @@
+"""Tests for the reader.py module."""
+
+import socket as so
+
+import NetHang
+
+
+def test_reader_pipelined_lines():
+    """Are lines received together taken separately, in order, with CRLF or LF?"""
+    reader = NetHang.reader.LineReader()
+    first, second = so.socketpair()
+    first.send(b"one\ntwo\r\n\nthree")
+    assert reader.fill(second) == 15
+    assert reader.lines() == [b"one", b"two", b""]
+    assert reader.pending() == b"three"
+
+    first.send(b"\n")
+    reader.fill(second)
+    assert reader.lines() == [b"three"]
+    assert len(reader) == 0
+
+    first.close()
+    assert reader.fill(second) == 0
+    second.close()
+
+
+def test_reader_split_line():
+    """Is a line split over many receives taken once complete?"""
+    reader = NetHang.reader.LineReader()
+    for part in (b"ha", b"ng", b"man\r", b"\n"):
+        assert reader.lines() == []
+        reader.feed(part)
+    assert reader.lines() == [b"hangman"]
+
+
+def test_reader_long_lines_cut():
+    """Are lines longer than the maximum cut, dropping the rest until their end?"""
+    reader = NetHang.reader.LineReader(max_line=4)
+    reader.feed(b"abcdefgh")
+    assert reader.read_line() == b"abcd"
+    reader.feed(b"ijkl\nmn\nabcd\n")
+    assert reader.lines() == [b"mn", b"abcd"]
+    assert reader.pending() == b""
+
+    reader.feed(b"toolong\n")
+    assert reader.read_line(max_line=2) == b"to"
+    assert reader.read_line() is None
+
+
+def test_reader_wraps_around():
+    """Does the preallocated buffer get reused over many lines?"""
+    reader = NetHang.reader.LineReader(max_line=8, capacity=32)
+    first, second = so.socketpair()
+    received = []
+    # A line is always left incomplete, so the buffer gets compacted
+    first.send(b"x")
+    for number in range(100):
+        first.send(b"line%d\nx" % number)
+        reader.fill(second)
+        received.extend(reader.lines())
+    assert received == [b"xline%d" % number for number in range(100)]
+    # Receives are limited to the free memory, input can be left in the socket
+    while not reader.pending():
+        reader.fill(second)
+    assert reader.pending() == b"x"
+    assert len(reader.buffer) == 32
+    first.close()
+    second.close()
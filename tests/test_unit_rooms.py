@@ -0,0 +1,161 @@
+"""Tests for the rooms.py module."""
+
+import socket as so
+from threading import Thread
+
+import NetHang
+
+
+def test_parse_room_request():
+    """Is "nickname@room" split, and a plain nickname left without room?"""
+    assert NetHang.rooms.parse_room_request("Nickname@red") == ("Nickname", "red")
+    assert NetHang.rooms.parse_room_request("Nickname") == ("Nickname", None)
+    assert NetHang.rooms.is_room_name("red")
+    assert not NetHang.rooms.is_room_name("")
+    assert not NetHang.rooms.is_room_name("red room")
+
+
+def test_single_shared_room():
+    """Does everyone share the lobby room without a room size?"""
+    rooms = NetHang.rooms.RoomList()
+    for i in range(5):
+        room = rooms.place(NetHang.players.Player("Socket" + str(i), "Nick" + str(i)))
+    assert room.name == "lobby"
+    assert rooms.count() == 1
+    assert room.players.count() == 5
+
+
+def test_room_size_assignment():
+    """Are players spread over rooms by room size, and by request?"""
+    rooms = NetHang.rooms.RoomList(room_size=2)
+    names = [
+        rooms.place(NetHang.players.Player("Socket" + str(i), "Nick" + str(i))).name
+        for i in range(5)
+    ]
+    assert names == ["room1", "room1", "room2", "room2", "room3"]
+
+    player = NetHang.players.Player("Socket5", "Nick5")
+    assert rooms.place(player, "red").name == "red"
+    assert player.room == "red"
+
+
+def test_room_leave_and_game_end():
+    """Are idle empty rooms removed, and scores kept after a game?"""
+    rooms = NetHang.rooms.RoomList(lobby_time=30)
+    player1 = NetHang.players.Player("Socket1", "Nick1")
+    player2 = NetHang.players.Player("Socket2", "Nick2")
+    room = rooms.place(player1)
+    rooms.place(player2)
+
+    # A running game keeps the room, even without players
+    room.host = "host"
+    rooms.leave(player1)
+    rooms.leave(player2)
+    assert rooms.get_room("lobby") is room
+
+    rooms.place(player2)
+    assert rooms.game_ended("lobby", {"Nick1": 10, "Nick2": 20}) is room
+    assert not room.is_playing()
+    assert player2.score == 20
+
+    rooms.leave(player2)
+    assert rooms.count() == 0
+
+
+class RecordingOutbox:
+    def __init__(self):
+        self.sent = []
+
+    def send_all(self, players, data):
+        self.sent.append(data)
+
+
+def test_room_countdown():
+    """Is the lobby countdown announced on the timers, then the game started?"""
+    now = [0.0]
+    started = []
+    outbox = RecordingOutbox()
+    timers = NetHang.timers.Timers(clock=lambda: now[0])
+    rooms = NetHang.rooms.RoomList(
+        outbox, lobby_time=10, timers=timers, on_start=started.append
+    )
+    room = rooms.place(NetHang.players.Player("Socket1", "Nick1"))
+    assert room.starts_at == 10
+    # Announcements at 10, 5, 4, 3, 2 and 1 seconds, then the start
+    assert len(timers) == 7
+
+    now[0] = 9.5
+    assert timers.run_due() == 6
+    assert b"Starting in 10 seconds" in outbox.sent[0]
+    assert not started
+    now[0] = 10
+    assert timers.run_due() == 1
+    assert started == [room]
+    assert room.starts_at is None
+
+    # A new countdown after the game, cancelled when the room empties
+    room.host = "host"
+    player = room.players.get_player(nickname="Nick1")
+    rooms.game_ended("lobby", {})
+    assert room.starts_at == 20
+    rooms.leave(player)
+    assert rooms.count() == 0
+    assert len(timers) == 0
+
+
+def test_room_spectators():
+    """Do spectators only watch rooms that exist, and get told when they close?"""
+    outbox = NetHang.writer.Outbox()
+    closed = []
+    rooms = NetHang.rooms.RoomList(outbox, on_close=closed.append)
+    player = NetHang.players.Player("Socket1", "Nick1")
+    room = rooms.place(player, "red")
+
+    sender, receiver = so.socketpair()
+    sender.setblocking(False)
+    spectator = NetHang.spectators.Spectator(sender, room="red")
+    assert rooms.watch(spectator) is room
+    assert rooms.watch(NetHang.spectators.Spectator(None, room="blue")) is None
+    rooms.route_frame("red", None, b"Frame")
+    assert receiver.recv(16) == b"Frame"
+    # Spectators don't keep a room, nor count as its players
+    rooms.leave(player)
+    assert closed == [room]
+    assert rooms.count() == 0
+
+
+class FloodGame:
+    """Game answering every line with a lot of output, until an "end" line."""
+
+    def __init__(self, players, commands_queue):
+        self.players = players
+        self.commands_queue = commands_queue
+
+    def run(self):
+        while self.commands_queue.get()[1] != "end":
+            self.players.outbox.send_all(self.players, b"x" * 65536)
+
+
+def test_game_host_reads_while_output_blocks():
+    """Does a host keep reading commands while its games wait on a full pipe?"""
+    hosts = NetHang.rooms.GameHostPool(FloodGame, size=1)
+    room = NetHang.rooms.Room("red")
+    room.players.add_player(NetHang.players.Player(None, "Nickname1"))
+    hosts.start_game(room)
+
+    def flood():
+        for _ in range(200):
+            hosts.send_command(room, "Nickname1", b"y" * 4096)
+        hosts.send_command(room, "Nickname1", b"end")
+
+    sender = Thread(target=flood, daemon=True)
+    sender.start()
+    sender.join(10)
+    try:
+        assert not sender.is_alive()
+        ended = []
+        while not ended:
+            ended = hosts.handle(room.host, NetHang.rooms.RoomList())
+            room.host.connection.poll(1)
+    finally:
+        hosts.close()
@@ -0,0 +1,71 @@
+"""Tests for the roster.py module."""
+
+from multiprocessing import Process, Value
+
+import NetHang
+
+
+def test_roster_add_and_lookup():
+    """Are nicknames, addresses and rejoin codes indexed after adding?"""
+    roster = NetHang.roster.SharedRoster()
+    assert roster.add("Nickname1", "127.0.0.1", "0042")
+    assert roster.count() == 1
+    assert roster.is_nickname("Nickname1")
+    assert roster.is_address("127.0.0.1")
+    assert roster.get_rejoin_code("Nickname1") == "0042"
+    assert not roster.is_nickname("Nickname2")
+    assert roster.get_rejoin_code("Nickname2") is None
+
+
+def test_roster_duplicate_nickname():
+    """Is a taken nickname refused?"""
+    roster = NetHang.roster.SharedRoster()
+    assert roster.add("Nickname1", "127.0.0.1", "0042")
+    assert not roster.add("Nickname1", "127.0.0.2", "0043")
+    assert roster.get_rejoin_code("Nickname1") == "0042"
+
+
+def test_roster_remove_shared_address():
+    """Does an address stay indexed until its last player leaves?"""
+    roster = NetHang.roster.SharedRoster()
+    roster.add("Nickname1", "127.0.0.1", "0001")
+    roster.add("Nickname2", "127.0.0.1", "0002")
+
+    roster.remove("Nickname1")
+    assert not roster.is_nickname("Nickname1")
+    assert roster.is_address("127.0.0.1")
+
+    roster.remove("Nickname2")
+    assert roster.count() == 0
+    assert not roster.is_address("127.0.0.1")
+
+
+def test_roster_full_and_churn():
+    """Is a full roster refusing players, and does churn keep it usable?"""
+    roster = NetHang.roster.SharedRoster(4)
+    for i in range(4):
+        assert roster.add("Nickname" + str(i), "10.0.0." + str(i), "0000")
+    assert not roster.add("Nickname4", "10.0.0.4", "0000")
+
+    for i in range(100):
+        roster.remove("Nickname" + str(i % 4))
+        assert roster.add("Nickname" + str(i % 4), "10.0.0.9", str(i).zfill(4))
+    assert roster.count() == 4
+    assert roster.get_rejoin_code("Nickname3") == "0099"
+
+
+def test_roster_shared_between_processes():
+    """Can another process see players added after it started?"""
+    roster = NetHang.roster.SharedRoster()
+    found = Value("B", 0)
+
+    def worker():
+        while not roster.is_nickname("Latecomer"):
+            pass
+        found.value = 1
+
+    process = Process(target=worker)
+    process.start()
+    roster.add("Latecomer", "127.0.0.1", "1234")
+    process.join(5)
+    assert found.value == 1
@@ -0,0 +1,90 @@
+"""Tests for the screen.py module."""
+
+import NetHang
+
+
+class RecordingOutbox:
+    def __init__(self):
+        self.sent = {}
+
+    def send_all(self, players, data):
+        for player in players:
+            self.send(player, data)
+
+    def send(self, player, data):
+        self.sent[player.nickname] = self.sent.get(player.nickname, b"") + data
+
+
+def make_players(*nicknames):
+    players = NetHang.players.PlayerList()
+    players.outbox = RecordingOutbox()
+    for nickname in nicknames:
+        players.add_player(NetHang.players.Player(None, nickname))
+    return players
+
+
+def test_visible_width():
+    """Are escape sequences left out of the line width?"""
+    assert NetHang.screen.visible_width("\x1B[01;36mSCORE\x1B[0m") == 5
+
+
+def test_screen_sends_changed_lines():
+    """Is the first frame sent whole, and the next one as changed lines?"""
+    players = make_players("Nick1", "Nick2")
+    screen = NetHang.screen.Screen(clear="<clear>")
+    screen.draw(players, "a\nb\nc\n")
+    assert players.outbox.sent["Nick1"] == b"<clear>a\nb\nc\n"
+
+    players.outbox.sent.clear()
+    screen.draw(players, "a\nB\nc\n")
+    assert players.outbox.sent["Nick1"] == b"\x1B[2HB\x1B[K\x1B[4H\x1B[J"
+    assert players.outbox.sent["Nick2"] == players.outbox.sent["Nick1"]
+
+
+def test_screen_invalidate_and_redraw():
+    """Do invalidated and rejoined players get the whole frame?"""
+    players = make_players("Nick1", "Nick2")
+    screen = NetHang.screen.Screen(clear="<clear>")
+    screen.draw(players, "a\nb\n")
+    screen.invalidate("Nick2")
+
+    players.outbox.sent.clear()
+    screen.draw(players, "a\nc\n")
+    assert players.outbox.sent["Nick1"] == b"\x1B[2Hc\x1B[K\x1B[3H\x1B[J"
+    assert players.outbox.sent["Nick2"] == b"<clear>a\nc\n"
+
+    players.outbox.sent.clear()
+    screen.redraw(players, "Nick1")
+    assert players.outbox.sent == {"Nick1": b"<clear>a\nc\n"}
+
+
+def test_screen_too_large_frames():
+    """Are frames that would scroll the terminal always sent whole?"""
+    players = make_players("Nick1")
+    screen = NetHang.screen.Screen(clear="<clear>", rows=3, columns=10)
+    screen.draw(players, "a\nb\n")
+    screen.draw(players, "a\nc\nd\n")
+    screen.draw(players, "a\n" + "x" * 10 + "\n")
+    assert players.outbox.sent["Nick1"].count(b"<clear>") == 3
+
+
+class FrameOutbox(RecordingOutbox):
+    def __init__(self):
+        super().__init__()
+        self.frames = []
+
+    def send_frame(self, changes, whole):
+        self.frames.append((changes, whole))
+
+
+def test_screen_shares_frames():
+    """Is each frame shared once for spectators, with the changes players got?"""
+    players = make_players("Nick1", "Nick2")
+    players.outbox = FrameOutbox()
+    screen = NetHang.screen.Screen(clear="<clear>")
+    screen.draw(players, "a\nb\n")
+    screen.draw(players, "a\nB\n")
+    assert players.outbox.frames == [
+        (None, b"<clear>a\nb\n"),
+        (players.outbox.sent["Nick1"][len(b"<clear>a\nb\n") :], b"<clear>a\nB\n"),
+    ]
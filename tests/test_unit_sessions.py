@@ -0,0 +1,79 @@
+"""Tests for the sessions.py module."""
+
+import sqlite3
+from multiprocessing import Process, Value
+from time import sleep, time
+
+import NetHang
+
+
+def test_sessions_survive_reload(tmp_path):
+    """Are saved sessions loaded again by a new store on the same file?"""
+    path = str(tmp_path / "sessions.db")
+    store = NetHang.sessions.SessionStore(path)
+    store.save("Nickname1", "0042", 150)
+    store.save("Nickname2", "0043", 0)
+    store.save("Nickname1", "0042", 300)
+    assert store.flush() == 2
+    assert store.flush() == 0
+    store.close()
+
+    store = NetHang.sessions.SessionStore(path)
+    assert len(store) == 2
+    session = store.get("Nickname1")
+    assert (session.rejoin_code, session.score) == ("0042", 300)
+    assert store.get_rejoin_code("Nickname2") == "0043"
+    assert store.get("Nickname3") is None
+
+
+def test_sessions_write_behind(tmp_path):
+    """Are saves written by the background thread, and the rest when closing?"""
+    path = str(tmp_path / "sessions.db")
+    store = NetHang.sessions.SessionStore(path, flush_interval=0.05)
+    store.start()
+    store.save("Nickname1", "0042", 10)
+    sleep(0.2)
+    assert NetHang.sessions.SessionStore(path).get("Nickname1").score == 10
+
+    store.save("Nickname1", "0042", 20)
+    store.close()
+    assert NetHang.sessions.SessionStore(path).get("Nickname1").score == 20
+
+
+def test_sessions_expire(tmp_path):
+    """Are sessions not seen within the ttl forgotten when loading?"""
+    path = str(tmp_path / "sessions.db")
+    store = NetHang.sessions.SessionStore(path)
+    store.save("Nickname1", "0042", 10)
+    store.save("Nickname2", "0043", 10)
+    store.close()
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "UPDATE sessions SET last_seen = ? WHERE nickname = ?",
+            (time() - 100, "Nickname1"),
+        )
+
+    store = NetHang.sessions.SessionStore(path, ttl=50)
+    assert store.get("Nickname1") is None
+    assert store.get_rejoin_code("Nickname1") is None
+    assert store.get("Nickname2") is not None
+
+
+def _wait_rejoin_code(store, found):
+    for _ in range(100):
+        if store.get_rejoin_code("Nickname1") == "0042":
+            found.value = 1
+            return
+        sleep(0.02)
+
+
+def test_sessions_index_shared(tmp_path):
+    """Can a forked process look up rejoin codes saved after it started?"""
+    store = NetHang.sessions.SessionStore(str(tmp_path / "sessions.db"))
+    found = Value("B", 0)
+    process = Process(target=_wait_rejoin_code, args=(store, found))
+    process.start()
+    sleep(0.05)
+    store.save("Nickname1", "0042", 0)
+    process.join()
+    assert found.value
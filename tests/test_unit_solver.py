@@ -0,0 +1,70 @@
+"""Tests for the solver.py module."""
+
+import os
+import random
+
+import pytest
+
+import NetHang.wordlist as wordlist
+from NetHang.solver import FREQUENCY_ORDER, Solver
+
+WORDS = ["bat", "cat", "hat", "mat", "rat", "cot", "cut", "dog", "fog", "log"]
+
+
+def play(solver, word):
+    """Guess a word with the solver until found, get the guesses made."""
+    known, tried, guesses = [None] * len(word), [], []
+    while None in known:
+        guess = solver.guess(known, tried)
+        guesses.append(guess)
+        if len(guess) > 1:
+            assert guess == word
+            break
+        tried.append(guess)
+        known = [c if c in tried else None for c in word]
+    return guesses
+
+
+def test_solver_finds_words(tmp_path):
+    """Does the solver find every word, without guessing a letter twice?"""
+    path = str(tmp_path / "words.idx")
+    wordlist.compile_words(WORDS, path)
+    dictionary = wordlist.Dictionary(path)
+    for word in WORDS:
+        guesses = play(Solver(dictionary, 3, use_numpy=False), word)
+        assert len(guesses) == len(set(guesses)) <= 6
+    dictionary.close()
+
+
+def test_solver_without_candidates(tmp_path):
+    """Are letters guessed by frequency for words the dictionary doesn't have?"""
+    path = str(tmp_path / "words.idx")
+    wordlist.compile_words(WORDS, path)
+    dictionary = wordlist.Dictionary(path)
+    solver = Solver(dictionary, 5, use_numpy=False)
+    assert solver.guess([None] * 5, []) == FREQUENCY_ORDER[0]
+    assert solver.guess([None, "-", None], ["e"]) == FREQUENCY_ORDER[1]
+
+    # A wrong whole word guess is not made again
+    solver = Solver(dictionary, 3, use_numpy=False)
+    assert solver.guess([None, "o", "g"], ["o", "g", "d", "f"]) == "log"
+    assert len(solver.guess([None, "o", "g"], ["o", "g", "d", "f"])) == 1
+    dictionary.close()
+
+
+def test_numpy_solver_agrees(tmp_path):
+    """Does the NumPy solver make the same guesses as the plain Python one?"""
+    pytest.importorskip("numpy")
+    source = os.path.join(os.path.dirname(wordlist.__file__), "examples", "words.txt")
+    path = str(tmp_path / "words.idx")
+    wordlist.compile_wordlist(source, path)
+    # One dictionary each, the opening guesses cached for one aren't the other's
+    vectorized, plain = wordlist.Dictionary(path), wordlist.Dictionary(path)
+    words = [plain.word(number) for number in range(len(plain))]
+    assert Solver(vectorized, 3).use_numpy
+    for word in random.Random(0).sample(words, min(200, len(words))):
+        assert play(Solver(vectorized, len(word)), word) == play(
+            Solver(plain, len(word), use_numpy=False), word
+        )
+    vectorized.close()
+    plain.close()
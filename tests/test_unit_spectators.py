@@ -0,0 +1,39 @@
+"""Tests for the spectators.py module."""
+
+import socket as so
+
+import NetHang
+
+
+def new_spectator(spectators, outbox):
+    sender, receiver = so.socketpair()
+    sender.setblocking(False)
+    receiver.setblocking(False)
+    spectators.add(sender, outbox)
+    return receiver
+
+
+def test_spectators_share_frames():
+    """Do spectators get each frame once, whole when new and as changes after?"""
+    outbox = NetHang.writer.Outbox()
+    spectators = NetHang.spectators.Spectators()
+    first = new_spectator(spectators, outbox)
+    spectators.frame(outbox, None, b"<clear>a\nb\n")
+    assert first.recv(64) == b"<clear>a\nb\n"
+
+    # A new spectator gets the last frame whole, then both get the changes
+    second = new_spectator(spectators, outbox)
+    assert second.recv(64) == b"<clear>a\nb\n"
+    spectators.frame(outbox, b"<b to c>", b"<clear>a\nc\n")
+    assert first.recv(64) == second.recv(64) == b"<b to c>"
+
+    # Frames that can't be sent as changes go whole to everyone
+    spectators.frame(outbox, None, b"<clear>d\n")
+    assert first.recv(64) == second.recv(64) == b"<clear>d\n"
+
+    spectators.reset()
+    spectators.discard(spectators.sockets.copy().pop())
+    third = new_spectator(spectators, outbox)
+    spectators.frame(outbox, b"<changes>", b"<clear>e\n")
+    assert third.recv(64) == b"<clear>e\n"
+    assert len(spectators) == 2
@@ -0,0 +1,76 @@
+"""Tests for the timers.py module."""
+
+from threading import Thread
+
+import NetHang
+
+
+def test_timers_run_in_deadline_order():
+    """Are due callbacks run by deadline, and later ones kept?"""
+    now = [0.0]
+    ran = []
+    timers = NetHang.timers.Timers(clock=lambda: now[0])
+    for when in [3, 1, 2, 1, 5]:
+        timers.call_at(when, ran.append, when)
+    assert timers.next_deadline() == 1
+    assert timers.timeout() == 1
+
+    now[0] = 3
+    assert timers.run_due() == 4
+    assert ran == [1, 1, 2, 3]
+    assert timers.timeout(1) == 1
+    assert len(timers) == 1
+
+
+def test_timers_cancel():
+    """Are cancelled callbacks skipped, and dropped from the heap?"""
+    now = [0.0]
+    ran = []
+    timers = NetHang.timers.Timers(clock=lambda: now[0])
+    handles = [timers.call_later(i, ran.append, i) for i in range(1000)]
+    for handle in handles[:-1]:
+        handle.cancel()
+    assert len(timers) == 1
+    assert len(timers._heap) < 1000
+    assert timers.next_deadline() == 999
+
+    now[0] = 1000
+    assert timers.run_due() == 1
+    assert ran == [999]
+    assert timers.next_deadline() is None
+    assert timers.timeout() is None
+
+
+def test_timers_cancel_racing():
+    """Is each timer counted once, cancelled by many threads while others run?"""
+    now = [0.0]
+    timers = NetHang.timers.Timers(clock=lambda: now[0])
+    handles = [timers.call_at(i % 100, print) for i in range(10000)]
+    threads = [
+        Thread(target=lambda: [handle.cancel() for handle in handles[1::2]])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    now[0] = 49.5
+    timers.run_due()
+    for thread in threads:
+        thread.join()
+
+    cancelled = sum(entry[2].cancelled for entry in timers._heap)
+    assert timers._cancelled_count == cancelled
+    # Only the timers never cancelled and not due yet are left
+    assert len(timers) == 2500
+    for handle in handles:
+        handle.cancel()
+    assert len(timers) == 0 and timers.next_deadline() is None
+
+
+def test_timers_on_change():
+    """Is on_change called only when the earliest deadline moves closer?"""
+    changes = []
+    timers = NetHang.timers.Timers(on_change=lambda: changes.append(1))
+    timers.call_later(10, print)
+    timers.call_later(20, print)
+    timers.call_later(5, print)
+    assert len(changes) == 2
@@ -0,0 +1,51 @@
+"""Tests for the upgrade.py module."""
+
+import socket as so
+
+import pytest
+
+import NetHang
+
+
+def test_upgrade_passes_sockets(tmp_path):
+    """Do sockets reach the new server with their fields, until the old one is done?"""
+    path = str(tmp_path / "upgrade")
+    upgrades = NetHang.upgrade.UpgradeListener(path)
+    assert upgrades.accept() is None
+    predecessor = NetHang.upgrade.connect(path)
+    successor = upgrades.accept()
+    upgrades.close()
+
+    local, remote = so.socketpair()
+    successor.send(remote, nickname="Nickname1", score=3)
+    assert remote.fileno() == -1
+    successor.close()
+
+    client_socket, fields = predecessor.receive()
+    assert fields == {"nickname": "Nickname1", "score": 3}
+    client_socket.send(b"hello\n")
+    assert local.recv(16) == b"hello\n"
+    with pytest.raises(EOFError):
+        predecessor.receive()
+
+    client_socket.close()
+    local.close()
+    predecessor.close()
+
+
+def test_upgrade_listener_path(tmp_path):
+    """Is the path free once taken over, and a stale socket there replaced?"""
+    path = str(tmp_path / "upgrade")
+    assert NetHang.upgrade.connect(path) is None
+    upgrades = NetHang.upgrade.UpgradeListener(path)
+    upgrades.close()
+    assert NetHang.upgrade.connect(path) is None
+
+    stale = so.socket(so.AF_UNIX, so.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    upgrades = NetHang.upgrade.UpgradeListener(path)
+    predecessor = NetHang.upgrade.connect(path)
+    assert predecessor is not None
+    predecessor.close()
+    upgrades.close()
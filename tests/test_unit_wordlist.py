@@ -0,0 +1,104 @@
+"""Tests for the wordlist.py module."""
+
+import os
+import random
+import tempfile
+
+import pytest
+
+import NetHang.wordlist as wordlist
+
+WORDS = ["Banana", "apple", "cherry", "kiwi", "apple", "x-ray", "a", "plum", "lemon"]
+
+
+def test_dictionary_lookup(tmp_path):
+    """Are words normalized, deduplicated and found, and the rest refused?"""
+    path = str(tmp_path / "words.idx")
+    assert wordlist.compile_words(WORDS, path) == 6
+    dictionary = wordlist.Dictionary(path)
+    assert len(dictionary) == 6
+    for word in ("banana", "APPLE", "cherry", "kiwi", "plum", "lemon"):
+        assert word in dictionary
+    for word in ("x-ray", "a", "pear", "appl", "apples", ""):
+        assert word not in dictionary
+    dictionary.close()
+
+
+def test_dictionary_random_word(tmp_path):
+    """Are random words picked in the range of lengths asked for?"""
+    path = str(tmp_path / "words.idx")
+    wordlist.compile_words(WORDS, path)
+    dictionary = wordlist.Dictionary(path)
+    rng = random.Random(7)
+    picked = {dictionary.random_word(5, 5, rng) for _ in range(200)}
+    assert picked == {"apple", "lemon"}
+    assert {dictionary.random_word(rng=rng) for _ in range(500)} == {
+        "banana",
+        "apple",
+        "cherry",
+        "kiwi",
+        "plum",
+        "lemon",
+    }
+    assert dictionary.random_word(7, 12) is None
+    assert dictionary.random_word(9, 3) is None
+    dictionary.close()
+
+
+def test_dictionary_signature_buckets(tmp_path):
+    """Are words of a length filtered by the letters they have and lack?"""
+    path = str(tmp_path / "words.idx")
+    wordlist.compile_words(WORDS + ["melon", "lemur", "apply"], path)
+    dictionary = wordlist.Dictionary(path)
+    five_letters = ("apple", "lemon", "melon", "lemur", "apply")
+    assert [mask for mask, _ in dictionary.buckets(5)] == sorted(
+        {wordlist.signature(word) for word in five_letters}
+    )
+    assert sorted(dictionary.words(5, include=wordlist.signature("le"))) == [
+        "apple",
+        "lemon",
+        "lemur",
+        "melon",
+    ]
+    assert sorted(
+        dictionary.words(5, wordlist.signature("le"), wordlist.signature("n"))
+    ) == ["apple", "lemur"]
+    assert list(dictionary.words(90)) == []
+    dictionary.close()
+
+
+def test_open_dictionary_compiles(tmp_path, monkeypatch):
+    """Is the index compiled in the temporary directory, and again once outdated?"""
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "cache"))
+    (tmp_path / "cache").mkdir()
+    source = tmp_path / "words.txt"
+    source.write_text("apple\nlemon\n")
+    dictionary = wordlist.open_dictionary(str(source))
+    index_path = wordlist.index_path_for(str(source))
+    assert os.path.dirname(index_path) == str(tmp_path / "cache")
+    assert os.path.exists(index_path)
+    # Nothing is written next to the word list
+    assert sorted(os.listdir(str(tmp_path))) == ["cache", "words.txt"]
+    assert len(dictionary) == 2
+
+    source.write_text("apple\nlemon\nmelon\n")
+    os.utime(index_path, (0, 0))
+    wordlist.open_dictionary.cache_clear()
+    assert "melon" in wordlist.open_dictionary(str(source))
+
+    (tmp_path / "broken.idx").write_bytes(b"NHWL")
+    with pytest.raises(ValueError):
+        wordlist.Dictionary(str(tmp_path / "broken.idx"))
+
+
+def test_dictionary_block(tmp_path):
+    """Are the words of a length stored back to back, in word order?"""
+    path = str(tmp_path / "words.idx")
+    wordlist.compile_words(WORDS, path)
+    dictionary = wordlist.Dictionary(path)
+    numbers = dictionary.lengths(5, 5)
+    block = dictionary.block(5)
+    assert bytes(block) == "".join(map(dictionary.word, numbers)).encode("ascii")
+    assert len(dictionary.block(7)) == 0
+    block.release()
+    dictionary.close()
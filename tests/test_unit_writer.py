@@ -0,0 +1,102 @@
+"""Tests for the writer.py module."""
+
+import socket as so
+from multiprocessing import Pipe
+
+import pytest
+
+import NetHang
+
+
+def stalled_pair():
+    """Socket pair with small buffers, where the reading side never reads."""
+    sender, receiver = so.socketpair()
+    sender.setsockopt(so.SOL_SOCKET, so.SO_SNDBUF, 4096)
+    receiver.setsockopt(so.SOL_SOCKET, so.SO_RCVBUF, 4096)
+    sender.setblocking(False)
+    return sender, receiver
+
+
+def test_outbox_immediate_send():
+    """Is data sent right away when the socket is writable?"""
+    sender, receiver = so.socketpair()
+    sender.setblocking(False)
+    outbox = NetHang.writer.Outbox()
+    outbox.write(sender, b"Hello\n")
+    assert outbox.pending(sender) == 0
+    assert receiver.recv(16) == b"Hello\n"
+
+
+def test_outbox_partial_send_and_flush():
+    """Is the unsent part buffered, then flushed in order when writable?"""
+    sender, receiver = stalled_pair()
+    pending = []
+    outbox = NetHang.writer.Outbox(
+        high_water=1 << 24, on_pending=pending.append, on_drained=pending.remove
+    )
+    data = bytes(range(256)) * 2048
+    outbox.write(sender, data)
+    assert pending == [sender]
+    assert outbox.pending(sender) > 0
+
+    received = b""
+    while len(received) < len(data):
+        received += receiver.recv(65536)
+        outbox.flush(sender)
+    assert received == data
+    assert not pending
+
+
+def test_outbox_high_water_eviction():
+    """Is a client that stops reading evicted, without blocking the sender?"""
+    sender, _receiver = stalled_pair()
+    evicted = []
+    outbox = NetHang.writer.Outbox(high_water=8192, on_evict=evicted.append)
+    for _ in range(1000):
+        outbox.write(sender, b"x" * 1024)
+    assert evicted == [sender]
+
+    outbox.discard(sender)
+    assert outbox.pending(sender) == 0
+
+
+def test_send_all_through_outbox():
+    """Does send_all() encode once and use the outbox of the player list?"""
+    player_list = NetHang.players.PlayerList()
+    player_list.add_player(NetHang.players.Player("Socket1", "Nickname1"))
+    player_list.add_player(NetHang.players.Player("Socket2", "Nickname2"))
+
+    reader, writer = Pipe(duplex=False)
+    player_list.outbox = NetHang.writer.PipeOutbox(writer, "lobby")
+    NetHang.players.send_all(player_list, "Hello")
+    NetHang.players.send_to(
+        player_list, player_list.get_player(nickname="Nickname2"), "Psst"
+    )
+    assert reader.recv() == ("output", "lobby", ["Nickname1", "Nickname2"], b"Hello")
+    assert reader.recv() == ("output", "lobby", ["Nickname2"], b"Psst")
+
+
+def test_outbox_fan_out():
+    """Are the same bytes written to every socket, past evicted ones?"""
+    pairs = [so.socketpair() for _ in range(3)]
+    for sender, _ in pairs:
+        sender.setblocking(False)
+    outbox = NetHang.writer.Outbox()
+    outbox.evicted.add(pairs[0][0])
+    outbox.fan_out([sender for sender, _ in pairs], b"Frame\n")
+    assert pairs[1][1].recv(16) == pairs[2][1].recv(16) == b"Frame\n"
+    pairs[0][1].setblocking(False)
+    with pytest.raises(BlockingIOError):
+        pairs[0][1].recv(16)
+
+
+def test_frames_through_pipe_outbox():
+    """Are frames forwarded once for the spectators, apart from player output?"""
+    player_list = NetHang.players.PlayerList()
+    player_list.add_player(NetHang.players.Player(None, "Nickname1"))
+    reader, writer = Pipe(duplex=False)
+    player_list.outbox = NetHang.writer.PipeOutbox(writer, "lobby")
+    NetHang.players.send_frame(player_list, None, "Frame")
+    NetHang.players.send_frame(player_list, "Change", "Frame")
+    assert reader.recv() == ("frame", "lobby", None, b"Frame")
+    assert reader.recv() == ("frame", "lobby", b"Change", b"Frame")